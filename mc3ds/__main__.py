@@ -18,16 +18,91 @@ import click
 
 from .classes import *
 from .parser import parser
-from .convert import convert
+from .convert import convert, convert_batch, DEFAULT_QUEUE_SIZE, OVERWORLD, NETHER, END
 from .nbt import NewNBT
 from .javato3ds import convert_java
+from .output import ZIP_SUFFIXES, TAR_SUFFIXES, archive_suffix
+from .shard import parse_shard
+from .stats import world_stats
+from .verify import verify_world
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    lets through at most limit records from each line of code every interval seconds,
+    so a message in a loop can't fill the log and slow everything down
+    """
+
+    def __init__(self, limit: int = 20, interval: float = 10.0) -> None:
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self._windows = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.pathname, record.lineno)
+        start, count, suppressed = self._windows.get(key, (record.created, 0, 0))
+        if record.created - start >= self.interval:
+            if suppressed:
+                record.msg = f"{record.getMessage()} ({suppressed:d} similar messages were suppressed)"
+                record.args = ()
+            start, count, suppressed = record.created, 0, 0
+        if count >= self.limit:
+            self._windows[key] = (start, count, suppressed + 1)
+            return False
+        self._windows[key] = (start, count + 1, suppressed)
+        return True
+
 
 logging.basicConfig(filename="3dschunker.log", level=logging.DEBUG)
+for handler in logging.getLogger().handlers:
+    handler.addFilter(RateLimitFilter())
 logger = logging.getLogger(__name__)
 
+DIMENSIONS = {"overworld": OVERWORLD, "nether": NETHER, "end": END}
+
+
+def parse_shard_option(
+    context: click.Context, parameter: click.Parameter, value: str | None
+) -> tuple[int, int] | None:
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+
+def make_chunk_filter(
+    dimensions: tuple[str],
+    chunk_box: tuple[int, int, int, int] | None,
+    block_box: tuple[int, int, int, int] | None,
+    radius: float | None,
+    center: tuple[int, int] | None,
+) -> ChunkFilter | None:
+    if chunk_box is not None and block_box is not None:
+        raise click.UsageError("--chunk-box and --block-box can't be used together")
+    if center is not None and radius is None:
+        raise click.UsageError("--center needs --radius")
+    if not dimensions and chunk_box is None and block_box is None and radius is None:
+        return None
+    kwargs = {
+        "dimensions": [DIMENSIONS[name] for name in dimensions] or None,
+        "radius": radius,
+        "center": center,
+    }
+    if block_box is not None:
+        return ChunkFilter.from_block_bounds(block_box, **kwargs)
+    return ChunkFilter(bounds=chunk_box, **kwargs)
+
 
 @click.command()
-@click.argument("path", type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.argument("path", type=click.Path(exists=True, path_type=Path))
+@click.option(
+    "-i",
+    "--world-id",
+    help="The world to use when PATH is a minecraftWorlds folder or a Checkpoint backup zip",
+)
 @click.option(
     "-o",
     "--out",
@@ -50,6 +125,27 @@ logger = logging.getLogger(__name__)
     flag_value="javato3ds",
     help="Convert a Java world to a 3DS world",
 )
+@click.option(
+    "-b",
+    "--batch",
+    "mode",
+    flag_value="batch",
+    help="Convert every world in a directory like minecraftWorlds, into folders in the world output folder named by world ID",
+)
+@click.option(
+    "-s",
+    "--stats",
+    "mode",
+    flag_value="stats",
+    help="Print statistics about the world as JSON instead of converting it",
+)
+@click.option(
+    "-v",
+    "--verify",
+    "mode",
+    flag_value="verify",
+    help="Check the world for corruption and list every problem instead of converting it",
+)
 @click.option(
     "-x",
     "--extract",
@@ -60,115 +156,261 @@ logger = logging.getLogger(__name__)
 @click.option(
     "-w",
     "--world-out",
-    type=click.Path(file_okay=False, path_type=Path),
-    help="Path to the Java world",
+    type=click.Path(path_type=Path),
+    help="Path to the Java world, ending it with .zip or .tar.gz writes the world into an archive",
     default=Path.cwd() / "Converted",
 )
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue an interrupted conversion, the regions it already saved are skipped",
+)
+@click.option(
+    "--shard",
+    callback=parse_shard_option,
+    metavar="I/N",
+    help="Only convert shard I of N (counting from 0), the regions are split the same way on every machine, merge the shards with 3dsmerge",
+)
+@click.option(
+    "--archive-format",
+    type=click.Choice(ZIP_SUFFIXES + TAR_SUFFIXES),
+    help="With --batch, write each world into an archive of this type",
+)
 @click.option(
     "--delete-out",
     is_flag=True,
     help="Permanently delete the output and world folders, and their contents (make sure they're the right folders!)",
 )
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    help="Number of threads and processes to convert with (default: the CPU count)",
+)
+@click.option(
+    "--queue-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_QUEUE_SIZE,
+    show_default=True,
+    help="How many chunks can wait between each stage of the conversion",
+)
+@click.option(
+    "--compression-level",
+    type=click.IntRange(0, 9),
+    help="zlib level for the region files, lower is faster but bigger (default: zlib's default)",
+)
+@click.option(
+    "-d",
+    "--dimension",
+    "dimensions",
+    type=click.Choice(tuple(DIMENSIONS)),
+    multiple=True,
+    help="Only convert this dimension, can be used more than once (default: all of them)",
+)
+@click.option(
+    "--chunk-box",
+    type=int,
+    nargs=4,
+    metavar="X1 Z1 X2 Z2",
+    help="Only convert the chunks inside these chunk coordinates",
+)
+@click.option(
+    "--block-box",
+    type=int,
+    nargs=4,
+    metavar="X1 Z1 X2 Z2",
+    help="Only convert the chunks with blocks inside these block coordinates",
+)
+@click.option(
+    "--radius",
+    type=click.FloatRange(min=0),
+    help="Only convert the chunks within this many blocks of --center",
+)
+@click.option(
+    "--center",
+    type=int,
+    nargs=2,
+    metavar="X Z",
+    help="Block coordinates for --radius (default: the world spawn)",
+)
 def main(
     path: Path,
+    world_id: str | None,
     out: Path,
     mode: str,
     world_out: Path,
     delete_out: bool = False,
+    resume: bool = False,
+    shard: tuple[int, int] | None = None,
+    archive_format: str | None = None,
+    workers: int | None = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    compression_level: int | None = None,
+    dimensions: tuple[str] = (),
+    chunk_box: tuple[int, int, int, int] | None = None,
+    block_box: tuple[int, int, int, int] | None = None,
+    radius: float | None = None,
+    center: tuple[int, int] | None = None,
 ) -> None:
     start_time = time.time()
+    chunk_filter = make_chunk_filter(dimensions, chunk_box, block_box, radius, center)
+    if resume and delete_out:
+        raise click.UsageError("--resume and --delete-out can't be used together")
+    if shard is not None and mode not in ("convert", "batch"):
+        raise click.UsageError("--shard only works when converting to Java")
+    if shard is not None and (archive_format or archive_suffix(world_out)):
+        raise click.UsageError(
+            "shards have to be written into folders, 3dsmerge can't read archives"
+        )
     with importlib.resources.path(data, "blankworld") as blank_world_path:
         blank_world = blank_world_path
-    if out.exists() and not delete_out and mode != "javato3ds":
+    if out.exists() and not delete_out and mode not in ("javato3ds", "stats", "verify"):
         logger.warning('already extracted, please move or delete the "out" folder')
         sys.exit(1)
 
-    world = World(path)
-    logger.info(f"World name: {world.name}")
-    if mode == "convert":
-        convert(world, blank_world, world_out, delete_out)
+    if mode == "batch":
+        failures = convert_batch(
+            path,
+            blank_world,
+            world_out,
+            delete_out,
+            workers=workers,
+            queue_size=queue_size,
+            compression_level=compression_level,
+            chunk_filter=chunk_filter,
+            archive_format=archive_format,
+            resume=resume,
+            shard=shard,
+        )
         total_time = time.time() - start_time
         minutes = int(total_time // 60)
         seconds = total_time % 60
-        logger.info(f"conversion time is {minutes:02d}:{seconds:05.2f}")
-    elif mode == "extract":
-        if out.exists() and delete_out:
-            if (out / "3dschunker.txt").is_file():
-                shutil.rmtree(out)
-            else:
-                raise ValueError(
-                    "out directory doesn't seem to be valid, not deleting it"
+        logger.info(f"batch conversion time is {minutes:02d}:{seconds:05.2f}")
+        if failures:
+            print(f"{len(failures):d} worlds failed to convert:", file=sys.stderr)
+            for world_path, error in failures.items():
+                print(
+                    f"{world_path} - {type(error).__name__}: {error}", file=sys.stderr
                 )
-        out.mkdir()
-        # make a blank file
-        with open(out / "3dschunker.txt", "x") as marker:
-            pass
-
-        vdb_out = out / "vdb"
-        vdb_out.mkdir()
-        for number, vdb_file in world.vdb:
-            region_path = vdb_out / f"region{number:d}"
-            region_path.mkdir()
-            for index, vdb_data in vdb_file:
-                try:
-                    base_name = vdb_data.name.decode().replace("\0", "")
-                except UnicodeDecodeError:
-                    base_name = "None"
-                filename = base_name
-                nbt_path = region_path / filename
-                n = 1
-                while nbt_path.exists():
-                    filename = f"{base_name}{n:d}"
-                    nbt_path = region_path / filename
-                    n += 1
-                nbt_metadata_path = region_path / f"{filename}.json"
-                with open(nbt_metadata_path, "x") as subfile_metadata_out:
-                    json.dump(
-                        {
-                            "unknown0": f"0x{vdb_data.unknown0:X}",
-                            "unknown1": f"0x{vdb_data.unknown1:X}",
-                            "unknown2": f"0x{vdb_data.unknown2:X}",
-                        },
-                        subfile_metadata_out,
+            sys.exit(1)
+        return
+
+    if mode == "verify":
+        # this has to happen before loading the world, which stops at the first problem
+        problems = verify_world(path, workers, world_id)
+        for problem in problems:
+            location = problem["file"]
+            if problem["subfile"] is not None:
+                location += f" subfile {problem['subfile']:d}"
+            if problem["position"] is not None:
+                location += f" {tuple(problem['position'])}"
+            print(f"{location}: {problem['problem']}")
+        if problems:
+            print(f"found {len(problems):d} problems", file=sys.stderr)
+            sys.exit(1)
+        print("no problems found", file=sys.stderr)
+        return
+
+    with World(path, chunk_filter, world_id) as world:
+        logger.info(f"World name: {world.name}")
+        for slot, fill_ratio in world.cdb.fill_ratios().items():
+            logger.debug(f"slt{slot:d}.cdb is {fill_ratio:.1%} full")
+        if mode == "convert":
+            convert(
+                world,
+                blank_world,
+                world_out,
+                delete_out,
+                workers=workers,
+                queue_size=queue_size,
+                compression_level=compression_level,
+                resume=resume,
+                shard=shard,
+            )
+            total_time = time.time() - start_time
+            minutes = int(total_time // 60)
+            seconds = total_time % 60
+            logger.info(f"conversion time is {minutes:02d}:{seconds:05.2f}")
+        elif mode == "stats":
+            json.dump(world_stats(world, workers), sys.stdout, indent=2)
+            print()
+        elif mode == "extract":
+            if out.exists() and delete_out:
+                if (out / "3dschunker.txt").is_file():
+                    shutil.rmtree(out)
+                else:
+                    raise ValueError(
+                        "out directory doesn't seem to be valid, not deleting it"
                     )
-                with open(nbt_path, "xb") as subfile_out:
-                    subfile_out.write(vdb_data.raw)
-
-        cdb_out = out / "cdb"
-        cdb_out.mkdir()
-        for number, cdb_file in world.cdb:
-            region_path = cdb_out / f"region{number:d}"
-            region_path.mkdir()
-            for index, chunk in cdb_file:
-                chunk_path = region_path / f"chunk{index:d}"
-                # chunk_path.mkdir()
-
-                for subchunk_index, subchunk in chunk:
-                    subchunk_path = chunk_path / f"data{subchunk_index:d}"
-                    if subchunk_index == 0:
-                        continue  # TODO fix this and don't just remove it
-                        block_data, unknown, biomes = subchunk.data
-                        for block_index, block in enumerate(block_data):
-                            block_path = chunk_path / f"blocks{block_index:d}"
-                            with open(block_path, "xb") as block_data_out:
-                                block_data_out.write(block)
-                        unknown_path = chunk_path / "unknown"
-                        biomes_path = chunk_path / "biomes"
-                        with open(unknown_path, "xb") as unknown_out:
-                            unknown_out.write(unknown)
-                        with open(biomes_path, "xb") as biomes_out:
-                            biomes_out.write(bytes(biomes))
-                    else:
-                        chunk_path.mkdir(exist_ok=True)
-                        new_nbt = NewNBT(subchunk.raw_decompressed)
-                        with open(subchunk_path, "x") as subchunk_out:
-                            # subchunk_out.write(subchunk.raw_decompressed)
-                            subchunk_out.write(new_nbt.nbt.pretty())
-                        # if subchunk_index >= 3:
-                        #     print(index, subchunk_index)
-            logger.debug(f"extracted region {number:d}!")
-    elif mode == "javato3ds":
-        convert_java(path, world_out, delete_out)
+            out.mkdir()
+            # make a blank file
+            with open(out / "3dschunker.txt", "x") as marker:
+                pass
+
+            vdb_out = out / "vdb"
+            vdb_out.mkdir()
+            for number, vdb_file in world.vdb:
+                region_path = vdb_out / f"region{number:d}"
+                region_path.mkdir()
+                for index, vdb_data in vdb_file:
+                    try:
+                        base_name = vdb_data.name.decode().replace("\0", "")
+                    except UnicodeDecodeError:
+                        base_name = "None"
+                    filename = base_name
+                    nbt_path = region_path / filename
+                    n = 1
+                    while nbt_path.exists():
+                        filename = f"{base_name}{n:d}"
+                        nbt_path = region_path / filename
+                        n += 1
+                    nbt_metadata_path = region_path / f"{filename}.json"
+                    with open(nbt_metadata_path, "x") as subfile_metadata_out:
+                        json.dump(
+                            {
+                                "unknown0": f"0x{vdb_data.unknown0:X}",
+                                "unknown1": f"0x{vdb_data.unknown1:X}",
+                                "unknown2": f"0x{vdb_data.unknown2:X}",
+                            },
+                            subfile_metadata_out,
+                        )
+                    with open(nbt_path, "xb") as subfile_out:
+                        subfile_out.write(vdb_data.raw)
+
+            cdb_out = out / "cdb"
+            cdb_out.mkdir()
+            for number, cdb_file in world.cdb:
+                region_path = cdb_out / f"region{number:d}"
+                region_path.mkdir()
+                for index, chunk in cdb_file:
+                    chunk_path = region_path / f"chunk{index:d}"
+                    # chunk_path.mkdir()
+
+                    for subchunk_index, subchunk in chunk:
+                        subchunk_path = chunk_path / f"data{subchunk_index:d}"
+                        if subchunk_index == 0:
+                            continue  # TODO fix this and don't just remove it
+                            block_data, unknown, biomes = subchunk.data
+                            for block_index, block in enumerate(block_data):
+                                block_path = chunk_path / f"blocks{block_index:d}"
+                                with open(block_path, "xb") as block_data_out:
+                                    block_data_out.write(block)
+                            unknown_path = chunk_path / "unknown"
+                            biomes_path = chunk_path / "biomes"
+                            with open(unknown_path, "xb") as unknown_out:
+                                unknown_out.write(unknown)
+                            with open(biomes_path, "xb") as biomes_out:
+                                biomes_out.write(bytes(biomes))
+                        else:
+                            chunk_path.mkdir(exist_ok=True)
+                            new_nbt = NewNBT(subchunk.raw_decompressed)
+                            with open(subchunk_path, "x") as subchunk_out:
+                                # subchunk_out.write(subchunk.raw_decompressed)
+                                subchunk_out.write(new_nbt.nbt.pretty())
+                            # if subchunk_index >= 3:
+                            #     print(index, subchunk_index)
+                logger.debug(f"extracted region {number:d}!")
+        elif mode == "javato3ds":
+            convert_java(world.path, world_out, delete_out, workers, compression_level)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,244 @@
+"reading worlds straight out of Checkpoint backup zips, without extracting them first"
+
+import os
+import io
+import zipfile
+import threading
+from collections import OrderedDict
+from pathlib import Path, PurePosixPath
+
+# the most decompressed member data that's kept in memory in each process
+ARCHIVE_CACHE_SIZE = 256 << 20
+
+
+class MemberCache:
+    "decompressed zip members, the least recently used ones are dropped once there's too much"
+
+    def __init__(self, max_size: int = ARCHIVE_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self._members = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, archive: Path, name: str) -> bytes:
+        key = (archive, name)
+        with self._lock:
+            try:
+                self._members.move_to_end(key)
+                return self._members[key]
+            except KeyError:
+                pass
+        # decompressing happens outside the lock, so other members can still be read
+        data = _read_member(archive, name)
+        with self._lock:
+            if key not in self._members:
+                self._members[key] = data
+                self._size += len(data)
+            # the newest member is kept even if it's bigger than the limit on its own
+            while self._size > self.max_size and len(self._members) > 1:
+                old_key, old_data = self._members.popitem(last=False)
+                self._size -= len(old_data)
+        return data
+
+
+member_cache = MemberCache()
+
+# each process opens its own ZipFile, forked processes would share the file position
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def _open_archive(archive: Path) -> tuple[zipfile.ZipFile, threading.Lock, set]:
+    key = (os.getpid(), archive)
+    with _archives_lock:
+        if key not in _archives:
+            zip_file = zipfile.ZipFile(archive)
+            names = set()
+            for name in zip_file.namelist():
+                names.add(name.rstrip("/"))
+                # directories aren't always stored, so add every parent
+                names.update(
+                    str(parent) for parent in PurePosixPath(name).parents if parent.name
+                )
+            _archives[key] = (zip_file, threading.Lock(), names)
+        return _archives[key]
+
+
+def _read_member(archive: Path, name: str) -> bytes:
+    zip_file, lock, names = _open_archive(archive)
+    with lock:
+        return zip_file.read(name)
+
+
+class MemberStream(io.RawIOBase):
+    "a read only, seekable stream of a zip member, the data comes from the member cache"
+
+    def __init__(self, archive: Path, name: str) -> None:
+        super().__init__()
+        self._archive = archive
+        self._name = name
+        self._position = 0
+
+    def _data(self) -> bytes:
+        return member_cache.get(self._archive, self._name)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += len(self._data())
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._position = offset
+        return self._position
+
+    def read(self, size: int | None = -1) -> bytes:
+        data = self._data()
+        if size is None or size < 0:
+            end = len(data)
+        else:
+            end = min(self._position + size, len(data))
+        result = data[self._position : end]
+        self._position = max(self._position, end)
+        return result
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class ArchivePath:
+    """
+    a path inside a zip file with the parts of pathlib.Path that the world classes use,
+    it can be pickled so it can be sent to worker processes
+    """
+
+    def __init__(self, archive: str | os.PathLike, at: str = "") -> None:
+        self.archive = Path(archive)
+        self.at = str(PurePosixPath(at)) if at else ""
+
+    def __reduce__(self):
+        return (ArchivePath, (self.archive, self.at))
+
+    def __truediv__(self, name: str) -> "ArchivePath":
+        return ArchivePath(self.archive, f"{self.at}/{name}" if self.at else name)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ArchivePath):
+            return NotImplemented
+        return (self.archive, self.at) == (other.archive, other.at)
+
+    def __hash__(self) -> int:
+        return hash((self.archive, self.at))
+
+    def __str__(self) -> str:
+        return str(self.archive / self.at)
+
+    def __repr__(self) -> str:
+        return f"ArchivePath({str(self.archive)!r}, {self.at!r})"
+
+    def __fspath__(self) -> str:
+        return str(self)
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.at).name if self.at else self.archive.name
+
+    @property
+    def parent(self) -> "ArchivePath":
+        parent = str(PurePosixPath(self.at).parent)
+        return ArchivePath(self.archive, "" if parent == "." else parent)
+
+    def _names(self) -> set:
+        return _open_archive(self.archive)[2]
+
+    def exists(self) -> bool:
+        return not self.at or self.at in self._names()
+
+    def is_file(self) -> bool:
+        zip_file, lock, names = _open_archive(self.archive)
+        try:
+            return not zip_file.getinfo(self.at).is_dir()
+        except KeyError:
+            return False
+
+    def is_dir(self) -> bool:
+        return self.exists() and not self.is_file()
+
+    def iterdir(self):
+        if not self.is_dir():
+            raise NotADirectoryError(str(self))
+        prefix = f"{self.at}/" if self.at else ""
+        for name in sorted(self._names()):
+            if name.startswith(prefix) and "/" not in name[len(prefix) :]:
+                yield ArchivePath(self.archive, name)
+
+    def open(self, mode: str = "rb", buffering: int = -1) -> MemberStream:
+        if mode != "rb":
+            raise ValueError("zip members can only be opened with mode 'rb'")
+        if not self.is_file():
+            raise FileNotFoundError(str(self))
+        return MemberStream(self.archive, self.at)
+
+    def read_bytes(self) -> bytes:
+        return member_cache.get(self.archive, self.at)
+
+
+def is_archive(path: str | os.PathLike) -> bool:
+    path = Path(path)
+    return path.is_file() and zipfile.is_zipfile(path)
+
+
+def archive_worlds(archive: str | os.PathLike) -> list[ArchivePath]:
+    "every world folder in a zip, wherever minecraftWorlds is inside it"
+    root = ArchivePath(Path(archive).resolve())
+    worlds = {
+        (root / name).parent
+        for name in root._names()
+        if PurePosixPath(name).name == "level.dat"
+    }
+    return sorted(worlds, key=lambda path: path.at)
+
+
+def world_root(
+    path: str | os.PathLike | ArchivePath, world_id: str | None = None
+) -> Path | ArchivePath:
+    """
+    where a world is, path can be a world folder, a folder of worlds with world_id,
+    or a Checkpoint backup zip with world_id (which can be left out if there's only one world)
+    """
+    if not isinstance(path, ArchivePath):
+        path = Path(path)
+        if is_archive(path):
+            return _archive_world(path, world_id)
+    # the world ID is ignored if path is already a world
+    if world_id is None or (path / "level.dat").is_file():
+        return path
+    return path / world_id
+
+
+def _archive_world(path: Path, world_id: str | None) -> ArchivePath:
+    worlds = archive_worlds(path)
+    if world_id is None:
+        if len(worlds) != 1:
+            raise ValueError(
+                f"{path} has {len(worlds):d} worlds, choose one with its world ID"
+            )
+        return worlds[0]
+    for world in worlds:
+        if world.name == world_id:
+            return world
+    raise FileNotFoundError(f"no world with the ID {world_id} in {path}")
@@ -1,17 +1,29 @@
 import os
-from abc import abstractmethod
-from io import BytesIO
-from typing import Any, Iterable
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Iterable, Iterator
 from pathlib import Path
+import mmap
+import threading
 import zlib
 import re
 import logging
 
+import numpy as np
+
 from .nbt import NBT
 from .parser import parser
+from .archive import ArchivePath, world_root
 
 logger = logging.getLogger(__name__)
 
+# the most slot files that are kept open at once in each process
+MAX_OPEN_FILES = 64
+# the most chunks whose block data is kept parsed, for reading blocks one at a time
+PARSED_CHUNK_CACHE_SIZE = 16
+
 # TODO separate this into smaller files
 
 
@@ -44,23 +56,204 @@ def parse_position(position) -> tuple[int, int, int]:
     return (int(x), int(z), int(dimension))
 
 
+# the 3DS only has 8 subchunks, so worlds are 128 blocks high
+MAX_SUBCHUNKS = 8
+
+
+def parse_block_data(raw: bytes):
+    data = parser.BlockData(raw)
+    assert len(data) == len(raw)
+    assert data.subchunkCount <= MAX_SUBCHUNKS
+    for subchunk in data.subchunks:
+        assert subchunk.constant0 == 0x0
+    return data
+
+
+SUBCHUNK_SIZE = 1 + 16 * 16 * 16 + 16 * 16 * 16 // 2 + 16 * 16 * 16
+
+
+class BlockArrays:
+    """
+    the same data as parser.BlockData, but as numpy arrays instead of nested lists,
+    blocks are indexed as [subchunk][x][z][y]
+    """
+
+    def __init__(self, raw: bytes) -> None:
+        count = raw[0]
+        assert count <= MAX_SUBCHUNKS
+        end = 1 + count * SUBCHUNK_SIZE
+        assert len(raw) == end + 16 * 16 * 2 + 16 * 16
+        subchunks = np.frombuffer(raw, np.uint8, end - 1, 1).reshape(
+            count, SUBCHUNK_SIZE
+        )
+        assert not subchunks[:, 0].any()
+        shape = (count, 16, 16, 16)
+        self.ids = subchunks[:, 1:4097].reshape(shape)
+        # every byte has two nibbles, the low nibble comes first
+        nibbles = subchunks[:, 4097:6145]
+        data = np.empty((count, 16 * 16 * 16), np.uint8)
+        data[:, 0::2] = nibbles & 0xF
+        data[:, 1::2] = nibbles >> 4
+        self.data = data.reshape(shape)
+        self.unknown_block_data = subchunks[:, 6145:].reshape(shape)
+        self.unknown0 = np.frombuffer(raw, "<u2", 16 * 16, end).reshape(16, 16)
+        self.biomes = np.frombuffer(raw, np.uint8, 16 * 16, end + 16 * 16 * 2).reshape(
+            16, 16
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class FilePool:
+    """
+    open file descriptors, the least recently used ones are closed once there's more than
+    max_open, a descriptor that's being read is only closed after the read is done
+    """
+
+    def __init__(self, max_open: int = MAX_OPEN_FILES) -> None:
+        if max_open < 1:
+            raise ValueError("at least one file has to be kept open")
+        self.max_open = max_open
+        # path: [fd, readers]
+        self._files = OrderedDict()
+        # descriptors that were closed while they were being read, by fd
+        self._closing = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def open(self, path: Path) -> Iterator[int]:
+        with self._lock:
+            try:
+                handle = self._files[path]
+                self._files.move_to_end(path)
+            except KeyError:
+                handle = self._files[path] = [_open_fd(path), 0]
+            handle[1] += 1
+            self._evict()
+        try:
+            yield handle[0]
+        finally:
+            with self._lock:
+                handle[1] -= 1
+                if not handle[1] and self._closing.pop(handle[0], None) is not None:
+                    os.close(handle[0])
+
+    def _evict(self) -> None:
+        for path in list(self._files):
+            if len(self._files) <= self.max_open:
+                break
+            self._close(path)
+
+    def _close(self, path: Path) -> None:
+        handle = self._files.pop(path)
+        if handle[1]:
+            self._closing[handle[0]] = handle
+        else:
+            os.close(handle[0])
+
+    def close(self, path: Path | None = None) -> None:
+        "closes one file, or all of them, they're opened again if they're read after"
+        with self._lock:
+            for open_path in [path] if path is not None else list(self._files):
+                if open_path in self._files:
+                    self._close(open_path)
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+
+def _open_fd(path: Path) -> int:
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    return fd
+
+
+file_pool = FilePool()
+
+# os.pread is missing on Windows, so reads seek the descriptor one at a time there
+_seek_lock = threading.Lock()
+
+
+def _pread(fd: int, size: int, offset: int) -> bytes:
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    with _seek_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+
+class FileSource:
+    "a slot file read with pread, there's no file position so any thread can read it"
+
+    def __init__(self, path: Path, pool: FilePool) -> None:
+        self.path = path
+        self._pool = pool
+
+    def pread(self, size: int, offset: int) -> bytes:
+        with self._pool.open(self.path) as fd:
+            return _pread(fd, size, offset)
+
+    def map(self) -> mmap.mmap | bytes:
+        "the whole file, mapped if it can be, mmaps have to be closed after"
+        with self._pool.open(self.path) as fd:
+            try:
+                return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # an empty file can't be mapped
+                return _pread(fd, os.fstat(fd).st_size, 0)
+
+    def advise(self, advice: int) -> None:
+        if hasattr(os, "posix_fadvise"):
+            with self._pool.open(self.path) as fd:
+                os.posix_fadvise(fd, 0, 0, advice)
+
+
+class MemberSource:
+    "a slot file in a zip, it's decompressed once into the member cache"
+
+    def __init__(self, path: ArchivePath) -> None:
+        self.path = path
+
+    def pread(self, size: int, offset: int) -> bytes:
+        return self.path.read_bytes()[offset : offset + size]
+
+    def map(self) -> bytes:
+        return self.path.read_bytes()
+
+    def advise(self, advice: int) -> None:
+        pass
+
+
 class BaseParser:
-    def __init__(self, stream: BytesIO) -> None:
-        self._stream = stream
-        self._offset = stream.tell()
+    def __init__(self, source: FileSource | MemberSource, offset: int = 0) -> None:
+        self._source = source
+        self._offset = offset
         self._reload_data()
 
     def _reload_data(self) -> None:
         pass
 
-    def _seek(self, position: int) -> None:
-        self._stream.seek(self._offset + position)
+    def _read(self, position: int, size: int) -> bytes:
+        return self._source.pread(size, self._offset + position)
 
 
-class Index(BaseParser):
-    def _reload_data(self) -> None:
-        self._seek(0)
-        self._data = parser.Index(self._stream)
+def as_path(path: str | bytes | os.PathLike | ArchivePath) -> Path | ArchivePath:
+    return path if isinstance(path, ArchivePath) else Path(path)
+
+
+def index_path(cdb_path: Path) -> Path:
+    "newindex.cdb, or index.cdb if there's only been one index"
+    path = cdb_path / "newindex.cdb"
+    if path.exists():
+        return path
+    return cdb_path / "index.cdb"
+
+
+class Index:
+    def __init__(self, raw: bytes) -> None:
+        self._data = parser.Index(raw)
         assert self._data.constant0 == 0x2
         # assert self._data.constant1 == 0x80
 
@@ -74,9 +267,11 @@ class Index(BaseParser):
 
 
 class Subfile(BaseParser):
-    def __init__(self, stream: BytesIO, subfile_size: int) -> None:
+    def __init__(
+        self, source: FileSource | MemberSource, offset: int, subfile_size: int
+    ) -> None:
         self._size = subfile_size
-        super().__init__(stream)
+        super().__init__(source, offset)
 
     # it's a property so it's read only
     @property
@@ -87,8 +282,7 @@ class Subfile(BaseParser):
         return self.size
 
     def _reload_data(self) -> None:
-        self._seek(0)
-        self._header = parser.SubfileHeader(self._stream)
+        self._header = parser.SubfileHeader(self._read(0, len(parser.SubfileHeader)))
 
     @property
     def filler(self) -> bool:
@@ -99,39 +293,31 @@ class Subfile(BaseParser):
     def raw(self) -> bytes | None:
         if self.filler:
             return None
-        self._seek(len(self._header))
-        content = self._stream.read(self.size - self._header.size)
-        return content
+        return self._read(len(self._header), self.size - self._header.size)
 
     @property
     def raw_with_header(self) -> bytes | None:
         if self.filler:
             return None
-        self._seek(0)
-        content = self._stream.read(self.size)
-        return content
+        return self._read(0, self.size)
 
 
 class IterDB:
     def __init__(self, db) -> None:
         self._db = db
-        self.__index = 0
+        # filler subfiles are skipped without parsing them
+        self.__indexes = iter(db.used_subfiles())
 
     def __next__(self) -> tuple[int, Any]:
-        while True:
-            if self.__index > len(self._db) - 1:
-                raise StopIteration
-            new_subfile = self._db[self.__index]
-            self.__index += 1
-            if not new_subfile.filler:
-                break
-        return self.__index - 1, new_subfile
+        index = int(next(self.__indexes))
+        return index, self._db[index]
 
 
 class DBFile(BaseParser):
     def _reload_data(self) -> None:
-        self._header = parser.FileHeader(self._stream)
+        self._header = parser.FileHeader(self._read(0, parser.FileHeader.size))
         assert self._header.footerSize == 0x14
+        self._occupancy = None
 
     @property
     def something(self) -> tuple[int]:
@@ -152,6 +338,71 @@ class DBFile(BaseParser):
     def __len__(self) -> int:
         return self.subfile_count
 
+    def _read_starts(self, size: int) -> np.ndarray:
+        """
+        the first size bytes of every subfile in one strided pass over the mapped file,
+        without parsing the subfiles, subfiles past the end of the file are all zeroes
+        """
+        start = self._offset + parser.FileHeader.size
+        mapped = self._source.map()
+        try:
+            available = len(mapped) - start - size
+            count = min(self.subfile_count, max(available // self.subfile_size + 1, 0))
+            starts = np.ndarray(
+                (count, size),
+                dtype=np.uint8,
+                buffer=mapped,
+                offset=start,
+                strides=(self.subfile_size, 1),
+            )
+            result = np.zeros((self.subfile_count, size), dtype=np.uint8)
+            result[:count] = starts
+            del starts
+        finally:
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        return result
+
+    def _read_magic(self) -> np.ndarray:
+        "reads the magic of every subfile at once"
+        return self._read_starts(len(parser.SubfileHeader)).view("<u4")[:, 0]
+
+    @property
+    def occupancy(self) -> np.ndarray:
+        "a bitmap of the subfiles that are in use, filler subfiles have a magic of 0"
+        if self._occupancy is None:
+            self._occupancy = self._read_magic() != 0
+        return self._occupancy
+
+    def used_subfiles(self) -> np.ndarray:
+        return np.flatnonzero(self.occupancy)
+
+    def free_subfiles(self) -> np.ndarray:
+        return np.flatnonzero(~self.occupancy)
+
+    @property
+    def used(self) -> int:
+        return int(np.count_nonzero(self.occupancy))
+
+    @property
+    def fill_ratio(self) -> float:
+        if self.subfile_count == 0:
+            return 1.0
+        return self.used / self.subfile_count
+
+    def subfile_offset(self, key: int) -> int:
+        key = process_key(int(key), self.subfile_count)
+        return parser.FileHeader.size + self.subfile_size * key
+
+    def read(self, key: int, position: int, size: int) -> bytes:
+        "reads part of a subfile without parsing or keeping the rest of it"
+        if position < 0 or position + size > self.subfile_size:
+            raise ValueError("read goes past the end of the subfile")
+        content = self._read(self.subfile_offset(key) + position, size)
+        if len(content) != size:
+            raise ValueError("slot file is truncated")
+        return content
+
     def _parse(self, subfile: Subfile) -> Any:
         return subfile
 
@@ -159,16 +410,9 @@ class DBFile(BaseParser):
         return IterDB(self)
 
     def __getitem__(self, key: int) -> bytes | None:
-        if key > self.subfile_size - 1:
-            raise IndexError("index out of range")
-        if key < 0:
-            key = self.subfile_size + key
-            # if it's still negative, it's out of range
-            if key < 0:
-                raise IndexError("index out of range")
-
-        self._seek(self.subfile_size * key + parser.FileHeader.size)
-        subfile = Subfile(self._stream, self.subfile_size)
+        subfile = Subfile(
+            self._source, self._offset + self.subfile_offset(key), self.subfile_size
+        )
         return self._parse(subfile)
 
 
@@ -186,6 +430,7 @@ class Subchunk:
     def raw_decompressed(self) -> bytes:
         decompress_object = zlib.decompressobj()
         decompressed = decompress_object.decompress(self._compressed)
+        assert decompress_object.eof, "compressed data is truncated"
         compressed_size = len(self._compressed) - len(decompress_object.unused_data)
         assert compressed_size == self._header.compressedSize, (
             f"compressed size {compressed_size:d} "
@@ -200,11 +445,7 @@ class Subchunk:
     @property
     def data(self):
         if self.__data_cache is None:
-            self.__data_cache = data = parser.BlockData(self.raw_decompressed)
-            assert len(data) == len(self.raw_decompressed)
-            assert data.subchunkCount <= 8
-            for subchunk in data.subchunks:
-                assert subchunk.constant0 == 0x0
+            self.__data_cache = parse_block_data(self.raw_decompressed)
         return self.__data_cache
 
     @property
@@ -297,7 +538,7 @@ class Chunk:
         should_be = start + len(parser.SubfileHeader)
         if subchunk_header.position != should_be:
             raise ValueError("invalid position")
-        subchunk = Subchunk(subchunk_header, self._raw[start:])
+        subchunk = Subchunk(subchunk_header, self._raw[start : start + size])
         return subchunk
 
 
@@ -351,9 +592,31 @@ class CDBFile(DBFile):
         super().__init__(*args, **kwargs)
         assert self._header.unknown0 == 0x4
 
+    def _reload_data(self) -> None:
+        super()._reload_data()
+        self._headers = None
+
     def _parse(self, subfile: Subfile) -> Chunk:
         return Chunk(subfile)
 
+    @property
+    def headers(self) -> np.ndarray:
+        "the raw subfile and chunk headers of every subfile, read together the first time"
+        if self._headers is None:
+            self._headers = self._read_starts(
+                len(parser.SubfileHeader) + parser.ChunkHeader.size
+            )
+            self._occupancy = self._headers[:, : len(parser.SubfileHeader)].any(axis=1)
+        return self._headers
+
+    def read_header(self, key: int):
+        "the chunk header of a subfile, None for filler"
+        key = process_key(int(key), self.subfile_count)
+        headers = self.headers
+        if not self.occupancy[key]:
+            return None
+        return parser.ChunkHeader(headers[key, len(parser.SubfileHeader) :].tobytes())
+
 
 class IterDBDirectory:
     def __init__(self, db_directory):
@@ -368,15 +631,18 @@ class IterDBDirectory:
         return new_key, self._db_directory[new_key]
 
 
-class DBDirectory:
+class DBDirectory(ABC):
     @property
     @abstractmethod
     def file_expression(self):
         pass
 
-    def __init__(self, path: str | bytes | os.PathLike) -> None:
+    def __init__(
+        self, path: str | bytes | os.PathLike, pool: FilePool | None = None
+    ) -> None:
         self._cache = {}
-        self._path = Path(path)
+        self._pool = file_pool if pool is None else pool
+        self._path = as_path(path)
         self._reload_data()
 
     def __iter__(self) -> IterDBDirectory:
@@ -399,7 +665,7 @@ class DBDirectory:
 
     @path.setter
     def path(self, value: str | bytes | os.PathLike) -> None:
-        self._path = Path(value)
+        self._path = as_path(value)
         self._reload_data()
 
     def keys(self) -> tuple[int]:
@@ -408,14 +674,33 @@ class DBDirectory:
     def get_file(self, key: int) -> Path:
         return self._files[key]
 
+    def fill_ratios(self) -> dict[int, float]:
+        "how full each slot file is, for capacity planning"
+        return {key: self[key].fill_ratio for key in sorted(self.keys())}
+
     @abstractmethod
-    def _process(self, stream: BytesIO) -> Any:
+    def _process(self, source: FileSource | MemberSource) -> Any:
         pass
 
+    def _open(self, path: Path | ArchivePath) -> FileSource | MemberSource:
+        if isinstance(path, ArchivePath):
+            return MemberSource(path)
+        return FileSource(path, self._pool)
+
+    def readahead(self, key: int) -> None:
+        "tells the OS that the whole slot file is about to be read"
+        self[key]._source.advise(getattr(os, "POSIX_FADV_WILLNEED", 0))
+
+    def close(self) -> None:
+        "closes the slot files that are open, they're opened again if they're read after"
+        for path in self._files.values():
+            if not isinstance(path, ArchivePath):
+                self._pool.close(path)
+
     def __getitem__(self, key: int) -> Any:
         path = self._files[key]
         if path not in self._cache:
-            self._cache[path] = self._process(open(path, "rb"))        
+            self._cache[path] = self._process(self._open(path))
         return self._cache[path]
 
 
@@ -424,8 +709,8 @@ class CDBDirectory(DBDirectory):
     def file_expression(self):
         return re.compile(r"slt(0|(?:[1-9]\d*))\.cdb")
 
-    def _process(self, stream: BytesIO) -> CDBFile:
-        return CDBFile(stream)
+    def _process(self, source: FileSource | MemberSource) -> CDBFile:
+        return CDBFile(source)
 
 
 class VDBDirectory(DBDirectory):
@@ -433,44 +718,195 @@ class VDBDirectory(DBDirectory):
     def file_expression(self):
         return re.compile(r"slt(0|(?:[1-9]\d*))\.vdb")
 
-    def _process(self, stream: BytesIO) -> VDBFile:
-        return VDBFile(stream)
+    def _process(self, source: FileSource | MemberSource) -> VDBFile:
+        return VDBFile(source)
 
 
-class Entry:
-    def __init__(self, header, chunk: Chunk, debug=None) -> None:
-        self.debug = debug
-        self.data_chunk = chunk[0]
-        self.chunk = chunk
+def _get_block(data, position: tuple[int, int, int]) -> tuple[int, int]:
+    x, y, z = position
+    subchunk_index, subchunk_y = y // 16, y % 16
+    if subchunk_index > 8:
+        raise KeyError("position out of range")
 
-    def __getitem__(self, position: tuple[int, int, int]) -> int:
-        data = self.data_chunk.data
-        x, y, z = position
-        subchunk_index, subchunk_y = y // 16, y % 16
-        if subchunk_index > 8:
-            raise KeyError("position out of range")
+    try:
+        subchunk = data.subchunks[subchunk_index]
+    except IndexError:
+        return (0, 0)
+    position = x * 16 * 16 + z * 16 + subchunk_y
+    try:
+        block_id = subchunk.blocks[x][z][subchunk_y]
+        block_raw_data = subchunk.blockData[position // 2]
+    except IndexError:
+        raise KeyError("position out of range") from None
 
-        try:
-            subchunk = data.subchunks[subchunk_index]
-        except KeyError:
-            return (0, 0)
-        position = x * 16 * 16 + z * 16 + subchunk_y
-        try:
-            block_id = subchunk.blocks[x][z][y]
-            block_raw_data = subchunk.data[position // 2]
-        except IndexError:
-            raise KeyError("position out of range") from None
+    # extract the correct nibble
+    if position % 2 == 0:
+        block_data = block_raw_data & 0xF
+    else:
+        block_data = block_raw_data >> 4
+    return (block_id, block_data)
+
+
+class Entry:
+    """
+    where a chunk is stored and its section table, the chunk itself is only read
+    from the slot file when it's used so large worlds don't have to fit in memory
+    """
+
+    __slots__ = ("position", "slot", "subfile", "parameters", "sections", "_cdb_file")
+
+    def __init__(
+        self,
+        position: tuple[int, int, int],
+        slot: int,
+        subfile: int,
+        header,
+        cdb_file: CDBFile,
+    ) -> None:
+        # plain ints, the parser's own int types are bigger and can't be pickled
+        self.position = position
+        self.slot = int(slot)
+        self.subfile = int(subfile)
+        self.parameters = (
+            int(header.parameters.unknown0),
+            int(header.parameters.unknown1),
+        )
+        # (index, position, compressed size, decompressed size) of each section
+        self.sections = tuple(
+            (
+                int(section.index),
+                int(section.position),
+                int(section.compressedSize),
+                int(section.decompressedSize),
+            )
+            for section in header.sections
+            if section.index != -1
+        )
+        self._cdb_file = cdb_file
+
+    @property
+    def chunk(self) -> Chunk:
+        return self._cdb_file[self.subfile]
 
-        # extract the correct nibble
-        if position % 2 == 0:
-            block_data = block_raw_data & 0xF
+    def section(self, key: int) -> Subchunk | None:
+        start = len(parser.SubfileHeader) + parser.ChunkHeader.size
+        for index, position, compressed_size, decompressed_size in self.sections:
+            if index == key:
+                break
+            # skip past the compressed data
+            start += compressed_size
         else:
-            block_data = block_raw_data >> 4
-        return (block_id, block_data)
+            # doesn't exist
+            return None
+        if position != start:
+            raise ValueError("invalid position")
+        header = parser.ChunkSection(
+            index=index,
+            position=position,
+            compressedSize=compressed_size,
+            decompressedSize=decompressed_size,
+        )
+        return Subchunk(
+            header, self._cdb_file.read(self.subfile, position, compressed_size)
+        )
+
+    @property
+    def data_chunk(self) -> Subchunk:
+        return self.section(0)
+
+    @property
+    def block_data(self):
+        "the parsed block data, it's kept for the last few chunks that were read"
+        return _parsed_block_data(self)
+
+    def __getitem__(self, position: tuple[int, int, int]) -> int:
+        return _get_block(self.block_data, position)
 
     @property
     def subchunk_count(self) -> int:
-        return len(self.blocks)
+        return self.block_data.subchunkCount
+
+
+@lru_cache(maxsize=PARSED_CHUNK_CACHE_SIZE)
+def _parsed_block_data(entry: Entry):
+    # entries are compared by identity, so chunks of different worlds are never mixed up
+    return entry.data_chunk.data
+
+
+class ChunkFilter:
+    """
+    which chunks of a world to load, anything that's None isn't limited,
+    bounds are chunk coordinates as (min x, min z, max x, max z) and are inclusive,
+    radius is in blocks around center, which is the world spawn if it's None
+    """
+
+    def __init__(
+        self,
+        dimensions: Iterable[int] | None = None,
+        bounds: tuple[int, int, int, int] | None = None,
+        radius: float | None = None,
+        center: tuple[int, int] | None = None,
+    ) -> None:
+        self.dimensions = None if dimensions is None else frozenset(dimensions)
+        if bounds is not None:
+            min_x, min_z, max_x, max_z = bounds
+            bounds = (
+                min(min_x, max_x),
+                min(min_z, max_z),
+                max(min_x, max_x),
+                max(min_z, max_z),
+            )
+        self.bounds = bounds
+        if radius is not None and radius < 0:
+            raise ValueError("radius can't be negative")
+        self.radius = radius
+        self.center = center
+
+    def __repr__(self) -> str:
+        "the same for the same chunks, so it can be saved and compared"
+        dimensions = None if self.dimensions is None else sorted(self.dimensions)
+        return (
+            f"ChunkFilter(dimensions={dimensions}, bounds={self.bounds}, "
+            f"radius={self.radius}, center={self.center})"
+        )
+
+    @classmethod
+    def from_block_bounds(
+        cls, bounds: tuple[int, int, int, int], **kwargs
+    ) -> "ChunkFilter":
+        "bounds in block coordinates, every chunk with a block inside them is kept"
+        min_x, min_z, max_x, max_z = bounds
+        chunk_bounds = (
+            min(min_x, max_x) // 16,
+            min(min_z, max_z) // 16,
+            max(min_x, max_x) // 16,
+            max(min_z, max_z) // 16,
+        )
+        return cls(bounds=chunk_bounds, **kwargs)
+
+    def with_center(self, center: tuple[int, int]) -> "ChunkFilter":
+        "a copy that uses center if it doesn't have one"
+        if self.center is not None:
+            return self
+        return ChunkFilter(self.dimensions, self.bounds, self.radius, center)
+
+    def __contains__(self, position: tuple[int, int, int]) -> bool:
+        chunk_x, chunk_z, dimension = position
+        if self.dimensions is not None and dimension not in self.dimensions:
+            return False
+        if self.bounds is not None:
+            min_x, min_z, max_x, max_z = self.bounds
+            if not (min_x <= chunk_x <= max_x and min_z <= chunk_z <= max_z):
+                return False
+        if self.radius is not None:
+            center_x, center_z = (0, 0) if self.center is None else self.center
+            # the distance to the nearest block of the chunk, so partly covered chunks are kept
+            nearest_x = min(max(center_x, chunk_x * 16), chunk_x * 16 + 15)
+            nearest_z = min(max(center_z, chunk_z * 16), chunk_z * 16 + 15)
+            distance = (nearest_x - center_x) ** 2 + (nearest_z - center_z) ** 2
+            if distance > self.radius**2:
+                return False
+        return True
 
 
 class CDBIndex(Index):
@@ -480,38 +916,64 @@ class CDBIndex(Index):
 
 
 class World:
-    def __init__(self, path: str | bytes | os.PathLike) -> None:
-        self._path = Path(path)
+    """
+    path can also be a folder of worlds or a Checkpoint backup zip, with world_id
+    choosing the world in it, slot files are opened from file_pool (the one shared by
+    the whole process if it's None) and closed with close or at the end of a with block
+    """
+
+    def __init__(
+        self,
+        path: str | bytes | os.PathLike,
+        chunk_filter: ChunkFilter | None = None,
+        world_id: str | None = None,
+        file_pool: FilePool | None = None,
+    ) -> None:
+        self._path = world_root(path, world_id)
+        self._chunk_filter = chunk_filter
+        self._file_pool = file_pool
         self._reload_data()
 
+    def __enter__(self) -> "World":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.cdb.close()
+        self.vdb.close()
+
     def _reload_data(self) -> None:
         self._db_path = self._path / "db"
         self._cdb_path = self._db_path / "cdb"
         self._vdb_path = self._db_path / "vdb"
-        self.cdb = CDBDirectory(self._cdb_path)
-        self.vdb = VDBDirectory(self._vdb_path)
+        self.cdb = CDBDirectory(self._cdb_path, self._file_pool)
+        self.vdb = VDBDirectory(self._vdb_path, self._file_pool)
 
         self._level_path = self._path / "level.dat"
         self._level_old_path = self._path / "level.dat_old"
-        with open(self._level_path, "rb") as level_file:
+        with self._level_path.open("rb") as level_file:
             buffer = level_file.read()
         self.metadata = NBT(buffer)
         if self._level_old_path.exists():
-            with open(self._level_old_path, "rb") as level_file:
+            with self._level_old_path.open("rb") as level_file:
                 buffer = level_file.read()
             self.old_metadata = NBT(buffer)
         else:
             self.old_metadata = None
-        try:
-            with open(self._cdb_path / "newindex.cdb", "rb") as index_file:
-                self._index = Index(index_file)
-        except FileNotFoundError:
-            # if there's only been one index, then newindex.cdb isn't created
-            with open(self._cdb_path / "index.cdb", "rb") as index_file:
-                self._index = Index(index_file)
+        self._index = Index(index_path(self._cdb_path).read_bytes())
 
+        chunk_filter = self._chunk_filter
+        if chunk_filter is not None:
+            chunk_filter = chunk_filter.with_center(self.spawn)
         self.entries = {}
-        for entry in self._index.entries:
+        # visit the chunks in the order they are stored in instead of the index order,
+        # so every slot file is read once from start to end
+        current_slot = None
+        for entry in sorted(
+            self._index.entries, key=lambda entry: (entry.slot, entry.subfile)
+        ):
             slot = entry.slot
             assert entry.constant0 == 0x20FF
             if entry.constant1 != 0xA:
@@ -521,21 +983,26 @@ class World:
                 pass  # logger.debug(f"N {entry}")
             else:
                 assert slot in self.cdb.keys()
-                chunk = self.cdb[slot][entry.subfile]
-
                 position = parse_position(entry.position)
-                if chunk.filler:
+                # filtered chunks are skipped before anything is read from the slot
+                if chunk_filter is not None and position not in chunk_filter:
+                    continue
+                if slot != current_slot:
+                    self.cdb.readahead(slot)
+                    current_slot = slot
+                cdb_file = self.cdb[slot]
+                # only the header is read, the sections are read when they're used
+                header = cdb_file.read_header(entry.subfile)
+                if header is None:
                     continue
-                assert position == chunk.position
-                chunk0 = chunk._header.unknown0
-                chunk1 = chunk._header.unknown1
-                chunk2 = chunk._header.unknown2
 
-                debug = None  # f"chunk0={chunk0:d} chunk1={chunk1:d} chunk2={chunk2:d} position={repr(position)} slot={slot:d} subfile={entry.subfile:d}"
+                assert position == parse_position(header.position)
                 if position in self.entries:
                     raise ValueError(f"duplicate position {position}")
                 else:
-                    self.entries[position] = Entry(entry, chunk, debug)
+                    self.entries[position] = Entry(
+                        position, slot, entry.subfile, header, cdb_file
+                    )
 
     def __iter__(self):
         return IterWorld(self)
@@ -573,13 +1040,23 @@ class World:
 
     @path.setter
     def path(self, value: str | bytes | os.PathLike) -> None:
-        self._path = Path(value)
+        self.close()
+        self._path = world_root(value)
         self._reload_data()
 
     @property
     def name(self) -> str:
         return self.metadata.get("LevelName")
 
+    @property
+    def spawn(self) -> tuple[int, int]:
+        "the block x and z of the world spawn"
+        return (self.metadata.get("SpawnX") or 0, self.metadata.get("SpawnZ") or 0)
+
+    @property
+    def chunk_filter(self) -> ChunkFilter | None:
+        return self._chunk_filter
+
 
 class IterWorld:
     def __init__(self, world: World) -> None:
@@ -587,6 +1064,7 @@ class IterWorld:
         self.__entries_left = list(world.entries.items())
         self.__blocks_left = []
         self.__entry = None
+        self.__data = None
         self.__position = None
 
     def __next__(self) -> tuple[tuple[int, int, int], int]:
@@ -596,9 +1074,10 @@ class IterWorld:
             self.__blocks_left = []
             position, self.__entry = self.__entries_left.pop(0)
             self.__position = (position[0] * 0x10, position[1] * 0x10, position[2])
+            self.__data = self.__entry.data_chunk.data
             for x in range(0x10):
                 for z in range(0x10):
-                    for y in range(0x10 * self.__entry.subchunk_count):
+                    for y in range(0x10 * self.__data.subchunkCount):
                         self.__blocks_left.append((x, y, z))
         coordinates = self.__blocks_left.pop(0)
         offset_x, offset_z, dimension = self.__position
@@ -610,5 +1089,5 @@ class IterWorld:
             ),
             dimension,
             self.__entry,
-            self.__entry[coordinates],
+            _get_block(self.__data, coordinates),
         )
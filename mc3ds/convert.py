@@ -1,110 +1,461 @@
-import sys
-import shutil
-from pathlib import Path
-import random
+import os
+from pathlib import Path, PurePosixPath
+from io import BytesIO
+import math
 import re
 import json
+import zlib
+import hashlib
 import asyncio
 import logging
-from multiprocessing import Lock
-from concurrent.futures import ThreadPoolExecutor
-from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from collections import Counter
+from functools import partial
+from array import array
 
-from anvil import EmptyRegion, EmptyChunk, Block
-import nbtlib
-from nbtlib.tag import String
+import numpy as np
+from anvil import EmptyChunk, EmptySection, Block
+from nbt import nbt
 from tqdm import tqdm
-from p_tqdm import p_umap, p_uimap
 
-from .classes import World, Entry
+from .classes import World, ChunkFilter, Entry, Subchunk, BlockArrays, index_path
+from .ls3ds import find_worlds
+from .nbt import read_compounds, TAG_COMPOUND
+from .entities import (
+    KEYS as ENTITY_KEYS,
+    is_block_entity,
+    is_entity,
+    convert_block_entity,
+    convert_entity,
+    java_tag,
+)
+from .output import (
+    DirectoryOutput,
+    ArchiveOutput,
+    open_output,
+    check_old_output,
+    remove_output,
+    write_blank_world,
+    archive_suffix,
+    RegionJournal,
+    is_finished,
+    JOURNAL_NAME,
+    fsync_directory,
+    write_durably,
+)
+from .shard import MANIFEST_NAME, region_shard, shard_manifest
+from .lighting import (
+    WORLD_HEIGHT,
+    LIGHT_REACH,
+    BlockProperties,
+    heightmap,
+    pack_heightmap,
+    sky_light,
+    block_light,
+    pack_light,
+    surrounding_keys,
+)
 
 OVERWORLD = 0
 NETHER = 1
 END = 2
 
 AIR = (0, 0)
+# the chunks around a chunk, its light is spread through them so it matches theirs
+NEIGHBOUR_OFFSETS = tuple(
+    (offset_x, offset_z)
+    for offset_x in (-1, 0, 1)
+    for offset_z in (-1, 0, 1)
+    if offset_x or offset_z
+)
+
+# how many chunks can wait between two stages of the conversion
+DEFAULT_QUEUE_SIZE = 64
+
+SECTOR_SIZE = 4096
 
 logger = logging.getLogger(__name__)
 
 
+class UnknownBlocks:
+    "counts the blocks without a mapping, so they can be reported once instead of for every block"
+
+    # how many positions are kept for each block, to find them in the world
+    SAMPLE_COUNT = 5
+
+    def __init__(self) -> None:
+        self.counts = Counter()
+        self.dimensions = {}
+        self.samples = {}
+
+    def add(
+        self,
+        block_id: tuple[int, int],
+        count: int,
+        dimension: int,
+        position: tuple[int, int, int],
+    ) -> None:
+        self.counts[block_id] += count
+        self.dimensions.setdefault(block_id, Counter())[dimension] += count
+        samples = self.samples.setdefault(block_id, [])
+        if len(samples) < self.SAMPLE_COUNT:
+            samples.append((dimension, position))
+
+    def update(self, other: "UnknownBlocks") -> None:
+        for block_id, count in other.counts.items():
+            self.counts[block_id] += count
+            self.dimensions.setdefault(block_id, Counter()).update(
+                other.dimensions[block_id]
+            )
+            samples = self.samples.setdefault(block_id, [])
+            samples.extend(other.samples[block_id][: self.SAMPLE_COUNT - len(samples)])
+
+    def __bool__(self) -> bool:
+        return bool(self.counts)
+
+    def summary(self) -> list[str]:
+        lines = [
+            f"{sum(self.counts.values()):d} blocks with {len(self.counts):d} unknown IDs "
+            "were replaced with netherite blocks"
+        ]
+        for block_id, count in self.counts.most_common():
+            dimensions = ", ".join(
+                f"dimension {dimension:d}: {dimension_count:d}"
+                for dimension, dimension_count in sorted(
+                    self.dimensions[block_id].items()
+                )
+            )
+            samples = ", ".join(
+                f"{position} in dimension {dimension:d}"
+                for dimension, position in self.samples[block_id]
+            )
+            lines.append(
+                f"unknown block {block_id}: {count:d} ({dimensions}), for example at {samples}"
+            )
+        return lines
+
+
+class UniformSection(EmptySection):
+    "a section made of one block, it's saved without looking at each block"
+
+    __slots__ = ()
+
+    def __init__(self, y: int, block: Block) -> None:
+        super().__init__(y)
+        self.blocks = [block] * (16 * 16 * 16)
+
+    def palette(self) -> tuple[Block]:
+        return (self.blocks[0],)
+
+    def blockstates(self, palette: tuple[Block] = None) -> array:
+        # a palette of one block uses the minimum of 4 bits per block, all zero
+        return array("Q", bytes(16 * 16 * 16 * 4 // 8))
+
+
+class JavaChunk(EmptyChunk):
+    "an EmptyChunk that also saves precomputed heightmaps and light"
+
+    __slots__ = (
+        "heightmaps",
+        "sky_light",
+        "block_light",
+        "biomes",
+        "entities",
+        "tile_entities",
+    )
+
+    def __init__(self, x: int, z: int) -> None:
+        super().__init__(x, z)
+        self.heightmaps = {}
+        self.biomes = None
+        # converted compounds from mc3ds.nbt, they're turned into tags when saving
+        self.entities = []
+        self.tile_entities = []
+        # the packed light of each section, by section Y
+        self.sky_light = {}
+        self.block_light = {}
+
+    def save(self) -> nbt.NBTFile:
+        root = super().save()
+        level = root["Level"]
+        for name, compounds in (
+            ("Entities", self.entities),
+            ("TileEntities", self.tile_entities),
+        ):
+            level[name].tags.extend(
+                java_tag(TAG_COMPOUND, compound) for compound in compounds
+            )
+        heightmaps = nbt.TAG_Compound()
+        heightmaps.name = "Heightmaps"
+        for name, longs in self.heightmaps.items():
+            tag = nbt.TAG_Long_Array(name=name)
+            tag.value = longs
+            heightmaps.tags.append(tag)
+        level.tags.append(heightmaps)
+        if self.biomes is not None:
+            biomes = nbt.TAG_Int_Array(name="Biomes")
+            biomes.value = self.biomes
+            level.tags.append(biomes)
+
+        sections = level["Sections"]
+        by_y = {section["Y"].value: section for section in sections.tags}
+        for section_y in sorted(self.sky_light.keys() | self.block_light.keys()):
+            try:
+                section = by_y[section_y]
+            except KeyError:
+                # sections without blocks still need light
+                section = nbt.TAG_Compound()
+                section.tags.append(nbt.TAG_Byte(name="Y", value=section_y))
+                sections.tags.append(section)
+            for name, light in (
+                ("BlockLight", self.block_light),
+                ("SkyLight", self.sky_light),
+            ):
+                if section_y in light:
+                    tag = nbt.TAG_Byte_Array(name=name)
+                    tag.value = bytearray(light[section_y])
+                    section.tags.append(tag)
+        sections.tags.sort(key=lambda section: section["Y"].value)
+        return root
+
+
+def block_keys(block_arrays: BlockArrays) -> np.ndarray:
+    "the ID and data of each block as one number, indexed [x][z][y]"
+    ids = block_arrays.ids.transpose(1, 2, 0, 3).reshape(16, 16, -1)
+    data = block_arrays.data.transpose(1, 2, 0, 3).reshape(16, 16, -1)
+    return (ids.astype(np.uint16) << 4) | data
+
+
 class ChunkConverter:
     def __init__(
-        self, position: tuple[int, int, int], entry: Entry, blocks: dict
+        self,
+        position: tuple[int, int, int],
+        block_arrays: BlockArrays,
+        blocks: dict,
+        properties: BlockProperties | None = None,
+        biomes: tuple[np.ndarray, dict] | None = None,
+        items: dict | None = None,
     ) -> None:
         self.chunk_x, self.chunk_z, self.dimension = position
-        self.entry = entry
+        self.block_arrays = block_arrays
         self.blocks = blocks
+        self.biomes = biomes
+        self.items = {} if items is None else items
+        if properties is None:
+            properties = BlockProperties(blocks)
+        self.properties = properties
+        self.keys = block_keys(block_arrays)
+        self.unknown_blocks = UnknownBlocks()
+
+    def _get_block(
+        self, key: int, keys: np.ndarray, subchunk_y: int, count: int
+    ) -> Block | None:
+        block_id = (key >> 4, key & 0xF)
+        if block_id == AIR:
+            return None
+        try:
+            return self.blocks[block_id]
+        except KeyError:
+            # only counted here, they're reported once the conversion is done
+            x, z, y = np.argwhere(keys == key)[0].tolist()
+            position = (
+                self.chunk_x * 16 + x,
+                y + subchunk_y * 16,
+                self.chunk_z * 16 + z,
+            )
+            self.unknown_blocks.add(block_id, count, self.dimension, position)
+            return Block("minecraft", "netherite_block")
 
     def place_blocks(self) -> None:
-        self.chunk = EmptyChunk(self.chunk_x, self.chunk_z)
-        setted = set()
-        for subchunk_y, subchunk in enumerate(self.entry.data_chunk.data.subchunks):
-            y_offset = subchunk_y * 16
-            for x, row in enumerate(subchunk.blocks):
-                for z, column in enumerate(row):
-                    for y, block in enumerate(column):
-                        unknown_block_data = subchunk.unknownBlockData[x][z][y]
-                        calculated_y = y + y_offset
-                        pos = x, calculated_y, z
-                        setted.add(pos)
-                        position = x * 16 * 16 + z * 16 + y
-                        # extract the nibble from the byte
-                        block_byte = subchunk.blockData[position // 2]
-                        if position % 2 == 0:
-                            block_data = block_byte & 0xF
-                        else:
-                            block_data = block_byte >> 4
-
-                        block_id = (block, block_data)
-                        if unknown_block_data:
-                            raise ValueError(
-                                f"UNKNOWN UNKNOWN UNKNOWN 0x{unknown_block_data:02X}"
-                            )
-                            if block_id == AIR:
-                                block = Block("minecraft", "glass")
-                                self.chunk.set_block(block, x, calculated_y, z)
-                                continue
-                        if block_id != AIR:
-                            try:
-                                block = self.blocks[block_id]
-                            except KeyError:
-                                logger.warning(
-                                    f"unknown block {block_id} at {(x, calculated_y, z)} dimension {self.dimension}"
-                                )
-                                sys.stderr.flush()
-                                block = Block("minecraft", "netherite_block")
-                            self.chunk.set_block(block, x, calculated_y, z)
+        self.chunk = JavaChunk(self.chunk_x, self.chunk_z)
+        arrays = self.block_arrays
+        for subchunk_y in range(len(arrays)):
+            unknown_block_data = arrays.unknown_block_data[subchunk_y]
+            if unknown_block_data.any():
+                raise ValueError(
+                    f"UNKNOWN UNKNOWN UNKNOWN 0x{unknown_block_data.max():02X}"
+                )
+            keys = self.keys[:, :, subchunk_y * 16 : (subchunk_y + 1) * 16]
+
+            first = int(keys[0, 0, 0])
+            if (keys == first).all():
+                if first == 0:
+                    # all air, so there is nothing to place
+                    continue
+                block = self._get_block(first, keys, subchunk_y, keys.size)
+                self.chunk.add_section(UniformSection(subchunk_y, block))
+                continue
+
+            palette_keys, indexes, counts = np.unique(
+                keys, return_inverse=True, return_counts=True
+            )
+            palette = [
+                self._get_block(key, keys, subchunk_y, count)
+                for key, count in zip(palette_keys.tolist(), counts.tolist())
+            ]
+            # anvil stores blocks in [y][z][x] order
+            indexes = indexes.reshape(16, 16, 16).transpose(2, 1, 0).ravel()
+            section = EmptySection(subchunk_y)
+            section.blocks = list(map(palette.__getitem__, indexes.tolist()))
+            self.chunk.add_section(section)
+
+    def convert_biomes(self) -> None:
+        lookup, defaults = self.biomes
+        # one biome for each 4x4 column, the 3DS stores them in [z][x] order like Pocket Edition
+        cells = lookup[self.block_arrays.biomes[2::4, 2::4]]
+        cells = np.where(cells < 0, defaults[self.dimension], cells)
+        # 1.16.5 has a biome for every 4x4x4 cube, in [y][z][x] order
+        self.chunk.biomes = (
+            np.broadcast_to(cells, (WORLD_HEIGHT // 4, 4, 4)).ravel().tolist()
+        )
+
+    def compute_lighting(self, neighbours: dict | None = None) -> None:
+        """
+        adds heightmaps and light, so Minecraft can skip lighting the chunk when it's
+        loaded, neighbours maps offsets like (-1, 0) to the keys of the chunks around
+        this one, the light spreads through them too so it matches at the chunk's edges
+        """
+        properties = self.properties
+        keys = self.keys
+        for name, mask in (
+            ("MOTION_BLOCKING", properties.blocks_motion | properties.fluid),
+            (
+                "MOTION_BLOCKING_NO_LEAVES",
+                (properties.blocks_motion | properties.fluid) & ~properties.leaves,
+            ),
+            ("OCEAN_FLOOR", properties.blocks_motion),
+            ("WORLD_SURFACE", properties.not_air),
+        ):
+            self.chunk.heightmaps[name] = pack_heightmap(heightmap(mask[keys]))
+
+        chunks = {(0, 0): keys}
+        if neighbours is not None:
+            chunks.update(neighbours)
+        # light from the top blocks can reach the section above them
+        top = max(chunk_keys.shape[2] for chunk_keys in chunks.values())
+        height = min(top + 16, WORLD_HEIGHT)
+        padded = surrounding_keys(chunks, height)
+        opacity = properties.opacity[padded]
+        inside = (slice(LIGHT_REACH, LIGHT_REACH + 16),) * 2
+        light = block_light(opacity, properties.emission[padded])[inside]
+        # only the overworld has a sky
+        sky = sky_light(opacity)[inside] if self.dimension == OVERWORLD else None
+        for section_y in range(height // 16):
+            self.chunk.block_light[section_y] = pack_light(light, section_y)
+            if sky is not None:
+                self.chunk.sky_light[section_y] = pack_light(sky, section_y)
+
+    def convert_entities(self, sections: list[bytes]) -> None:
+        "adds the block entities and entities in the NBT sections to the chunk"
+        for raw in sections:
+            try:
+                compounds = read_compounds(raw, ENTITY_KEYS)
+            except ValueError as error:
+                # the blocks are still worth converting without the entities
+                logger.warning(
+                    f"could not read the entities of chunk {(self.chunk_x, self.chunk_z, self.dimension)}: {error}"
+                )
+                continue
+            for compound in compounds:
+                if is_block_entity(compound):
+                    converted = convert_block_entity(compound, self.items)
+                    if converted is not None:
+                        self.chunk.tile_entities.append(converted)
+                elif is_entity(compound):
+                    converted = convert_entity(compound, self.items)
+                    if converted is not None:
+                        self.chunk.entities.append(converted)
 
     @property
     def region_position(self) -> tuple[int, int, int]:
         return self.chunk_x // 32, self.chunk_z // 32, self.dimension
 
 
+def encode_chunk(chunk: EmptyChunk) -> bytes:
+    "serializes a chunk to uncompressed NBT, like anvil does before saving a region"
+    buffer = BytesIO()
+    chunk.save().write_file(buffer=buffer)
+    return buffer.getvalue()
+
+
+def region_name(position: tuple[int, int, int]) -> str:
+    "where a region is inside the world"
+    region_x, region_z, dimension = position
+    if dimension == OVERWORLD:
+        dimension_path = PurePosixPath()
+    elif dimension == NETHER:
+        dimension_path = PurePosixPath("DIM-1")
+    elif dimension == END:
+        dimension_path = PurePosixPath("DIM1")
+    else:
+        raise ValueError("invalid dimension")
+    return (dimension_path / "region" / f"r.{region_x:d}.{region_z:d}.mca").as_posix()
+
+
 class RegionConverter:
-    def __init__(self, world_directory: Path, position: tuple[int, int, int]) -> None:
+    def __init__(
+        self,
+        world_directory: Path | None,
+        position: tuple[int, int, int],
+    ) -> None:
+        "world_directory is None when the region is written to an archive instead"
         self.region_x, self.region_z, self.dimension = position
-        self.world_directory = Path(world_directory)
-        if self.dimension == OVERWORLD:
-            dimension_path = self.world_directory
-        elif self.dimension == NETHER:
-            dimension_path = self.world_directory / "DIM-1"
-        elif self.dimension == END:
-            dimension_path = self.world_directory / "DIM1"
+        self.name = region_name(position)
+        if world_directory is None:
+            self.world_directory = self.region_file = None
         else:
-            raise ValueError("invalid dimension")
-        self.region_file = (
-            dimension_path / "region" / f"r.{self.region_x:d}.{self.region_z:d}.mca"
-        )
-        self.region = EmptyRegion(self.region_x, self.region_z)
+            self.world_directory = Path(world_directory)
+            self.region_file = self.world_directory / self.name
+        # the zlib compressed NBT of each chunk, in the same order as anvil.EmptyRegion
+        self.chunks = [None] * 1024
+
+    def add_chunk(self, chunk_x: int, chunk_z: int, compressed: bytes) -> None:
+        assert (chunk_x // 32, chunk_z // 32) == (self.region_x, self.region_z)
+        self.chunks[chunk_z % 32 * 32 + chunk_x % 32] = compressed
 
-    def add_chunk(self, chunk: EmptyChunk) -> None:
-        self.region.add_chunk(chunk)
+    def to_bytes(self) -> bytes:
+        # the same layout as anvil.EmptyRegion.save, without copying the whole region for every chunk
+        locations_header = bytearray()
+        chunks_bytes = bytearray()
+        for compressed in self.chunks:
+            if compressed is None:
+                locations_header += bytes(4)
+                continue
+            # the length includes the compression type, which is 2 for zlib
+            to_add = (len(compressed) + 1).to_bytes(4, "big") + b"\x02" + compressed
+            sector_offset = len(chunks_bytes) // SECTOR_SIZE
+            sector_count = math.ceil(len(to_add) / SECTOR_SIZE)
+            # the header and timestamps are the first two sectors
+            locations_header += (sector_offset + 2).to_bytes(3, "big")
+            locations_header += sector_count.to_bytes(1, "big")
+            chunks_bytes += to_add
+            chunks_bytes += bytes(SECTOR_SIZE - (len(to_add) % SECTOR_SIZE))
+        timestamps_header = bytes(SECTOR_SIZE)
+        final = locations_header + timestamps_header + chunks_bytes
+        final += bytes(SECTOR_SIZE - (len(final) % SECTOR_SIZE))
+        return bytes(final)
 
     def save(self) -> None:
+        "the region is on disk once this returns, so the journal can't list a lost region"
+        region_directory = self.region_file.parent
         # if the region directory hasn't been generated yet, create it
-        if self.world_directory.exists():
-            self.region_file.parent.mkdir(parents=True, exist_ok=True)
-        self.region.save(str(self.region_file))
+        if self.world_directory.exists() and not region_directory.is_dir():
+            region_directory.mkdir(parents=True, exist_ok=True)
+            # the new folders have to be on disk too, or the region is lost with them
+            for directory in {region_directory.parent, self.world_directory}:
+                fsync_directory(directory)
+        write_durably(self.region_file, self.to_bytes())
+
+
+def save_region(region_converter: RegionConverter) -> tuple:
+    """
+    saves a region into the world folder, or returns it if it goes into an archive,
+    which can only be written by the process that opened it
+    """
+    if region_converter.world_directory is None:
+        return region_converter.name, region_converter.to_bytes()
+    region_converter.save()
+    return region_converter.name, None
 
 
 def parse_block_json(raw_blocks: dict) -> dict:
@@ -133,26 +484,71 @@ def parse_block_json(raw_blocks: dict) -> dict:
     return blocks
 
 
-def convert(
+def parse_item_json(raw_items: dict) -> dict:
+    "item names by numeric ID and data value, without the block states some have"
+    return {
+        tuple(map(int, numerical_id.split(":"))): new.partition("[")[0]
+        for numerical_id, new in raw_items["items"].items()
+    }
+
+
+def parse_biome_json(raw_biomes: dict) -> tuple[np.ndarray, dict]:
+    "returns a lookup array from 3DS to Java biome IDs, -1 for unknown biomes, and the default biome of each dimension"
+    lookup = np.full(256, -1, np.int32)
+    for biome_3ds, biome_java in raw_biomes["biomes"].items():
+        lookup[int(biome_3ds)] = biome_java
+    defaults = {
+        int(dimension): biome for dimension, biome in raw_biomes["defaults"].items()
+    }
+    return lookup, defaults
+
+
+def prepare_world_out(
     world: World,
     blank_world: Path,
     world_out: Path,
     delete_out: bool = False,
     interactive: bool = True,
-) -> None:
-    if world_out.exists():
-        if not world_out.is_dir() or not (world_out / "level.dat").is_file():
-            raise FileExistsError(
-                "world output folder already exists, and is not a Java savefile, did you select the right folder?"
+    resume: bool = False,
+) -> DirectoryOutput | ArchiveOutput | None:
+    """
+    opens the output, a folder or an archive, and writes the blank world into it,
+    with resume an interrupted conversion into a folder is continued instead, and
+    None is returned if it already finished
+    """
+    if resume and world_out.exists():
+        if archive_suffix(world_out) is not None:
+            raise ValueError("conversions into archives can't be resumed")
+        # the journal is made before anything else, so a folder with one was started by a conversion
+        if not (world_out / JOURNAL_NAME).exists():
+            check_old_output(world_out)
+            if is_finished(world_out, world.name):
+                logger.info(f"{world_out} already finished converting")
+                return None
+        output = open_output(world_out)
+        try:
+            output.journal = RegionJournal(
+                world_out, index_hash(world), repr(world.chunk_filter), resume=True
             )
-        elif delete_out:
-            shutil.rmtree(world_out)
+            # it might have stopped before the blank world was all written
+            write_blank_world(output, blank_world, world.name)
+        except BaseException:
+            output.close()
+            raise
+        logger.info(
+            f"resuming {world_out}, {len(output.journal.done):d} regions are already done"
+        )
+        return output
+    if world_out.exists():
+        check_old_output(world_out)
+        if delete_out:
+            remove_output(world_out)
         elif interactive:
             print("A converted world already exists, do you want to overwrite it?")
             while True:
                 choice = input("[y/n]> ").strip().upper()
                 if choice in ("Y", "YES"):
-                    shutil.rmtree(world_out)
+                    remove_output(world_out)
                     break
                 elif choice in ("N", "NO"):
                     raise FileExistsError("world output folder already exists")
@@ -162,86 +558,507 @@ def convert(
                     print("Invalid input, please enter Y or N")
         else:
             raise FileExistsError("world output folder already exists")
-    shutil.copytree(blank_world, world_out)
-    with nbtlib.load(world_out / "level.dat") as level:
-        level["Data"]["LevelName"] = String(world.name)
+    output = open_output(world_out)
+    try:
+        if output.directory is not None:
+            # before the blank world, or a crash while it's written looks like a finished world
+            world_out.mkdir(parents=True)
+            output.journal = RegionJournal(
+                world_out, index_hash(world), repr(world.chunk_filter)
+            )
+        write_blank_world(output, blank_world, world.name)
+    except BaseException:
+        output.close()
+        raise
+    return output
+
+
+def index_hash(world: World) -> str:
+    "identifies the save a conversion was made from, so it isn't resumed from another one"
+    return hashlib.sha256(index_path(world.cdb.path).read_bytes()).hexdigest()
 
-    # read the JSON files containing MCPE block IDs
+
+def load_mappings() -> tuple[dict, tuple[np.ndarray, dict], dict]:
+    "reads the JSON files containing MCPE block IDs, item IDs and biome IDs"
     with open(Path(__file__).parent / "data" / "blocks.json") as blocks_file:
         raw_blocks = json.load(blocks_file)
     blocks = parse_block_json(raw_blocks)
+    items = parse_item_json(raw_blocks)
+    with open(Path(__file__).parent / "data" / "biomes.json") as biomes_file:
+        biomes = parse_biome_json(json.load(biomes_file))
+    return blocks, biomes, items
+
+
+def convert(
+    world: World,
+    blank_world: Path,
+    world_out: Path,
+    delete_out: bool = False,
+    interactive: bool = True,
+    workers: int | None = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    compression_level: int | None = None,
+    resume: bool = False,
+    shard: tuple[int, int] | None = None,
+) -> None:
+    "shard is (i, N) to only convert shard i of N, see shard.py"
+    output = prepare_world_out(
+        world, blank_world, world_out, delete_out, interactive, resume
+    )
+    if output is None:
+        return
+    job = ConversionJob(world, output, shard=shard)
+    try:
+        run_jobs([job], workers, queue_size, compression_level)
+        job.write_manifest()
+    finally:
+        output.close()
+    if job.failed:
+        raise job.error
+    job.finish()
 
-    chunk_converters = []
 
-    for position, entry in world.entries.items():
-        chunk_converters.append(ChunkConverter(position, entry, blocks))
+def convert_batch(
+    worlds_directory: Path,
+    blank_world: Path,
+    out_root: Path,
+    delete_out: bool = False,
+    workers: int | None = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    compression_level: int | None = None,
+    chunk_filter: ChunkFilter | None = None,
+    archive_format: str | None = None,
+    resume: bool = False,
+    shard: tuple[int, int] | None = None,
+) -> dict[Path, Exception]:
+    """
+    converts every world in a directory like minecraftWorlds into out_root, named by
+    world ID, a world that fails doesn't stop the others, returns the ones that failed,
+    archive_format is a suffix like ".zip" to write each world into an archive,
+    shard is (i, N) to only convert shard i of N of every world
+    """
+    failures = {}
+    jobs = []
+    out_root.mkdir(parents=True, exist_ok=True)
+    for world_path in find_worlds(worlds_directory):
+        world_out = out_root / f"{world_path.name}{archive_format or ''}"
+        try:
+            world = World(world_path, chunk_filter)
+            output = prepare_world_out(
+                world, blank_world, world_out, delete_out, False, resume
+            )
+        except Exception as error:
+            logger.error(f"could not start converting {world_path}", exc_info=error)
+            failures[world_path] = error
+            continue
+        if output is None:
+            world.close()
+            continue
+        jobs.append(ConversionJob(world, output, world_path.name, shard))
 
-    def convert_chunk(
-        chunk_converter: ChunkConverter,
-    ) -> tuple[tuple[int, int, int], EmptyChunk]:
-        chunk_converter.place_blocks()
-        return chunk_converter.region_position, chunk_converter.chunk
+    try:
+        run_jobs(jobs, workers, queue_size, compression_level)
+        for job in jobs:
+            job.write_manifest()
+    finally:
+        for job in jobs:
+            job.output.close()
+            job.world.close()
+    for job in jobs:
+        if job.failed:
+            failures[job.world.path] = job.error
+        else:
+            job.finish()
+    return failures
 
-    regions = {}
 
-    def process_region(
-        region_position: tuple[int, int, int], chunk_converters: list[EmptyChunk]
+def run_jobs(
+    jobs: list["ConversionJob"],
+    workers: int | None = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    compression_level: int | None = None,
+) -> None:
+    "converts the worlds of every job with one set of workers"
+    if not jobs:
+        return
+    blocks, biomes, items = load_mappings()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with (
+        ThreadPoolExecutor(workers) as io_executor,
+        ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(blocks, biomes, items)
+        ) as cpu_executor,
     ):
-        assert region_position not in regions
-        regions[region_position] = region_converter = RegionConverter(
-            world_out, region_position
+        asyncio.run(
+            convert_pipeline(
+                jobs,
+                io_executor,
+                cpu_executor,
+                workers,
+                queue_size,
+                compression_level,
+            )
         )
-        for chunk in chunk_converters:
-            region_converter.add_chunk(chunk)
-
-    def save_region(region_converter: RegionConverter) -> None:
-        region_converter.save()
-
-    chunk_regions = defaultdict(list)
-    region_converters = {}
-
-    class DummyPoolExecutorContext:
-        def map(self, func, iter):
-            for thing in iter:
-                yield func(thing)
-
-    class DummyPoolExecutor:
-        def __enter__(self):
-            return DummyPoolExecutorContext()
-
-        def __exit__(self, exc_type, exc_value, traceback):
-            return False
-
-    # disable threads
-    ThreadPoolExecutor = DummyPoolExecutor
-    with ThreadPoolExecutor() as executor:
-        for current_region_position, chunk in tqdm(
-            executor.map(convert_chunk, chunk_converters),
-            total=len(chunk_converters),
-            desc="Converting chunks",
-            unit="chunk",
-        ):
+
+
+# the block mappings of each process, set once so they aren't sent with every chunk
+_worker_blocks = None
+_worker_properties = None
+_worker_biomes = None
+_worker_items = None
+
+
+def _init_worker(blocks: dict, biomes: tuple[np.ndarray, dict], items: dict) -> None:
+    global _worker_blocks, _worker_properties, _worker_biomes, _worker_items
+    _worker_blocks = blocks
+    _worker_properties = BlockProperties(blocks)
+    _worker_biomes = biomes
+    _worker_items = items
+
+
+def read_section(
+    position: tuple[int, int, int], entry: Entry, neighbours: dict[tuple, Entry]
+) -> tuple:
+    "the block data, the NBT sections with the entities and the block data around it"
+    nbt_sections = [
+        entry.section(section[0]) for section in entry.sections if section[0] != 0
+    ]
+    neighbour_sections = {}
+    for offset, neighbour in neighbours.items():
+        try:
+            neighbour_sections[offset] = neighbour.data_chunk
+        except (ValueError, OSError):
+            # it's reported when that chunk is converted, here it's only left out
+            continue
+    return position, entry.data_chunk, nbt_sections, neighbour_sections
+
+
+def inflate_section(
+    position: tuple[int, int, int],
+    subchunk: Subchunk,
+    nbt_sections: list[Subchunk],
+    neighbour_sections: dict[tuple, Subchunk],
+) -> tuple:
+    # the neighbours stay compressed until they're in the worker, so less is pickled
+    return (
+        position,
+        subchunk.raw_decompressed,
+        [section.raw_decompressed for section in nbt_sections],
+        {
+            offset: section.compressed
+            for offset, section in neighbour_sections.items()
+            if section is not None
+        },
+    )
+
+
+def neighbour_keys(neighbours: dict[tuple, bytes]) -> dict[tuple, np.ndarray]:
+    "the keys of the compressed block data around a chunk, broken chunks are left out"
+    keys = {}
+    for offset, compressed in neighbours.items():
+        try:
+            keys[offset] = block_keys(BlockArrays(zlib.decompress(compressed)))
+        except (zlib.error, AssertionError, ValueError):
+            continue
+    return keys
+
+
+def convert_section(
+    position: tuple[int, int, int],
+    raw: bytes,
+    nbt_sections: list[bytes],
+    neighbours: dict[tuple, bytes],
+    compression_level: int = zlib.Z_DEFAULT_COMPRESSION,
+) -> tuple:
+    """
+    converts, encodes and compresses a chunk in one task, so only the compressed NBT
+    is sent back from the worker process instead of the whole chunk
+    """
+    chunk_converter = ChunkConverter(
+        position,
+        BlockArrays(raw),
+        _worker_blocks,
+        _worker_properties,
+        _worker_biomes,
+        _worker_items,
+    )
+    chunk_converter.place_blocks()
+    chunk_converter.convert_biomes()
+    chunk_converter.compute_lighting(neighbour_keys(neighbours))
+    chunk_converter.convert_entities(nbt_sections)
+    compressed = zlib.compress(encode_chunk(chunk_converter.chunk), compression_level)
+    return position, compressed, chunk_converter.unknown_blocks
+
+
+def region_position(position: tuple[int, int, int]) -> tuple[int, int, int]:
+    chunk_x, chunk_z, dimension = position
+    return chunk_x // 32, chunk_z // 32, dimension
+
+
+class _Done:
+    "put in a queue after the last item"
+
+
+class ConversionJob:
+    "a world being converted by convert_pipeline, every item in the pipeline belongs to one"
+
+    def __init__(
+        self,
+        world: World,
+        output: DirectoryOutput | ArchiveOutput,
+        name: str | None = None,
+        shard: tuple[int, int] | None = None,
+    ) -> None:
+        self.world = world
+        self.output = output
+        self.name = world.name if name is None else name
+        self.shard = shard
+        names = {
+            position: region_name(region_position(position))
+            for position in world.entries
+        }
+        self.world_regions = len(set(names.values()))
+        # a shard only converts its own regions, the other shards convert the rest
+        if shard is not None:
+            index, count = shard
+            names = {
+                position: name
+                for position, name in names.items()
+                if region_shard(name, count) == index
+            }
+        self.shard_regions = set(names.values())
+        # the chunks of regions a resumed conversion already saved are skipped
+        done = set() if output.journal is None else output.journal.done
+        self.entries = {
+            position: world.entries[position]
+            for position, name in names.items()
+            if name not in done
+        }
+        self.chunk_counts = Counter(
+            region_position(position) for position in self.entries
+        )
+        self.regions = {}
+        self.unknown_blocks = UnknownBlocks()
+        self.error = None
+        self.progress = None
+
+    def neighbours(self, position: tuple[int, int, int]) -> dict[tuple, Entry]:
+        "the chunks around a chunk by their offset, even ones this job doesn't convert"
+        chunk_x, chunk_z, dimension = position
+        neighbours = {}
+        for offset_x, offset_z in NEIGHBOUR_OFFSETS:
+            entry = self.world.entries.get(
+                (chunk_x + offset_x, chunk_z + offset_z, dimension)
+            )
+            if entry is not None:
+                neighbours[(offset_x, offset_z)] = entry
+        return neighbours
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    def fail(self, error: Exception) -> None:
+        # only the first error matters, the rest of the world is skipped after it
+        if self.error is None:
+            self.error = error
+            logger.error(f"converting {self.name} failed", exc_info=error)
+
+    def write_manifest(self) -> None:
+        "lists the regions of a shard once they're all saved, so they can be merged"
+        if self.shard is None or self.failed:
+            return
+        self.output.write(
+            MANIFEST_NAME,
+            shard_manifest(
+                self.shard,
+                index_hash(self.world),
+                repr(self.world.chunk_filter),
+                self.world_regions,
+                self.shard_regions,
+            ),
+        )
+
+    def finish(self) -> None:
+        if self.output.journal is not None:
+            self.output.journal.remove()
+        if self.unknown_blocks:
+            # one record, so it isn't cut short by the rate limit
+            summary = "\n".join(self.unknown_blocks.summary())
+            logger.warning(f"{self.name}: {summary}")
+
+
+async def _run_stage(
+    function,
+    executor: Executor,
+    inbox: asyncio.Queue,
+    outbox: asyncio.Queue | None,
+    concurrency: int,
+    progress: tqdm,
+) -> None:
+    loop = asyncio.get_running_loop()
+
+    async def worker() -> None:
+        while True:
+            item = await inbox.get()
+            if item is _Done:
+                # let the other workers of this stage see it too
+                await inbox.put(_Done)
+                return
+            job, *arguments = item
             try:
-                region_converter = region_converters[current_region_position]
+                if job.failed:
+                    continue
+                result = await loop.run_in_executor(executor, function, *arguments)
+            except Exception as error:
+                job.fail(error)
+                continue
+            finally:
+                progress.update()
+            if outbox is not None:
+                await outbox.put((job, *result))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    if outbox is not None:
+        await outbox.put(_Done)
+
+
+async def convert_pipeline(
+    jobs: list[ConversionJob],
+    io_executor: Executor,
+    cpu_executor: Executor,
+    workers: int,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    compression_level: int | None = None,
+) -> None:
+    """
+    converts the chunks in stages connected by bounded queues, so reading,
+    zlib and block conversion all happen at the same time, the chunks of every
+    job share the stages so the workers don't wait between worlds
+    """
+    if compression_level is None:
+        compression_level = zlib.Z_DEFAULT_COMPRESSION
+    chunk_total = sum(len(job.entries) for job in jobs)
+    region_total = sum(len(job.chunk_counts) for job in jobs)
+
+    stages = (
+        ("Reading", read_section, io_executor),
+        ("Inflating", inflate_section, io_executor),
+        (
+            "Converting",
+            partial(convert_section, compression_level=compression_level),
+            cpu_executor,
+        ),
+    )
+    queues = [asyncio.Queue(queue_size) for _ in range(len(stages) + 3)]
+    bars = [
+        tqdm(total=chunk_total, desc=name, unit="chunk", position=n)
+        for n, (name, function, executor) in enumerate(stages)
+    ]
+    save_bar = tqdm(
+        total=region_total,
+        desc="Saving regions",
+        unit="region",
+        position=len(stages),
+    )
+    if len(jobs) > 1:
+        for n, job in enumerate(jobs, len(stages) + 1):
+            job.progress = tqdm(
+                total=len(job.entries), desc=job.name, unit="chunk", position=n
+            )
+
+    async def feed() -> None:
+        for job in jobs:
+            for position, entry in job.entries.items():
+                if job.failed:
+                    break
+                await queues[0].put((job, position, entry, job.neighbours(position)))
+        await queues[0].put(_Done)
+
+    async def collect() -> None:
+        # a region is saved as soon as all of its chunks are encoded
+        inbox, outbox = queues[len(stages)], queues[len(stages) + 1]
+        while True:
+            item = await inbox.get()
+            if item is _Done:
+                break
+            job, (chunk_x, chunk_z, dimension), compressed, unknown_blocks = item
+            if job.failed:
+                continue
+            job.unknown_blocks.update(unknown_blocks)
+            current_region_position = region_position((chunk_x, chunk_z, dimension))
+            regions = job.regions
+            try:
+                region_converter = regions[current_region_position]
             except KeyError:
-                region_converter = region_converters[current_region_position] = (
-                    RegionConverter(world_out, current_region_position)
+                region_converter = regions[current_region_position] = RegionConverter(
+                    job.output.directory, current_region_position
                 )
-            region_converter.add_chunk(chunk)
-            # chunk_converters = chunk_regions[current_region_position]
-            # chunk_converters.append(chunk)
-        # tuple(
-        #     tqdm(
-        #         executor.map(
-        #             lambda keyvalue: process_region(*keyvalue), chunk_regions.items()
-        #         ),
-        #         total=len(chunk_regions),
-        #         desc="Adding chunks to regions",
-        #         unit="region",
-        #     )
-        # )
-
-        for region_converter in tqdm(
-            region_converters.values(), desc="Saving regions", unit="region"
-        ):
-            save_region(region_converter)
+            region_converter.add_chunk(chunk_x, chunk_z, compressed)
+            if job.progress is not None:
+                job.progress.update()
+            job.chunk_counts[current_region_position] -= 1
+            if not job.chunk_counts[current_region_position]:
+                await outbox.put((job, regions.pop(current_region_position)))
+        for job in jobs:
+            assert job.failed or not job.regions, "some regions were never completed"
+        await outbox.put(_Done)
+
+    async def write() -> None:
+        # regions that go into an archive are written here, one at a time, and
+        # every saved region is added to the journal
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await queues[-1].get()
+            if item is _Done:
+                break
+            job, name, data = item
+            if job.failed:
+                continue
+            try:
+                if data is not None:
+                    await loop.run_in_executor(
+                        io_executor, job.output.write, name, data
+                    )
+                if job.output.journal is not None:
+                    await loop.run_in_executor(
+                        io_executor, job.output.journal.add, name
+                    )
+            except Exception as error:
+                job.fail(error)
+
+    tasks = [asyncio.ensure_future(feed())]
+    for n, (name, function, executor) in enumerate(stages):
+        tasks.append(
+            asyncio.ensure_future(
+                _run_stage(
+                    function, executor, queues[n], queues[n + 1], workers, bars[n]
+                )
+            )
+        )
+    tasks.append(asyncio.ensure_future(collect()))
+    tasks.append(
+        asyncio.ensure_future(
+            # the chunks are already compressed, so saving a region is only I/O
+            _run_stage(
+                save_region,
+                io_executor,
+                queues[-2],
+                queues[-1],
+                workers,
+                save_bar,
+            )
+        )
+    )
+    tasks.append(asyncio.ensure_future(write()))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        for bar in (*bars, save_bar):
+            bar.close()
+        for job in jobs:
+            if job.progress is not None:
+                job.progress.close()
@@ -0,0 +1,117 @@
+"a command line utility to show which chunks changed between two backups of the same world"
+
+import sys
+import json
+import zlib
+import hashlib
+from pathlib import Path
+
+import click
+import numpy as np
+
+from .classes import World, Entry, BlockArrays
+
+
+def section_hashes(entry: Entry) -> dict[int, bytes]:
+    "a hash of the compressed bytes of each section, nothing is inflated"
+    return {
+        index: hashlib.blake2b(entry.section(index).compressed, digest_size=16).digest()
+        for index, position, compressed_size, decompressed_size in entry.sections
+    }
+
+
+def _keys(arrays: BlockArrays, count: int) -> np.ndarray:
+    "block IDs and data as (id << 4) | data, with missing subchunks filled with air"
+    keys = np.zeros((count, 16, 16, 16), np.uint16)
+    keys[: len(arrays)] = (arrays.ids.astype(np.uint16) << 4) | arrays.data
+    return keys
+
+
+def changed_voxels(old: Entry, new: Entry) -> int:
+    old_arrays = BlockArrays(old.data_chunk.raw_decompressed)
+    new_arrays = BlockArrays(new.data_chunk.raw_decompressed)
+    count = max(len(old_arrays), len(new_arrays))
+    return int(np.count_nonzero(_keys(old_arrays, count) != _keys(new_arrays, count)))
+
+
+def diff_worlds(old: World, new: World) -> dict:
+    """
+    compares two worlds chunk by chunk, only the chunks where a section's hash
+    differs are inflated to count the changed blocks, chunks that can't be read in
+    either world are reported as unreadable instead of stopping the diff
+    """
+    added = sorted(new.entries.keys() - old.entries.keys())
+    removed = sorted(old.entries.keys() - new.entries.keys())
+    modified = []
+    unreadable = []
+    for position in sorted(old.entries.keys() & new.entries.keys()):
+        old_entry, new_entry = old.entries[position], new.entries[position]
+        try:
+            old_hashes = section_hashes(old_entry)
+            new_hashes = section_hashes(new_entry)
+            if old_hashes == new_hashes:
+                continue
+            sections = sorted(
+                index
+                for index in old_hashes.keys() | new_hashes.keys()
+                if old_hashes.get(index) != new_hashes.get(index)
+            )
+            # the blocks are only in section 0, the other sections are only compared by hash
+            voxels = changed_voxels(old_entry, new_entry) if 0 in sections else 0
+        except (zlib.error, AssertionError, ValueError) as error:
+            unreadable.append({"position": position, "error": str(error)})
+            continue
+        modified.append(
+            {"position": position, "sections": sections, "changed_voxels": voxels}
+        )
+    return {
+        "added": added,
+        "removed": removed,
+        "modified": modified,
+        "unreadable": unreadable,
+    }
+
+
+@click.command()
+@click.argument("old", type=click.Path(exists=True, path_type=Path))
+@click.argument("new", type=click.Path(exists=True, path_type=Path))
+@click.option(
+    "-i",
+    "--world-id",
+    help="The world to compare when OLD and NEW are minecraftWorlds folders or Checkpoint backup zips",
+)
+@click.option("--json", "as_json", is_flag=True, help="Print the report as JSON")
+def main(old: Path, new: Path, world_id: str | None, as_json: bool) -> None:
+    with (
+        World(old, world_id=world_id) as old_world,
+        World(new, world_id=world_id) as new_world,
+    ):
+        report = diff_worlds(old_world, new_world)
+    if as_json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        for position in report["added"]:
+            print(f"+ {position}")
+        for position in report["removed"]:
+            print(f"- {position}")
+        for chunk in report["modified"]:
+            sections = ", ".join(str(index) for index in chunk["sections"])
+            print(
+                f"~ {chunk['position']} {chunk['changed_voxels']:d} blocks changed "
+                f"(sections {sections})"
+            )
+        for chunk in report["unreadable"]:
+            print(f"! {chunk['position']} unreadable: {chunk['error']}")
+        print(
+            f"{len(report['added']):d} added, {len(report['removed']):d} removed, "
+            f"{len(report['modified']):d} modified, "
+            f"{len(report['unreadable']):d} unreadable",
+            file=sys.stderr,
+        )
+    if any(report.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
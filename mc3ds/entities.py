@@ -0,0 +1,352 @@
+"maps the block entities and entities in the NBT sections of 3DS chunks to Java Edition 1.16.5"
+
+import json
+import uuid
+import logging
+
+from nbt import nbt
+
+from .nbt import (
+    Compound,
+    List,
+    TAG_BYTE,
+    TAG_SHORT,
+    TAG_INT,
+    TAG_LONG,
+    TAG_FLOAT,
+    TAG_DOUBLE,
+    TAG_BYTE_ARRAY,
+    TAG_STRING,
+    TAG_LIST,
+    TAG_COMPOUND,
+    TAG_INT_ARRAY,
+    TAG_LONG_ARRAY,
+)
+
+logger = logging.getLogger(__name__)
+
+# 3DS block entity IDs, the ones that aren't block entities in Java Edition are dropped
+BLOCK_ENTITY_IDS = {
+    "Banner": "banner",
+    "Beacon": "beacon",
+    "Bed": "bed",
+    "BrewingStand": "brewing_stand",
+    "Chest": "chest",
+    "CommandBlock": "command_block",
+    "Comparator": "comparator",
+    "DaylightDetector": "daylight_detector",
+    "Dispenser": "dispenser",
+    "Dropper": "dropper",
+    "EnchantTable": "enchanting_table",
+    "EndGateway": "end_gateway",
+    "EndPortal": "end_portal",
+    "EnderChest": "ender_chest",
+    "Furnace": "furnace",
+    "Hopper": "hopper",
+    "Jukebox": "jukebox",
+    "MobSpawner": "mob_spawner",
+    "ShulkerBox": "shulker_box",
+    "Sign": "sign",
+    "Skull": "skull",
+}
+
+# the entity type is the lowest byte of the numeric ID
+ENTITY_TYPES = {
+    10: "chicken",
+    11: "cow",
+    12: "pig",
+    13: "sheep",
+    14: "wolf",
+    15: "villager",
+    16: "mooshroom",
+    17: "squid",
+    18: "rabbit",
+    19: "bat",
+    20: "iron_golem",
+    21: "snow_golem",
+    22: "ocelot",
+    23: "horse",
+    24: "donkey",
+    25: "mule",
+    26: "skeleton_horse",
+    27: "zombie_horse",
+    28: "polar_bear",
+    32: "zombie",
+    33: "creeper",
+    34: "skeleton",
+    35: "spider",
+    36: "zombified_piglin",
+    37: "slime",
+    38: "enderman",
+    39: "silverfish",
+    40: "cave_spider",
+    41: "ghast",
+    42: "magma_cube",
+    43: "blaze",
+    44: "zombie_villager",
+    45: "witch",
+    46: "stray",
+    47: "husk",
+    48: "wither_skeleton",
+    49: "guardian",
+    50: "elder_guardian",
+    52: "wither",
+    53: "ender_dragon",
+    54: "shulker",
+    55: "endermite",
+    61: "armor_stand",
+    64: "item",
+    65: "tnt",
+    69: "experience_orb",
+    84: "minecart",
+    90: "boat",
+}
+# string identifiers that changed name in Java Edition
+RENAMED_ENTITIES = {
+    "zombie_pigman": "zombified_piglin",
+    "villager_v2": "villager",
+    "zombie_villager_v2": "zombie_villager",
+    "xp_orb": "experience_orb",
+}
+JAVA_ENTITIES = frozenset(ENTITY_TYPES.values())
+
+# the only keys that are decoded, everything else in a section is skipped
+KEYS = frozenset(
+    {
+        "id",
+        "identifier",
+        "x",
+        "y",
+        "z",
+        "Pos",
+        "Motion",
+        "Rotation",
+        "UniqueID",
+        "CustomName",
+        "Attributes",
+        "OnGround",
+        "FallDistance",
+        "Fire",
+        "Air",
+        "Invulnerable",
+        "Persistent",
+        "IsBaby",
+        "Item",
+        "Items",
+        "Text",
+        "EntityId",
+        "experience value",
+    }
+)
+
+BABY_AGE = -24000
+
+_JAVA_TAGS = {
+    TAG_BYTE: nbt.TAG_Byte,
+    TAG_SHORT: nbt.TAG_Short,
+    TAG_INT: nbt.TAG_Int,
+    TAG_LONG: nbt.TAG_Long,
+    TAG_FLOAT: nbt.TAG_Float,
+    TAG_DOUBLE: nbt.TAG_Double,
+    TAG_STRING: nbt.TAG_String,
+}
+_JAVA_ARRAYS = {
+    TAG_BYTE_ARRAY: nbt.TAG_Byte_Array,
+    TAG_INT_ARRAY: nbt.TAG_Int_Array,
+    TAG_LONG_ARRAY: nbt.TAG_Long_Array,
+}
+_JAVA_LIST_TYPES = {
+    **_JAVA_TAGS,
+    **_JAVA_ARRAYS,
+    TAG_LIST: nbt.TAG_List,
+    TAG_COMPOUND: nbt.TAG_Compound,
+}
+
+
+def java_tag(tag_id: int, value, name: str | None = None) -> nbt.TAG:
+    "a decoded value as a tag of the NBT library that writes regions"
+    if tag_id in _JAVA_TAGS:
+        return _JAVA_TAGS[tag_id](name=name, value=value)
+    elif tag_id in _JAVA_ARRAYS:
+        tag = _JAVA_ARRAYS[tag_id](name=name)
+        if tag_id == TAG_BYTE_ARRAY:
+            tag.value = bytearray(value)
+        else:
+            tag.value = [int(item) for item in value]
+        return tag
+    elif tag_id == TAG_LIST:
+        # empty lists of any type are written as lists of bytes
+        tag = nbt.TAG_List(
+            name=name, type=_JAVA_LIST_TYPES.get(value.tag_id, nbt.TAG_Byte)
+        )
+        tag.tags.extend(java_tag(value.tag_id, item) for item in value)
+        return tag
+    elif tag_id == TAG_COMPOUND:
+        tag = nbt.TAG_Compound()
+        tag.name = name
+        tag.tags.extend(
+            java_tag(value.types[key], item, key) for key, item in value.items()
+        )
+        return tag
+    raise ValueError(f"unknown tag type {tag_id:d}")
+
+
+def _text(text: str) -> str:
+    "Java Edition names and sign lines are JSON text components"
+    return json.dumps({"text": text})
+
+
+def _copy(
+    compound: Compound,
+    java: Compound,
+    name: str,
+    tag_id: int,
+    convert=None,
+    java_name: str | None = None,
+) -> None:
+    "copies a value if it's there, with the tag type and name Java Edition uses"
+    if name in compound:
+        value = compound[name]
+        java.set(
+            name if java_name is None else java_name,
+            tag_id,
+            value if convert is None else convert(value),
+        )
+
+
+def _uuid(unique_id: int) -> list[int]:
+    "a UUID made from the 64-bit unique ID, as the 4 signed ints Java Edition stores"
+    value = uuid.uuid5(uuid.NAMESPACE_OID, f"3ds:{unique_id:d}").int
+    words = [(value >> shift) & 0xFFFFFFFF for shift in (96, 64, 32, 0)]
+    return [word - (1 << 32) if word & 0x80000000 else word for word in words]
+
+
+def _doubles(values: List) -> List:
+    return List(TAG_DOUBLE, (float(value) for value in values))
+
+
+def convert_item(item: Compound, items: dict) -> Compound | None:
+    "an item in an inventory, or None if it's unknown"
+    damage = item.get("Damage", 0)
+    if "Name" in item:
+        name = item["Name"]
+    else:
+        item_id = item.get("id", 0)
+        name = items.get((item_id, damage))
+        if name is None:
+            name = items.get((item_id, 0))
+            if name is None:
+                return None
+        else:
+            # the data value was part of the item, not its durability
+            damage = 0
+    if name == "minecraft:air":
+        return None
+    java = Compound()
+    java.set("id", TAG_STRING, name)
+    java.set("Count", TAG_BYTE, item.get("Count", 1))
+    _copy(item, java, "Slot", TAG_BYTE)
+    if damage:
+        tag = Compound()
+        tag.set("Damage", TAG_INT, damage)
+        java.set("tag", TAG_COMPOUND, tag)
+    return java
+
+
+def _convert_items(items_list: List, items: dict) -> List:
+    result = List(TAG_COMPOUND)
+    for item in items_list:
+        converted = convert_item(item, items)
+        if converted is not None:
+            result.append(converted)
+    return result
+
+
+def is_block_entity(compound: Compound) -> bool:
+    return isinstance(compound.get("id"), str) and all(
+        key in compound for key in ("x", "y", "z")
+    )
+
+
+def is_entity(compound: Compound) -> bool:
+    return "Pos" in compound
+
+
+def convert_block_entity(compound: Compound, items: dict) -> Compound | None:
+    "a Java Edition block entity, or None if there's nothing to convert it to"
+    java_id = BLOCK_ENTITY_IDS.get(compound["id"])
+    if java_id is None:
+        logger.debug(f"skipped block entity {compound['id']}")
+        return None
+    java = Compound()
+    java.set("id", TAG_STRING, f"minecraft:{java_id}")
+    for key in ("x", "y", "z"):
+        java.set(key, TAG_INT, compound[key])
+    java.set("keepPacked", TAG_BYTE, 0)
+    _copy(compound, java, "CustomName", TAG_STRING, _text)
+    if "Items" in compound:
+        java.set("Items", TAG_LIST, _convert_items(compound["Items"], items))
+    if java_id == "sign":
+        lines = compound.get("Text", "").split("\n")
+        for n in range(4):
+            java.set(
+                f"Text{n + 1:d}", TAG_STRING, _text(lines[n] if n < len(lines) else "")
+            )
+    elif java_id == "mob_spawner" and "EntityId" in compound:
+        entity_type = ENTITY_TYPES.get(compound["EntityId"] & 0xFF)
+        if entity_type is not None:
+            spawn_data = Compound()
+            spawn_data.set("id", TAG_STRING, f"minecraft:{entity_type}")
+            java.set("SpawnData", TAG_COMPOUND, spawn_data)
+    return java
+
+
+def entity_type(compound: Compound) -> str | None:
+    "the Java Edition name of an entity's type"
+    identifier = compound.get("identifier")
+    if isinstance(identifier, str):
+        name = identifier.rpartition(":")[2]
+        name = RENAMED_ENTITIES.get(name, name)
+        return name if name in JAVA_ENTITIES else None
+    entity_id = compound.get("id")
+    if isinstance(entity_id, int):
+        return ENTITY_TYPES.get(entity_id & 0xFF)
+    return None
+
+
+def convert_entity(compound: Compound, items: dict) -> Compound | None:
+    "a Java Edition entity, or None if its type isn't converted"
+    name = entity_type(compound)
+    if name is None:
+        logger.debug(f"skipped entity {compound.get('identifier', compound.get('id'))}")
+        return None
+    java = Compound()
+    java.set("id", TAG_STRING, f"minecraft:{name}")
+    java.set("Pos", TAG_LIST, _doubles(compound["Pos"]))
+    motion = compound.get("Motion", (0.0, 0.0, 0.0))
+    java.set("Motion", TAG_LIST, _doubles(motion))
+    rotation = compound.get("Rotation", (0.0, 0.0))
+    java.set("Rotation", TAG_LIST, List(TAG_FLOAT, rotation))
+    if "UniqueID" in compound:
+        java.set("UUID", TAG_INT_ARRAY, _uuid(compound["UniqueID"]))
+    _copy(compound, java, "CustomName", TAG_STRING, _text)
+    _copy(compound, java, "OnGround", TAG_BYTE)
+    _copy(compound, java, "FallDistance", TAG_FLOAT)
+    _copy(compound, java, "Fire", TAG_SHORT)
+    _copy(compound, java, "Air", TAG_SHORT)
+    _copy(compound, java, "Invulnerable", TAG_BYTE)
+    _copy(compound, java, "Persistent", TAG_BYTE, java_name="PersistenceRequired")
+    for attribute in compound.get("Attributes", ()):
+        if attribute.get("Name") == "minecraft:health" and "Current" in attribute:
+            java.set("Health", TAG_FLOAT, attribute["Current"])
+    if compound.get("IsBaby"):
+        java.set("Age", TAG_INT, BABY_AGE)
+
+    if name == "item":
+        item = convert_item(compound.get("Item", Compound()), items)
+        if item is None:
+            return None
+        java.set("Item", TAG_COMPOUND, item)
+    elif name == "experience_orb":
+        java.set("Value", TAG_SHORT, compound.get("experience value", 1))
+    return java
@@ -1,10 +1,18 @@
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import os
+import gzip
 import json
+import zlib
 import logging
 
-from anvil import Region, Chunk, Block
+import numpy as np
 
-from .convert import parse_block_json
+from .convert import parse_block_json, SECTOR_SIZE
+from .nbt import NBTReader, Compound
+from .archive import ArchivePath
+from .classes import MAX_SUBCHUNKS
+from .writer import CDBWriter, encode_block_data, compress_block_data, recover_all
 
 logger = logging.getLogger(__name__)
 
@@ -12,33 +20,270 @@ OVERWORLD = 0
 NETHER = 1
 END = 2
 
+DIMENSION_PATHS = {OVERWORLD: Path(), NETHER: Path("DIM-1"), END: Path("DIM1")}
+# the layer of 4x4x4 biome cells at sea level, the 3DS only has one biome per column
+BIOME_LAYER = 64 // 4
+# the only parts of a chunk that are decoded
+CHUNK_KEYS = frozenset({"DataVersion", "Level"})
+COMPRESSION_GZIP = 1
+COMPRESSION_ZLIB = 2
+COMPRESSION_NONE = 3
+# the most chunks the writer holds before they are committed, 4 full regions
+COMMIT_CHUNKS = 4 * 32 * 32
 
-class RegionJavaConverter:
-    def __init__(self, world_directory: Path, position: tuple[int, int, int]) -> None:
-        self.region_x, self.region_z, self.dimension = position
-        self.world_directory = Path(world_directory)
-        if self.dimension == OVERWORLD:
-            dimension_path = self.world_directory
-        elif self.dimension == NETHER:
-            dimension_path = self.world_directory / "DIM-1"
-        elif self.dimension == END:
-            dimension_path = self.world_directory / "DIM1"
+
+def region_files(java_world: Path) -> list[tuple[Path, int]]:
+    "every region file of every dimension, as (path, dimension)"
+    result = []
+    for dimension, dimension_path in DIMENSION_PATHS.items():
+        region_directory = java_world / dimension_path / "region"
+        if region_directory.is_dir():
+            result.extend(
+                (path, dimension) for path in sorted(region_directory.glob("r.*.*.mca"))
+            )
+    return result
+
+
+def read_region(path: Path):
+    "yields (chunk_x, chunk_z, chunk) for every chunk in a region file, chunk_x and chunk_z are within the region"
+    data = path.read_bytes()
+    for index in range(1024):
+        location = int.from_bytes(data[index * 4 : index * 4 + 4], "big")
+        offset = location >> 8
+        if not offset:
+            continue
+        start = offset * SECTOR_SIZE
+        length = int.from_bytes(data[start : start + 4], "big")
+        compression = data[start + 4]
+        payload = data[start + 5 : start + 4 + length]
+        if compression == COMPRESSION_ZLIB:
+            raw = zlib.decompress(payload)
+        elif compression == COMPRESSION_GZIP:
+            raw = gzip.decompress(payload)
+        elif compression == COMPRESSION_NONE:
+            raw = payload
         else:
-            raise ValueError("invalid dimension")
-        self.region_file = (
-            dimension_path / "region" / f"r.{self.region_x:d}.{self.region_z:d}.mca"
-        )
-        with open(self.region_file, "rb") as region_handle:
-            self.region = Region.from_file(region_handle)
+            raise ValueError(
+                f"chunk {index:d} of {path} has compression {compression:d}"
+            )
+        name, chunk = NBTReader(raw, byteorder="big").read_root(CHUNK_KEYS)
+        yield index % 32, index // 32, chunk
+
+
+def unpack_block_states(block_states: np.ndarray, palette_size: int) -> np.ndarray:
+    "the palette index of each block in a section, in [y][z][x] order"
+    bits = max(4, int(palette_size - 1).bit_length())
+    longs = block_states.astype(np.uint64)
+    per_long = 64 // bits
+    # since 20w17a indexes don't cross longs, but older worlds (and anvil) still
+    # pack them across longs, which only takes fewer longs when bits doesn't divide 64
+    if len(longs) == -(-4096 // per_long):
+        shifts = np.arange(per_long, dtype=np.uint64) * np.uint64(bits)
+        indexes = (longs[:, np.newaxis] >> shifts) & np.uint64((1 << bits) - 1)
+        indexes = indexes.ravel()[:4096]
+    else:
+        stream = np.unpackbits(longs.astype("<u8").view(np.uint8), bitorder="little")
+        stream = stream[: 4096 * bits].reshape(4096, bits)
+        indexes = stream.astype(np.uint16) @ (1 << np.arange(bits, dtype=np.uint16))
+    return indexes.astype(np.uint16).reshape(16, 16, 16)
+
+
+class JavaBlocks:
+    "finds the 3DS block ID and data of Java Edition block states"
+
+    def __init__(self, blocks: dict) -> None:
+        # every legacy block of each name, the first one wins if they're the same
+        self._by_name = {}
+        for (block_id, data), block in sorted(blocks.items()):
+            name = f"{block.namespace}:{block.id}"
+            self._by_name.setdefault(name, []).append(
+                (block.properties, (block_id << 4) | data)
+            )
+        self._cache = {}
+        self.unknown = set()
+
+    def key(self, state: Compound) -> int:
+        "(id << 4) | data, unknown blocks are air"
+        name = state.get("Name", "minecraft:air")
+        properties = state.get("Properties", {})
+        cache_key = (name, tuple(sorted(properties.items())))
+        try:
+            return self._cache[cache_key]
+        except KeyError:
+            pass
+        candidates = self._by_name.get(name)
+        if candidates is None:
+            self.unknown.add(name)
+            key = 0
+        else:
+            # the legacy block with the most matching properties, and no different ones
+            matching = [
+                (len(legacy), key)
+                for legacy, key in candidates
+                if all(
+                    properties.get(property_name) == value
+                    for property_name, value in legacy.items()
+                )
+            ]
+            key = (
+                max(matching, key=lambda match: match[0])[1]
+                if matching
+                else candidates[0][1]
+            )
+        self._cache[cache_key] = key
+        return key
+
+    def palette_keys(self, palette: list) -> np.ndarray:
+        return np.array([self.key(state) for state in palette], np.uint16)
+
 
-        chunk = self.region.get_chunk(1, 1)
-        for block in chunk.stream_chunk():
-            if block.name() != "minecraft:air":
-                logger.debug(block)
+def read_chunk_blocks(chunk: Compound, java_blocks: JavaBlocks) -> np.ndarray | None:
+    """
+    the 3DS (id << 4) | data of every block in a chunk, in [subchunk][x][z][y] order
+    like BlockArrays, or None if the chunk has no blocks
+    """
+    level = chunk["Level"]
+    sections = {}
+    for section in level.get("Sections", ()):
+        section_y = section.get("Y", -1)
+        if "BlockStates" not in section or "Palette" not in section:
+            continue
+        palette_keys = java_blocks.palette_keys(section["Palette"])
+        if not 0 <= section_y < MAX_SUBCHUNKS:
+            if palette_keys.any():
+                logger.debug(
+                    f"chunk {level.get('xPos')}, {level.get('zPos')} has blocks in section {section_y:d}, which the 3DS can't store"
+                )
+            continue
+        indexes = unpack_block_states(section["BlockStates"], len(palette_keys))
+        # [y][z][x] to [x][z][y]
+        sections[section_y] = palette_keys[indexes].transpose(2, 1, 0)
+    if not sections:
+        return None
+    keys = np.zeros((max(sections) + 1, 16, 16, 16), np.uint16)
+    for section_y, section_keys in sections.items():
+        keys[section_y] = section_keys
+    return keys
 
 
-def convert_java(world_3ds: Path, java_world: Path, delete_out: bool) -> None:
+def parse_java_biome_json(raw_biomes: dict) -> tuple[np.ndarray, dict]:
+    "the opposite of convert.parse_biome_json, from Java to 3DS biome IDs, -1 for unknown biomes"
+    lookup = np.full(256, -1, np.int32)
+    # the lowest 3DS ID wins when several are the same Java biome
+    for biome_3ds, biome_java in sorted(
+        raw_biomes["biomes"].items(), key=lambda item: -int(item[0])
+    ):
+        lookup[biome_java] = int(biome_3ds)
+    defaults = {}
+    for dimension, biome_java in raw_biomes["defaults"].items():
+        defaults[int(dimension)] = max(int(lookup[biome_java]), 0)
+    return lookup, defaults
+
+
+def read_chunk_biomes(
+    chunk: Compound, biomes: tuple[np.ndarray, dict], dimension: int
+) -> np.ndarray:
+    "the 3DS biome of each column in [z][x] order"
+    lookup, defaults = biomes
+    java_biomes = chunk["Level"].get("Biomes")
+    if java_biomes is None or len(java_biomes) != 1024:
+        return np.full((16, 16), defaults[dimension], np.uint8)
+    # 1.16 has a biome for every 4x4x4 cube, in [y][z][x] order
+    cells = lookup[np.clip(java_biomes.reshape(64, 4, 4)[BIOME_LAYER], 0, 255)]
+    cells = np.where(cells < 0, defaults[dimension], cells)
+    return cells.repeat(4, axis=0).repeat(4, axis=1).astype(np.uint8)
+
+
+_worker_java_blocks = None
+_worker_biomes = None
+
+
+def _init_worker(blocks: dict, biomes: tuple[np.ndarray, dict]) -> None:
+    global _worker_java_blocks, _worker_biomes
+    _worker_java_blocks = JavaBlocks(blocks)
+    _worker_biomes = biomes
+
+
+def convert_region(
+    path: Path, dimension: int, compression_level: int
+) -> tuple[dict, set]:
+    """
+    the compressed 3DS block data of every chunk in a region, ready for
+    CDBWriter.add_compressed, this runs in a worker process so the chunks are
+    encoded and compressed in parallel
+    """
+    region_x, region_z = (int(part) for part in path.name.split(".")[1:3])
+    java_blocks = _worker_java_blocks
+    chunks = {}
+    for chunk_x, chunk_z, chunk in read_region(path):
+        keys = read_chunk_blocks(chunk, java_blocks)
+        if keys is None:
+            continue
+        raw = encode_block_data(
+            (keys >> 4).astype(np.uint8),
+            (keys & 0xF).astype(np.uint8),
+            read_chunk_biomes(chunk, _worker_biomes, dimension),
+        )
+        position = (region_x * 32 + chunk_x, region_z * 32 + chunk_z, dimension)
+        chunks[position] = compress_block_data(raw, compression_level)
+    return chunks, set(java_blocks.unknown)
+
+
+def convert_java(
+    world_3ds: Path,
+    java_world: Path,
+    delete_out: bool,
+    workers: int | None = None,
+    compression_level: int | None = None,
+) -> None:
+    "writes the blocks and biomes of every chunk in the Java world into the 3DS world"
+    if isinstance(world_3ds, ArchivePath):
+        raise ValueError("worlds in a backup zip can't be written, extract it first")
     with open(Path(__file__).parent / "data" / "blocks.json") as blocks_file:
         raw_blocks = json.load(blocks_file)
     blocks = parse_block_json(raw_blocks)
-    test_converter = RegionJavaConverter(java_world, (0, 0, 0))
+    with open(Path(__file__).parent / "data" / "biomes.json") as biomes_file:
+        biomes = parse_java_biome_json(json.load(biomes_file))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if compression_level is None:
+        compression_level = zlib.Z_DEFAULT_COMPRESSION
+    # a write that was interrupted is rolled back, the chunks are all written again
+    recover_all(world_3ds / "db" / "cdb")
+    writer = CDBWriter(world_3ds / "db" / "cdb")
+    regions = region_files(java_world)
+    unknown = set()
+    chunk_count = 0
+    skipped = 0
+    # each region is read, encoded and compressed by one process, the writer only
+    # has to copy the compressed chunks into the slot files
+    with ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(blocks, biomes)
+    ) as executor:
+        results = executor.map(
+            convert_region,
+            [path for path, dimension in regions],
+            [dimension for path, dimension in regions],
+            [compression_level] * len(regions),
+        )
+        for (path, dimension), (chunks, region_unknown) in zip(regions, results):
+            logger.debug(f"converted {len(chunks):d} chunks from {path}")
+            for position, sections in chunks.items():
+                try:
+                    writer.add_compressed(position, sections)
+                except ValueError as error:
+                    logger.error(f"{error}, it was skipped")
+                    skipped += 1
+                else:
+                    chunk_count += 1
+            unknown.update(region_unknown)
+            # committing as it goes keeps the pending chunks small, and every
+            # commit leaves a world the 3DS can load
+            if len(writer) >= COMMIT_CHUNKS:
+                writer.commit()
+    writer.commit()
+    for name in sorted(unknown):
+        logger.warning(f"Java block {name} has no 3DS block, it was replaced with air")
+    logger.info(f"wrote {chunk_count:d} chunks from {len(regions):d} regions")
+    if skipped:
+        logger.warning(f"{skipped:d} chunks were too big for the 3DS and were skipped")
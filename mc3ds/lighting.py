@@ -0,0 +1,326 @@
+"heightmaps and light for converted chunks, so Minecraft doesn't have to relight them"
+
+import numpy as np
+
+# the number of keys, a key is the block ID and data of a block as (id << 4) | data
+KEY_COUNT = 1 << 12
+WORLD_HEIGHT = 256
+MAX_LIGHT = 15
+# light gets dimmer with every block, so only blocks this close to a chunk can light it
+LIGHT_REACH = MAX_LIGHT - 1
+
+# light emitted by blocks, blocks with a lit property only emit light when it's true
+LIGHT_EMISSION = {
+    "beacon": 15,
+    "brewing_stand": 1,
+    "brown_mushroom": 1,
+    "dragon_egg": 1,
+    "end_gateway": 15,
+    "end_portal": 15,
+    "end_portal_frame": 1,
+    "end_rod": 14,
+    "ender_chest": 7,
+    "fire": 15,
+    "furnace": 13,
+    "glowstone": 15,
+    "jack_o_lantern": 15,
+    "lava": 15,
+    "magma_block": 3,
+    "nether_portal": 11,
+    "redstone_lamp": 15,
+    "redstone_ore": 9,
+    "redstone_torch": 7,
+    "redstone_wall_torch": 7,
+    "sea_lantern": 15,
+    "torch": 14,
+    "wall_torch": 14,
+}
+
+# blocks that let light through without reducing it, like Block.propagatesSkylightDown
+TRANSPARENT = {
+    "air",
+    "anvil",
+    "barrier",
+    "brewing_stand",
+    "cactus",
+    "cake",
+    "cauldron",
+    "chest",
+    "chipped_anvil",
+    "cobweb",
+    "cocoa",
+    "chorus_flower",
+    "chorus_plant",
+    "damaged_anvil",
+    "daylight_detector",
+    "dragon_egg",
+    "enchanting_table",
+    "end_portal_frame",
+    "end_rod",
+    "ender_chest",
+    "farmland",
+    "fire",
+    "flower_pot",
+    "glass",
+    "glass_pane",
+    "grass_path",
+    "hopper",
+    "iron_bars",
+    "ladder",
+    "lever",
+    "lily_pad",
+    "moving_piston",
+    "nether_portal",
+    "piston_head",
+    "redstone_wire",
+    "repeater",
+    "comparator",
+    "snow",
+    "structure_void",
+    "sugar_cane",
+    "trapped_chest",
+    "tripwire",
+    "tripwire_hook",
+    "vine",
+}
+TRANSPARENT_SUFFIXES = (
+    "_banner",
+    "_bed",
+    "_button",
+    "_carpet",
+    "_door",
+    "_fence",
+    "_fence_gate",
+    "_pane",
+    "_pressure_plate",
+    "_rail",
+    "_sapling",
+    "_sign",
+    "_skull",
+    "_slab",
+    "_stained_glass",
+    "_stairs",
+    "_stem",
+    "_torch",
+    "_trapdoor",
+    "_wall",
+    "rail",
+    "sign",
+    "torch",
+)
+
+# full blocks that still let light through, reduced by 1 like Minecraft does
+TRANSLUCENT = {
+    "beacon",
+    "frosted_ice",
+    "ice",
+    "lava",
+    "slime_block",
+    "spawner",
+    "water",
+}
+
+# blocks without collision that don't count for MOTION_BLOCKING, fluids still count
+NO_COLLISION = {
+    "air",
+    "beetroots",
+    "carrots",
+    "cobweb",
+    "cocoa",
+    "comparator",
+    "dead_bush",
+    "end_gateway",
+    "end_portal",
+    "end_rod",
+    "fern",
+    "fire",
+    "flower_pot",
+    "grass",
+    "ladder",
+    "large_fern",
+    "lever",
+    "lily_pad",
+    "nether_portal",
+    "nether_wart",
+    "potatoes",
+    "redstone_wire",
+    "repeater",
+    "snow",
+    "structure_void",
+    "sugar_cane",
+    "tall_grass",
+    "tripwire",
+    "tripwire_hook",
+    "vine",
+    "wheat",
+    # flowers
+    "allium",
+    "azure_bluet",
+    "blue_orchid",
+    "brown_mushroom",
+    "dandelion",
+    "lilac",
+    "orange_tulip",
+    "oxeye_daisy",
+    "peony",
+    "pink_tulip",
+    "poppy",
+    "red_mushroom",
+    "red_tulip",
+    "rose_bush",
+    "sunflower",
+    "white_tulip",
+}
+NO_COLLISION_PREFIXES = ("potted_",)
+NO_COLLISION_SUFFIXES = (
+    "_button",
+    "_carpet",
+    "_rail",
+    "_sapling",
+    "_skull",
+    "_stem",
+    "_torch",
+    "rail",
+    "torch",
+)
+
+FLUIDS = {"water", "lava"}
+
+
+def _is_transparent(name: str, properties: dict) -> bool:
+    if properties.get("type") == "double":
+        # double slabs are full blocks
+        return False
+    return name in TRANSPARENT or name.endswith(TRANSPARENT_SUFFIXES)
+
+
+def _has_collision(name: str) -> bool:
+    if name in NO_COLLISION or name.startswith(NO_COLLISION_PREFIXES):
+        return False
+    return not name.endswith(NO_COLLISION_SUFFIXES)
+
+
+class BlockProperties:
+    "lookup tables of the lighting properties of every block, indexed by key"
+
+    def __init__(self, blocks: dict) -> None:
+        # anything that isn't mapped is converted to a netherite block, which is opaque
+        self.opacity = np.full(KEY_COUNT, MAX_LIGHT, np.uint8)
+        self.emission = np.zeros(KEY_COUNT, np.uint8)
+        self.not_air = np.ones(KEY_COUNT, bool)
+        self.blocks_motion = np.ones(KEY_COUNT, bool)
+        self.fluid = np.zeros(KEY_COUNT, bool)
+        self.leaves = np.zeros(KEY_COUNT, bool)
+        for (block_id, block_data), block in blocks.items():
+            key = (block_id << 4) | block_data
+            name = block.id
+            properties = block.properties
+            if _is_transparent(name, properties):
+                self.opacity[key] = 0
+            elif name in TRANSLUCENT or name.endswith("_leaves"):
+                self.opacity[key] = 1
+            if properties.get("lit") != "false":
+                self.emission[key] = LIGHT_EMISSION.get(name, 0)
+            self.not_air[key] = name != "air"
+            self.blocks_motion[key] = _has_collision(name) and name not in FLUIDS
+            self.fluid[key] = name in FLUIDS or properties.get("waterlogged") == "true"
+            self.leaves[key] = name.endswith("_leaves")
+        # air is (0, 0), other data values of 0 aren't mapped
+        self.opacity[0] = 0
+        self.emission[0] = 0
+        self.not_air[0] = False
+        self.blocks_motion[0] = False
+
+
+def heightmap(mask: np.ndarray) -> np.ndarray:
+    "the height above the top block in each column that matches the mask, indexed [x][z]"
+    height = mask.shape[2]
+    found = mask.any(axis=2)
+    # search from the top by reversing the columns
+    top = height - np.argmax(mask[:, :, ::-1], axis=2)
+    return np.where(found, top, 0)
+
+
+def pack_heightmap(heights: np.ndarray) -> list[int]:
+    "packs a heightmap into longs like 1.16, 9 bits each and never split between longs"
+    bits = (WORLD_HEIGHT + 1).bit_length()
+    per_long = 64 // bits
+    # heightmaps are stored in [z][x] order
+    values = heights.T.ravel().astype(np.uint64)
+    padding = -len(values) % per_long
+    values = np.concatenate((values, np.zeros(padding, np.uint64)))
+    shifts = np.arange(per_long, dtype=np.uint64) * np.uint64(bits)
+    packed = np.bitwise_or.reduce(values.reshape(-1, per_long) << shifts, axis=1)
+    return packed.tolist()
+
+
+def _spread(light: np.ndarray, cost: np.ndarray) -> np.ndarray:
+    "spreads light to neighbouring blocks until it stops changing, like a flood fill"
+    light = light.astype(np.int16)
+    for _ in range(MAX_LIGHT - 1):
+        neighbours = np.zeros_like(light)
+        for axis in range(3):
+            forward = [slice(None)] * 3
+            backward = [slice(None)] * 3
+            forward[axis] = slice(1, None)
+            backward[axis] = slice(None, -1)
+            forward, backward = tuple(forward), tuple(backward)
+            np.maximum(neighbours[forward], light[backward], out=neighbours[forward])
+            np.maximum(neighbours[backward], light[forward], out=neighbours[backward])
+        spread = np.maximum(light, neighbours - cost)
+        if np.array_equal(spread, light):
+            break
+        light = spread
+    return light.astype(np.uint8)
+
+
+def sky_light(opacity: np.ndarray) -> np.ndarray:
+    "sky light for a chunk with nothing but sky above it, indexed [x][z][y]"
+    light = np.empty(opacity.shape, np.int16)
+    above = np.full(opacity.shape[:2], MAX_LIGHT, np.int16)
+    for y in range(opacity.shape[2] - 1, -1, -1):
+        layer = opacity[:, :, y]
+        # full sky light goes straight down through transparent blocks without getting dimmer
+        above = np.where(
+            (above == MAX_LIGHT) & (layer == 0),
+            MAX_LIGHT,
+            np.maximum(above - np.maximum(layer, 1), 0),
+        )
+        light[:, :, y] = above
+    return _spread(light, np.maximum(opacity, 1).astype(np.int16))
+
+
+def block_light(opacity: np.ndarray, emission: np.ndarray) -> np.ndarray:
+    if not emission.any():
+        return np.zeros(opacity.shape, np.uint8)
+    return _spread(emission, np.maximum(opacity, 1).astype(np.int16))
+
+
+def surrounding_keys(
+    chunks: dict[tuple[int, int], np.ndarray], height: int
+) -> np.ndarray:
+    """
+    the keys of a chunk and of the blocks around it that can light it, indexed [x][z][y]
+    with the chunk at [LIGHT_REACH:LIGHT_REACH + 16], chunks maps an offset like (-1, 0)
+    to the keys of that chunk, (0, 0) is the chunk itself and missing chunks are air
+    """
+    size = 16 + 2 * LIGHT_REACH
+    padded = np.zeros((size, size, height), np.uint16)
+    for (offset_x, offset_z), keys in chunks.items():
+        # where the chunk starts, it's cut off at the edges of the padded area
+        start_x = LIGHT_REACH + offset_x * 16
+        start_z = LIGHT_REACH + offset_z * 16
+        min_x, max_x = max(start_x, 0), min(start_x + 16, size)
+        min_z, max_z = max(start_z, 0), min(start_z + 16, size)
+        top = min(keys.shape[2], height)
+        padded[min_x:max_x, min_z:max_z, :top] = keys[
+            min_x - start_x : max_x - start_x, min_z - start_z : max_z - start_z, :top
+        ]
+    return padded
+
+
+def pack_light(light: np.ndarray, section_y: int) -> bytes:
+    "packs one section of light into nibbles in [y][z][x] order, the low nibble first"
+    section = light[:, :, section_y * 16 : (section_y + 1) * 16]
+    values = section.transpose(2, 1, 0).ravel()
+    return (values[0::2] | (values[1::2] << 4)).astype(np.uint8).tobytes()
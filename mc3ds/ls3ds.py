@@ -9,6 +9,7 @@ from warnings import warn
 import click
 
 from .nbt import NBT
+from .archive import is_archive, archive_worlds
 
 
 def get_world_name_stream(stream: BytesIO) -> str:
@@ -17,20 +18,36 @@ def get_world_name_stream(stream: BytesIO) -> str:
 
 
 def get_world_name(level_dat: Path) -> str:
-    with open(level_dat, "rb") as stream:
+    with level_dat.open("rb") as stream:
         return get_world_name_stream(stream)
 
 
-def get_world_names(directory: Path) -> dict[Path, str]:
-    result = {}
+def find_worlds(directory: Path) -> list[Path]:
+    """
+    the world folders in a directory like minecraftWorlds, or the directory itself if it's a world,
+    the directory can also be a Checkpoint backup zip
+    """
+    if is_archive(directory):
+        return archive_worlds(directory)
     if (directory / "level.dat").is_file():
+        return [directory]
+    return sorted(
+        subdirectory
+        for subdirectory in directory.iterdir()
+        if subdirectory.is_dir() and (subdirectory / "level.dat").is_file()
+    )
+
+
+def get_world_names(directory: Path) -> dict[str, str]:
+    "the name of each world by its world ID, which is the name of its folder"
+    result = {}
+    if not is_archive(directory) and (directory / "level.dat").is_file():
         result[directory.name] = get_world_name(directory / "level.dat")
     else:
-        for subdirectory in directory.iterdir():
-            if subdirectory.is_dir() and (subdirectory / "level.dat").is_file():
-                if subdirectory.name in result:
-                    warn("duplicate world IDs")
-                result[subdirectory] = get_world_name(subdirectory / "level.dat")
+        for subdirectory in find_worlds(directory):
+            if subdirectory.name in result:
+                warn("duplicate world IDs")
+            result[subdirectory.name] = get_world_name(subdirectory / "level.dat")
     return result
 
 
@@ -38,13 +55,13 @@ def get_world_names(directory: Path) -> dict[Path, str]:
 @click.argument(
     "directory",
     default=os.path.curdir,
-    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    type=click.Path(exists=True, path_type=Path),
 )
 def main(directory: Path) -> None:
     world_names = get_world_names(directory)
     if world_names:
-        for path, world_name in world_names.items():
-            print(f"{path} - {world_name}")
+        for world_id, world_name in world_names.items():
+            print(f"{world_id} - {world_name}")
     else:
         print("no worlds found", file=sys.stderr)
         sys.exit(1)
@@ -1,11 +1,192 @@
 from io import BytesIO
 from typing import Any
+import struct
+
+import numpy as np
 
 from .xnbt import XNBT
 from pynbt import NBTFile
 
 BEDROCK_HEADER_SIZE: int = 0x8
 
+(
+    TAG_END,
+    TAG_BYTE,
+    TAG_SHORT,
+    TAG_INT,
+    TAG_LONG,
+    TAG_FLOAT,
+    TAG_DOUBLE,
+    TAG_BYTE_ARRAY,
+    TAG_STRING,
+    TAG_LIST,
+    TAG_COMPOUND,
+    TAG_INT_ARRAY,
+    TAG_LONG_ARRAY,
+) = range(13)
+
+_ubyte = struct.Struct("B")
+_FIXED_FORMATS = {
+    TAG_BYTE: "b",
+    TAG_SHORT: "h",
+    TAG_INT: "i",
+    TAG_LONG: "q",
+    TAG_FLOAT: "f",
+    TAG_DOUBLE: "d",
+}
+# 3DS and Bedrock Edition NBT is little-endian, Java Edition NBT is big-endian
+_PREFIXES = {"little": "<", "big": ">"}
+_FIXED = {
+    byteorder: {
+        tag_id: struct.Struct(f"{prefix}{format}")
+        for tag_id, format in _FIXED_FORMATS.items()
+    }
+    for byteorder, prefix in _PREFIXES.items()
+}
+_USHORT = {
+    byteorder: struct.Struct(f"{prefix}H") for byteorder, prefix in _PREFIXES.items()
+}
+_FIXED_SIZES = {
+    tag_id: struct.calcsize(format) for tag_id, format in _FIXED_FORMATS.items()
+}
+_ARRAYS = {TAG_INT_ARRAY: "i4", TAG_LONG_ARRAY: "i8"}
+_ARRAY_SIZES = {TAG_BYTE_ARRAY: 1, TAG_INT_ARRAY: 4, TAG_LONG_ARRAY: 8}
+
+
+class Compound(dict):
+    "a decoded compound, types has the tag ID of each value"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.types = {}
+
+    def set(self, name: str, tag_id: int, value: Any) -> None:
+        self[name] = value
+        self.types[name] = tag_id
+
+
+class List(list):
+    "a decoded list, tag_id is the tag ID of its items"
+
+    def __init__(self, tag_id: int = TAG_END, items=()) -> None:
+        super().__init__(items)
+        self.tag_id = tag_id
+
+
+class NBTReader:
+    """
+    a cursor over NBT, values become Python values and the payloads that aren't
+    needed are skipped without being decoded, int and long arrays are numpy arrays
+    that share the buffer
+    """
+
+    def __init__(
+        self, buffer: bytes, position: int = 0, byteorder: str = "little"
+    ) -> None:
+        self.buffer = buffer
+        self.position = position
+        self._prefix = _PREFIXES[byteorder]
+        self._fixed = _FIXED[byteorder]
+        self._ushort = _USHORT[byteorder]
+        self._int = self._fixed[TAG_INT]
+
+    def _unpack(self, fixed: struct.Struct) -> Any:
+        try:
+            (value,) = fixed.unpack_from(self.buffer, self.position)
+        except struct.error:
+            raise ValueError(f"NBT is truncated at 0x{self.position:X}")
+        self.position += fixed.size
+        return value
+
+    def _skip(self, size: int) -> None:
+        if size < 0 or self.position + size > len(self.buffer):
+            raise ValueError(f"NBT is truncated at 0x{self.position:X}")
+        self.position += size
+
+    def read_string(self) -> str:
+        size = self._unpack(self._ushort)
+        start = self.position
+        self._skip(size)
+        return self.buffer[start : self.position].decode("utf-8", "replace")
+
+    def read_payload(self, tag_id: int) -> Any:
+        if tag_id in self._fixed:
+            return self._unpack(self._fixed[tag_id])
+        elif tag_id == TAG_STRING:
+            return self.read_string()
+        elif tag_id == TAG_COMPOUND:
+            return self.read_compound()
+        elif tag_id == TAG_LIST:
+            item_id = self._unpack(_ubyte)
+            count = max(self._unpack(self._int), 0)
+            return List(item_id, [self.read_payload(item_id) for _ in range(count)])
+        elif tag_id in _ARRAY_SIZES:
+            count = self._unpack(self._int)
+            start = self.position
+            self._skip(count * _ARRAY_SIZES[tag_id])
+            if tag_id == TAG_BYTE_ARRAY:
+                return self.buffer[start : self.position]
+            return np.frombuffer(
+                self.buffer, f"{self._prefix}{_ARRAYS[tag_id]}", count, start
+            )
+        raise ValueError(f"unknown tag type {tag_id:d} at 0x{self.position:X}")
+
+    def skip_payload(self, tag_id: int) -> None:
+        if tag_id in _FIXED_SIZES:
+            self._skip(_FIXED_SIZES[tag_id])
+        elif tag_id == TAG_STRING:
+            self._skip(self._unpack(self._ushort))
+        elif tag_id == TAG_COMPOUND:
+            while True:
+                item_id = self._unpack(_ubyte)
+                if item_id == TAG_END:
+                    break
+                self._skip(self._unpack(self._ushort))
+                self.skip_payload(item_id)
+        elif tag_id == TAG_LIST:
+            item_id = self._unpack(_ubyte)
+            count = max(self._unpack(self._int), 0)
+            if item_id in _FIXED_SIZES:
+                self._skip(count * _FIXED_SIZES[item_id])
+            else:
+                for _ in range(count):
+                    self.skip_payload(item_id)
+        elif tag_id in _ARRAY_SIZES:
+            self._skip(self._unpack(self._int) * _ARRAY_SIZES[tag_id])
+        else:
+            raise ValueError(f"unknown tag type {tag_id:d} at 0x{self.position:X}")
+
+    def read_compound(self, keys: frozenset | None = None) -> Compound:
+        "keys are the only values that are decoded, the rest are skipped"
+        compound = Compound()
+        while True:
+            tag_id = self._unpack(_ubyte)
+            if tag_id == TAG_END:
+                return compound
+            name = self.read_string()
+            if keys is None or name in keys:
+                compound.set(name, tag_id, self.read_payload(tag_id))
+            else:
+                self.skip_payload(tag_id)
+
+    def read_root(self, keys: frozenset | None = None) -> tuple[str, Compound]:
+        tag_id = self._unpack(_ubyte)
+        if tag_id != TAG_COMPOUND:
+            raise ValueError(f"root tag at 0x{self.position - 1:X} is not a compound")
+        name = self.read_string()
+        return name, self.read_compound(keys)
+
+
+def read_compounds(buffer: bytes, keys: frozenset | None = None) -> list[Compound]:
+    "every root compound in a section, sections have them one after another"
+    reader = NBTReader(buffer)
+    compounds = []
+    # some sections are padded with zeros after the last compound
+    while reader.position < len(buffer) and buffer[reader.position] != TAG_END:
+        name, compound = reader.read_root(keys)
+        compounds.append(compound)
+    return compounds
+
 
 class NewNBT:
     def __init__(self, buffer: bytes) -> None:
@@ -0,0 +1,270 @@
+"where a converted Java world is written, a folder or a zip or tar that's written as the conversion goes"
+
+import os
+import io
+import gzip
+import time
+import shutil
+import zipfile
+import tarfile
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import nbtlib
+from nbtlib.tag import String
+
+ZIP_SUFFIXES = (".zip",)
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+# files that are already compressed are stored as they are
+COMPRESSED_SUFFIXES = (".mca", ".zip", ".dat")
+JOURNAL_NAME = "3dschunker-journal.txt"
+
+
+def archive_suffix(path: Path) -> str | None:
+    name = path.name.lower()
+    for suffix in ZIP_SUFFIXES + TAR_SUFFIXES:
+        if name.endswith(suffix):
+            return suffix
+    return None
+
+
+def fsync_directory(path: Path) -> None:
+    "makes sure new files in a folder are still there after a crash"
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # folders can't be opened on Windows, where syncing the file is enough
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_durably(path: Path, data: bytes) -> None:
+    "writes a file and only returns once it's on disk, so it can be added to the journal"
+    new = not path.exists()
+    with open(path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    if new:
+        fsync_directory(path.parent)
+
+
+class RegionJournal:
+    """
+    the regions of a folder output that are completely saved, one name per line after
+    the hash of the index they were converted from and the chunk filter, so an
+    interrupted conversion can be resumed
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        index_hash: str,
+        chunk_filter: str = "None",
+        resume: bool = False,
+    ) -> None:
+        self.path = path / JOURNAL_NAME
+        self.done = set()
+        self._lock = threading.Lock()
+        if resume:
+            self._load(index_hash, chunk_filter)
+            self._file = open(self.path, "a")
+        else:
+            self._file = open(self.path, "x")
+            self._write(f"index {index_hash}\nfilter {chunk_filter}\n")
+            fsync_directory(path)
+
+    def _load(self, index_hash: str, chunk_filter: str) -> None:
+        try:
+            lines = self.path.read_text().split("\n")
+        except FileNotFoundError:
+            raise ValueError(
+                f"{self.path.parent} has no conversion journal, it's already finished"
+            )
+        # the last line is empty, or was cut off while it was written
+        lines.pop()
+        if not lines or lines[0] != f"index {index_hash}":
+            raise ValueError(
+                f"{self.path.parent} was converted from a different world or save, it can't be resumed"
+            )
+        if len(lines) < 2 or lines[1] != f"filter {chunk_filter}":
+            raise ValueError(
+                f"{self.path.parent} was converted with different chunk options, resume it with the same ones"
+            )
+        self.done.update(lines[2:])
+
+    def _write(self, text: str) -> None:
+        self._file.write(text)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def add(self, name: str) -> None:
+        with self._lock:
+            self._write(f"{name}\n")
+            self.done.add(name)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def remove(self) -> None:
+        "the conversion finished, so there's nothing left to resume"
+        self.close()
+        self.path.unlink()
+
+
+def is_finished(path: Path, level_name: str) -> bool:
+    """
+    whether a folder is a conversion that already finished, which removed its journal,
+    the level name has to match so another world isn't mistaken for it
+    """
+    if (path / JOURNAL_NAME).exists():
+        return False
+    level = nbtlib.load(path / "level.dat")
+    if str(level["Data"].get("LevelName", "")) != level_name:
+        raise ValueError(
+            f"{path} was converted from a different world, it can't be resumed"
+        )
+    return True
+
+
+class DirectoryOutput:
+    "writes the world into a folder, regions are written by the workers themselves"
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.directory = path
+        self.journal = None
+
+    def write(self, name: str, data: bytes) -> None:
+        path = self.path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    def close(self) -> None:
+        if self.journal is not None:
+            self.journal.close()
+
+
+class ArchiveOutput(ABC):
+    "writes the world into an archive, every file is added as soon as it's ready"
+
+    directory = None
+    journal = None
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # the world is in a folder inside the archive, so it can be extracted into saves
+        self.root = path.name[: -len(archive_suffix(path))]
+        self._lock = threading.Lock()
+
+    def write(self, name: str, data: bytes) -> None:
+        with self._lock:
+            self._write(f"{self.root}/{name}", data)
+
+    @abstractmethod
+    def _write(self, name: str, data: bytes) -> None:
+        pass
+
+
+class ZipOutput(ArchiveOutput):
+    def __init__(self, path: Path) -> None:
+        super().__init__(path)
+        self._zip_file = zipfile.ZipFile(path, "x")
+
+    def _write(self, name: str, data: bytes) -> None:
+        info = zipfile.ZipInfo(name, time.localtime()[:6])
+        if name.endswith(COMPRESSED_SUFFIXES):
+            info.compress_type = zipfile.ZIP_STORED
+        else:
+            info.compress_type = zipfile.ZIP_DEFLATED
+        # regions are written straight into the zip instead of being buffered again
+        with self._zip_file.open(
+            info, "w", force_zip64=len(data) > 0x7FFFFFFF
+        ) as member:
+            member.write(data)
+
+    def close(self) -> None:
+        self._zip_file.close()
+
+
+class TarOutput(ArchiveOutput):
+    def __init__(self, path: Path) -> None:
+        super().__init__(path)
+        compression = {
+            ".tar.gz": "gz",
+            ".tgz": "gz",
+            ".tar.bz2": "bz2",
+            ".tbz2": "bz2",
+            ".tar.xz": "xz",
+            ".txz": "xz",
+        }.get(archive_suffix(path), "")
+        self._tar_file = tarfile.open(path, f"x:{compression}")
+
+    def _write(self, name: str, data: bytes) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self._tar_file.addfile(info, io.BytesIO(data))
+
+    def close(self) -> None:
+        self._tar_file.close()
+
+
+def open_output(path: Path) -> DirectoryOutput | ArchiveOutput:
+    suffix = archive_suffix(path)
+    if suffix is None:
+        return DirectoryOutput(path)
+    elif suffix in ZIP_SUFFIXES:
+        return ZipOutput(path)
+    else:
+        return TarOutput(path)
+
+
+def _is_archive(path: Path) -> bool:
+    return path.is_file() and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+def check_old_output(path: Path) -> None:
+    "makes sure an existing output is an old converted world before it's deleted"
+    if archive_suffix(path) is None:
+        if not path.is_dir() or not (path / "level.dat").is_file():
+            raise FileExistsError(
+                "world output folder already exists, and is not a Java savefile, did you select the right folder?"
+            )
+    elif not _is_archive(path):
+        raise FileExistsError(
+            "world output file already exists, and is not an archive, did you select the right file?"
+        )
+
+
+def remove_output(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink()
+
+
+def write_blank_world(
+    output: DirectoryOutput | ArchiveOutput, blank_world: Path, level_name: str
+) -> None:
+    "copies the blank world into the output, with the level name changed"
+    for path in sorted(blank_world.rglob("*")):
+        if not path.is_file():
+            continue
+        name = path.relative_to(blank_world).as_posix()
+        if name == "level.dat":
+            level = nbtlib.load(path)
+            level["Data"]["LevelName"] = String(level_name)
+            buffer = io.BytesIO()
+            level.write(buffer, level.byteorder)
+            data = buffer.getvalue()
+            if level.gzipped:
+                data = gzip.compress(data)
+        else:
+            data = path.read_bytes()
+        output.write(name, data)
@@ -0,0 +1,313 @@
+"""
+a command line utility that renders top-down maps of 3DS worlds as PNG tile pyramids,
+straight from the block data so worlds can be previewed before they're converted
+"""
+
+import os
+import sys
+import json
+import zlib
+import struct
+import logging
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import numpy as np
+
+from .classes import World, CDBDirectory, Entry, BlockArrays
+from .convert import parse_block_json, NETHER
+from .stats import DIMENSION_NAMES, KEY_COUNT
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+# chunks along each side of a tile at full detail
+TILE_CHUNKS = TILE_SIZE // 16
+WORLD_HEIGHT = 128
+# blocks that are missing from blocks.json are still drawn, so they show up
+UNKNOWN_COLOR = (255, 0, 255, 255)
+# how much brighter the highest block is than the lowest
+HEIGHT_SHADE = 0.6
+# how much brighter or darker a block is when it's higher or lower than the one north of it
+RELIEF_SHADE = 0.08
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def load_colors() -> np.ndarray:
+    "the RGBA color of every (id << 4) | data, blocks like air and glass are see-through"
+    with open(Path(__file__).parent / "data" / "blocks.json") as blocks_file:
+        blocks = parse_block_json(json.load(blocks_file))
+    with open(Path(__file__).parent / "data" / "colors.json") as colors_file:
+        colors = json.load(colors_file)["colors"]
+    lookup = np.empty((KEY_COUNT, 4), np.uint8)
+    lookup[:] = UNKNOWN_COLOR
+    # air with any data
+    lookup[:16] = 0
+    for (block_id, data), block in blocks.items():
+        color = colors.get(block.id)
+        if color is None:
+            lookup[(block_id << 4) | data] = 0
+        else:
+            lookup[(block_id << 4) | data] = (*bytes.fromhex(color[1:]), 255)
+    return lookup
+
+
+def top_blocks(
+    arrays: BlockArrays, visible: np.ndarray, below_roof: bool = False
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    the highest visible block of each column and its height in [z][x] order, -1 for
+    columns without one, below_roof skips the blocks above the highest see-through
+    block so the nether isn't just its bedrock roof
+    """
+    count = len(arrays)
+    if count == 0:
+        # a chunk without subchunks is all air
+        return np.zeros((16, 16), np.uint16), np.full((16, 16), -1, np.intp)
+    keys = (arrays.ids.astype(np.uint16) << 4) | arrays.data
+    # [subchunk][x][z][y] to [z][x][height]
+    columns = keys.transpose(2, 1, 0, 3).reshape(16, 16, count * 16)
+    shown = visible[columns]
+    if below_roof:
+        # a see-through block somewhere above, so the top of the world isn't counted
+        see_through = np.logical_or.accumulate(~shown[..., ::-1], axis=-1)[..., ::-1]
+        shown[..., :-1] &= see_through[..., 1:]
+        shown[..., -1] = False
+    top = count * 16 - 1 - np.argmax(shown[..., ::-1], axis=-1)
+    found = shown.any(axis=-1)
+    top_keys = np.take_along_axis(columns, top[..., np.newaxis], axis=-1)[..., 0]
+    return np.where(found, top_keys, 0), np.where(found, top, -1)
+
+
+def shade(colors: np.ndarray, heights: np.ndarray) -> np.ndarray:
+    "RGBA pixels that are brighter the higher they are, with relief from the block to the north"
+    factor = 1 + HEIGHT_SHADE * (heights / (WORLD_HEIGHT - 1) - 0.5)
+    north = np.vstack((heights[:1], heights[:-1]))
+    factor += RELIEF_SHADE * np.sign(heights - north)
+    pixels = colors.astype(np.float32)
+    pixels[..., :3] *= factor[..., np.newaxis]
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+def encode_png(
+    pixels: np.ndarray, compression_level: int = zlib.Z_DEFAULT_COMPRESSION
+) -> bytes:
+    "an RGBA image as a PNG, every row uses filter type 0"
+    height, width, channels = pixels.shape
+    assert channels == 4
+    rows = np.zeros((height, width * 4 + 1), np.uint8)
+    rows[:, 1:] = pixels.reshape(height, width * 4)
+
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return b"".join(
+            (
+                struct.pack(">I", len(data)),
+                chunk_type,
+                data,
+                struct.pack(">I", zlib.crc32(chunk_type + data)),
+            )
+        )
+
+    return b"".join(
+        (
+            PNG_SIGNATURE,
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+            chunk(b"IDAT", zlib.compress(rows.tobytes(), compression_level)),
+            chunk(b"IEND", b""),
+        )
+    )
+
+
+def tile_path(out: Path, dimension: int, level: int, tile: tuple[int, int]) -> Path:
+    tile_x, tile_z = tile
+    return out / DIMENSION_NAMES[dimension] / str(level) / f"{tile_x:d}_{tile_z:d}.png"
+
+
+def write_tile(path: Path, pixels: np.ndarray) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(encode_png(pixels))
+
+
+_worker_colors = None
+_worker_visible = None
+# kept between tiles, so the headers of each slot file are only read once per worker
+_worker_cdb_directories = {}
+
+
+def _init_worker() -> None:
+    global _worker_colors, _worker_visible
+    _worker_colors = load_colors()
+    _worker_visible = _worker_colors[:, 3] != 0
+
+
+def render_tile(
+    cdb_path: Path,
+    dimension: int,
+    tile: tuple[int, int],
+    chunks: list[tuple[tuple[int, int, int], int, int]],
+    out: Path,
+) -> tuple[tuple[int, int], np.ndarray]:
+    """
+    renders and writes one tile at full detail, chunks are (position, slot, subfile),
+    this runs in a worker process
+    """
+    try:
+        cdb_directory = _worker_cdb_directories[cdb_path]
+    except KeyError:
+        cdb_directory = _worker_cdb_directories[cdb_path] = CDBDirectory(cdb_path)
+    keys = np.zeros((TILE_SIZE, TILE_SIZE), np.uint16)
+    heights = np.full((TILE_SIZE, TILE_SIZE), -1, np.int16)
+    tile_x, tile_z = tile
+    for position, slot, subfile in chunks:
+        cdb_file = cdb_directory[slot]
+        try:
+            entry = Entry(
+                position, slot, subfile, cdb_file.read_header(subfile), cdb_file
+            )
+            arrays = BlockArrays(entry.data_chunk.raw_decompressed)
+        except Exception as error:
+            logger.error(f"could not read chunk {position}", exc_info=error)
+            continue
+        chunk_keys, chunk_heights = top_blocks(
+            arrays, _worker_visible, below_roof=dimension == NETHER
+        )
+        x = (position[0] - tile_x * TILE_CHUNKS) * 16
+        z = (position[1] - tile_z * TILE_CHUNKS) * 16
+        keys[z : z + 16, x : x + 16] = chunk_keys
+        heights[z : z + 16, x : x + 16] = chunk_heights
+    pixels = shade(_worker_colors[keys], heights)
+    write_tile(tile_path(out, dimension, 0, tile), pixels)
+    return tile, pixels
+
+
+def downsample(tiles: dict[tuple[int, int], np.ndarray]) -> dict:
+    "the next level of the pyramid, each tile is made from 2x2 tiles at half the size"
+    children = {}
+    for (tile_x, tile_z), pixels in tiles.items():
+        children.setdefault((tile_x // 2, tile_z // 2), []).append(
+            ((tile_x % 2, tile_z % 2), pixels)
+        )
+    parents = {}
+    for parent, quarters in children.items():
+        canvas = np.zeros((TILE_SIZE * 2, TILE_SIZE * 2, 4), np.float32)
+        for (offset_x, offset_z), pixels in quarters:
+            canvas[
+                offset_z * TILE_SIZE : (offset_z + 1) * TILE_SIZE,
+                offset_x * TILE_SIZE : (offset_x + 1) * TILE_SIZE,
+            ] = pixels
+        blocks = canvas.reshape(TILE_SIZE, 2, TILE_SIZE, 2, 4)
+        alpha = blocks[..., 3].sum(axis=(1, 3))
+        # weighted by alpha, so the edges of the world don't turn dark
+        color = (blocks[..., :3] * blocks[..., 3:]).sum(axis=(1, 3))
+        pixels = np.zeros((TILE_SIZE, TILE_SIZE, 4), np.uint8)
+        pixels[..., :3] = color / np.maximum(alpha, 1)[..., np.newaxis]
+        pixels[..., 3] = alpha / 4
+        parents[parent] = pixels
+    return parents
+
+
+def fits(tiles: dict[tuple[int, int], np.ndarray]) -> bool:
+    """
+    whether the tiles fit in 2x2 tiles, the tiles at -1 and 0 never end up in the same
+    tile so a dimension can't always be made into one tile
+    """
+    xs = [tile_x for tile_x, tile_z in tiles]
+    zs = [tile_z for tile_x, tile_z in tiles]
+    return max(xs) - min(xs) < 2 and max(zs) - min(zs) < 2
+
+
+def render_world(
+    world: World,
+    out: Path,
+    dimensions: set[int] | None = None,
+    workers: int | None = None,
+) -> dict[int, int]:
+    """
+    writes out/<dimension>/<level>/<x>_<z>.png, level 0 has one pixel per block and each
+    level after it has half as many, up to the level where the dimension fits in 2x2 tiles,
+    returns the number of levels of each dimension
+    """
+    tiles = {}
+    for position, entry in world.entries.items():
+        chunk_x, chunk_z, dimension = position
+        if dimensions is not None and dimension not in dimensions:
+            continue
+        tile = (chunk_x // TILE_CHUNKS, chunk_z // TILE_CHUNKS)
+        tiles.setdefault(dimension, {}).setdefault(tile, []).append(
+            (position, entry.slot, entry.subfile)
+        )
+    if workers is None:
+        workers = os.cpu_count() or 1
+    levels = {}
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as executor:
+        for dimension, dimension_tiles in sorted(tiles.items()):
+            results = executor.map(
+                render_tile,
+                [world.cdb.path] * len(dimension_tiles),
+                [dimension] * len(dimension_tiles),
+                dimension_tiles.keys(),
+                dimension_tiles.values(),
+                [out] * len(dimension_tiles),
+            )
+            level_tiles = dict(results)
+            level = 0
+            while not fits(level_tiles):
+                level += 1
+                level_tiles = downsample(level_tiles)
+                paths = [tile_path(out, dimension, level, tile) for tile in level_tiles]
+                # a list so any error is raised here
+                list(executor.map(write_tile, paths, level_tiles.values()))
+            levels[dimension] = level + 1
+            logger.info(
+                f"rendered {len(dimension_tiles):d} tiles of the {DIMENSION_NAMES[dimension]} in {level + 1:d} levels"
+            )
+    return levels
+
+
+@click.command()
+@click.argument("path", type=click.Path(exists=True, path_type=Path))
+@click.argument("out", type=click.Path(file_okay=False, path_type=Path))
+@click.option(
+    "-i",
+    "--world-id",
+    help="The world to render when PATH is a minecraftWorlds folder or a Checkpoint backup zip",
+)
+@click.option(
+    "-d",
+    "--dimension",
+    "dimensions",
+    type=click.Choice(list(DIMENSION_NAMES.values())),
+    multiple=True,
+    help="Only render this dimension, can be used more than once",
+)
+@click.option(
+    "-j",
+    "--workers",
+    type=click.IntRange(min=1),
+    help="How many tiles to render at once, the number of CPUs if it's not given",
+)
+def main(
+    path: Path,
+    out: Path,
+    world_id: str | None,
+    dimensions: tuple[str],
+    workers: int | None,
+) -> None:
+    "renders top-down maps of a world into OUT, as a pyramid of PNG tiles for each dimension"
+    dimension_ids = {
+        dimension_id
+        for dimension_id, name in DIMENSION_NAMES.items()
+        if name in dimensions
+    }
+    with World(path, world_id=world_id) as world:
+        levels = render_world(world, out, dimension_ids or None, workers)
+    for dimension, level_count in levels.items():
+        print(
+            f"{out / DIMENSION_NAMES[dimension]}: {level_count:d} levels",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+splitting one conversion between machines, each shard converts the regions that are
+assigned to it and 3dsmerge puts the shards back together into one Java world
+"""
+
+import sys
+import json
+import zlib
+from pathlib import Path
+
+import click
+
+from .output import (
+    JOURNAL_NAME,
+    open_output,
+    check_old_output,
+    remove_output,
+)
+
+MANIFEST_NAME = "3dschunker-shard.json"
+
+
+def parse_shard(text: str) -> tuple[int, int]:
+    "i/N, the shard i out of N shards, i counts from 0"
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"{text} isn't a shard like 0/4") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"shard {index:d} of {count:d} doesn't exist")
+    return index, count
+
+
+def region_shard(name: str, count: int) -> int:
+    """
+    the shard that converts a region, from the region's path inside the world so every
+    machine splits the world the same way
+    """
+    return zlib.crc32(name.encode()) % count
+
+
+def shard_manifest(
+    shard: tuple[int, int],
+    index_hash: str,
+    chunk_filter: str,
+    world_regions: int,
+    regions: set[str],
+) -> bytes:
+    """
+    what a finished shard converted, index_hash and chunk_filter are what the journal
+    records, world_regions is how many regions all the shards have
+    """
+    index, count = shard
+    manifest = {
+        "shard": index,
+        "shards": count,
+        "index": index_hash,
+        "filter": chunk_filter,
+        "world_regions": world_regions,
+        "regions": sorted(regions),
+    }
+    return json.dumps(manifest, indent=2).encode() + b"\n"
+
+
+def read_manifest(shard_path: Path) -> dict:
+    if not shard_path.is_dir():
+        raise ValueError(
+            f"{shard_path} isn't a folder, shards can only be merged from folders"
+        )
+    if (shard_path / JOURNAL_NAME).exists():
+        raise ValueError(f"{shard_path} didn't finish converting, resume it first")
+    try:
+        with open(shard_path / MANIFEST_NAME) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        raise ValueError(f"{shard_path} isn't a finished shard") from None
+
+
+def check_shards(manifests: dict[Path, dict]) -> None:
+    "makes sure the shards are all the shards of the same conversion and cover every region"
+    first = next(iter(manifests.values()))
+    count = first["shards"]
+    shard_paths = {}
+    regions = {}
+    for shard_path, manifest in manifests.items():
+        if manifest.get("index") != first.get("index"):
+            raise ValueError(f"{shard_path} was converted from a different save")
+        if manifest.get("filter") != first.get("filter"):
+            raise ValueError(
+                f"{shard_path} was converted with different chunk options from the other shards"
+            )
+        if (manifest["shards"], manifest["world_regions"]) != (
+            count,
+            first["world_regions"],
+        ):
+            raise ValueError(
+                f"{shard_path} was split differently from the other shards"
+            )
+        if manifest["shard"] in shard_paths:
+            raise ValueError(
+                f"{shard_path} and {shard_paths[manifest['shard']]} are both shard {manifest['shard']:d}"
+            )
+        shard_paths[manifest["shard"]] = shard_path
+        for name in manifest["regions"]:
+            if region_shard(name, count) != manifest["shard"]:
+                raise ValueError(f"{name} in {shard_path} belongs to another shard")
+            if not (shard_path / name).is_file():
+                raise ValueError(f"{shard_path} is missing {name}")
+            regions[name] = shard_path
+    missing = sorted(set(range(count)) - shard_paths.keys())
+    if missing:
+        raise ValueError(
+            f"shards {', '.join(str(index) for index in missing)} of {count:d} are missing"
+        )
+    if len(regions) != first["world_regions"]:
+        raise ValueError(
+            f"the shards have {len(regions):d} of the {first['world_regions']:d} regions"
+        )
+
+
+def merge_shards(
+    shard_paths: list[Path], world_out: Path, delete_out: bool = False
+) -> int:
+    """
+    combines the shard folders into one world, which can be a folder or an archive,
+    returns the number of regions
+    """
+    manifests = {shard_path: read_manifest(shard_path) for shard_path in shard_paths}
+    check_shards(manifests)
+    if world_out.exists():
+        check_old_output(world_out)
+        if not delete_out:
+            raise FileExistsError("world output already exists")
+        remove_output(world_out)
+    region_count = 0
+    output = open_output(world_out)
+    try:
+        first = min(shard_paths, key=lambda shard_path: manifests[shard_path]["shard"])
+        # every shard has the same level.dat and other files, so they come from the first
+        for path in sorted(first.rglob("*")):
+            name = path.relative_to(first).as_posix()
+            if path.is_file() and path.suffix != ".mca" and name != MANIFEST_NAME:
+                output.write(name, path.read_bytes())
+        for shard_path, manifest in manifests.items():
+            for name in manifest["regions"]:
+                output.write(name, (shard_path / name).read_bytes())
+                region_count += 1
+    finally:
+        output.close()
+    return region_count
+
+
+@click.command()
+@click.argument(
+    "shards",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option(
+    "-w",
+    "--world-out",
+    type=click.Path(path_type=Path),
+    required=True,
+    help="Path to the merged Java world, ending it with .zip or .tar.gz writes the world into an archive",
+)
+@click.option(
+    "--delete-out",
+    is_flag=True,
+    help="Permanently delete the world output if it already exists",
+)
+def main(shards: tuple[Path], world_out: Path, delete_out: bool) -> None:
+    "merges the world folders that 3dschunker --shard wrote into one world"
+    try:
+        region_count = merge_shards(list(shards), world_out, delete_out)
+    except (ValueError, FileExistsError) as error:
+        raise click.ClickException(str(error))
+    print(f"merged {region_count:d} regions into {world_out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
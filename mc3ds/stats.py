@@ -0,0 +1,128 @@
+"what a world is made of, for sizing conversions and finding broken saves"
+
+import os
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import logging
+
+import numpy as np
+
+from .classes import World, CDBDirectory, Entry, BlockArrays, MAX_SUBCHUNKS
+from .convert import OVERWORLD, NETHER, END
+
+logger = logging.getLogger(__name__)
+
+DIMENSION_NAMES = {OVERWORLD: "overworld", NETHER: "nether", END: "end"}
+
+# the block ID and data of a block as (id << 4) | data
+KEY_COUNT = 1 << 12
+BIOME_COUNT = 1 << 8
+
+
+def slot_stats(
+    cdb_path: Path, slot: int, chunks: list[tuple[tuple[int, int, int], int]]
+) -> dict:
+    "counts everything in one slot file, chunks are (position, subfile), this runs in a worker process"
+    cdb_file = CDBDirectory(cdb_path)[slot]
+    blocks = np.zeros(KEY_COUNT, np.int64)
+    biomes = np.zeros(BIOME_COUNT, np.int64)
+    subchunks = np.zeros(MAX_SUBCHUNKS + 1, np.int64)
+    dimensions = np.zeros(len(DIMENSION_NAMES), np.int64)
+    compressed = 0
+    decompressed = 0
+    errors = []
+    for position, subfile in chunks:
+        try:
+            entry = Entry(
+                position, slot, subfile, cdb_file.read_header(subfile), cdb_file
+            )
+            # every section counts towards the compression ratio, not just the blocks
+            compressed += sum(section[2] for section in entry.sections)
+            decompressed += sum(section[3] for section in entry.sections)
+            arrays = BlockArrays(entry.data_chunk.raw_decompressed)
+        except Exception as error:
+            errors.append(
+                {"position": position, "error": f"{type(error).__name__}: {error}"}
+            )
+            continue
+        keys = (arrays.ids.astype(np.uint16) << 4) | arrays.data
+        blocks += np.bincount(keys.ravel(), minlength=KEY_COUNT)
+        biomes += np.bincount(arrays.biomes.ravel(), minlength=BIOME_COUNT)
+        subchunks[len(arrays)] += 1
+        dimensions[position[2]] += 1
+    return {
+        "slot": slot,
+        "blocks": blocks,
+        "biomes": biomes,
+        "subchunks": subchunks,
+        "dimensions": dimensions,
+        "compressed": compressed,
+        "decompressed": decompressed,
+        "errors": errors,
+    }
+
+
+def world_stats(world: World, workers: int | None = None) -> dict:
+    "block, biome, subchunk and chunk counts of a world, and how well each slot compresses"
+    slots = {}
+    for position, entry in world.entries.items():
+        slots.setdefault(entry.slot, []).append((position, entry.subfile))
+
+    blocks = np.zeros(KEY_COUNT, np.int64)
+    biomes = np.zeros(BIOME_COUNT, np.int64)
+    subchunks = np.zeros(MAX_SUBCHUNKS + 1, np.int64)
+    dimensions = np.zeros(len(DIMENSION_NAMES), np.int64)
+    slot_results = {}
+    errors = []
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(slot_stats, world.cdb.path, slot, chunks)
+            for slot, chunks in sorted(slots.items())
+        ]
+        for future in futures:
+            result = future.result()
+            blocks += result["blocks"]
+            biomes += result["biomes"]
+            subchunks += result["subchunks"]
+            dimensions += result["dimensions"]
+            errors.extend(result["errors"])
+            slot = result["slot"]
+            cdb_file = world.cdb[slot]
+            slot_results[str(slot)] = {
+                "chunks": len(slots[slot]),
+                "subfiles": cdb_file.subfile_count,
+                "used_subfiles": cdb_file.used,
+                "fill_ratio": cdb_file.fill_ratio,
+                "compressed_size": result["compressed"],
+                "decompressed_size": result["decompressed"],
+                "compression_ratio": (
+                    result["decompressed"] / result["compressed"]
+                    if result["compressed"]
+                    else None
+                ),
+            }
+    for error in errors:
+        logger.error(f"could not read chunk {error['position']}: {error['error']}")
+
+    return {
+        "name": world.name,
+        "chunks": int(dimensions.sum()),
+        "dimensions": {
+            DIMENSION_NAMES[dimension]: int(count)
+            for dimension, count in enumerate(dimensions)
+        },
+        "blocks": {
+            f"{key >> 4:d}:{key & 0xF:d}": int(blocks[key])
+            for key in np.flatnonzero(blocks)
+        },
+        "biomes": {
+            f"{biome:d}": int(biomes[biome]) for biome in np.flatnonzero(biomes)
+        },
+        "subchunks": {
+            f"{count:d}": int(chunks) for count, chunks in enumerate(subchunks)
+        },
+        "slots": slot_results,
+        "errors": errors,
+    }
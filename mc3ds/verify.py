@@ -0,0 +1,270 @@
+"checks a whole save for corruption and reports every problem instead of stopping at the first one"
+
+import os
+import zlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import logging
+
+from .classes import (
+    CDBDirectory,
+    VDBDirectory,
+    SUBCHUNK_SIZE,
+    index_path,
+    parse_position,
+)
+from .archive import world_root
+from .parser import parser
+from .writer import SECTION_COUNT, DATA_OFFSET, subfile_offset
+
+logger = logging.getLogger(__name__)
+
+FOOTER_SIZE = 0x14
+CDB_UNKNOWN = 0x4
+VDB_UNKNOWN = 0x100
+BLOCK_DATA_TRAILER = 16 * 16 * 2 + 16 * 16
+
+
+class Problems(list):
+    "a list of problems, each one is a dict so it can be sent back from a worker process"
+
+    def add(
+        self,
+        file: str,
+        problem: str,
+        subfile: int | None = None,
+        position: tuple[int, int, int] | None = None,
+    ) -> None:
+        self.append(
+            {"file": file, "subfile": subfile, "position": position, "problem": problem}
+        )
+
+
+def check_block_data(raw: bytes) -> list[str]:
+    "the same checks as parse_block_data, but every problem is returned"
+    if not raw:
+        return ["block data is empty"]
+    count = raw[0]
+    if count > 8:
+        return [f"block data has {count:d} subchunks, the most is 8"]
+    expected = 1 + count * SUBCHUNK_SIZE + BLOCK_DATA_TRAILER
+    if len(raw) != expected:
+        return [f"block data is 0x{len(raw):X} bytes, should be 0x{expected:X}"]
+    return [
+        f"subchunk {n:d} doesn't start with 0"
+        for n in range(count)
+        if raw[1 + n * SUBCHUNK_SIZE] != 0
+    ]
+
+
+def _check_file_header(path: Path, stream, unknown: int, problems: Problems):
+    "returns the header, or None if the rest of the file can't be checked"
+    header = parser.FileHeader(stream)
+    if header.footerSize != FOOTER_SIZE:
+        problems.add(path.name, f"footer size is 0x{header.footerSize:X}")
+    if header.unknown0 != unknown:
+        problems.add(path.name, f"file type is 0x{header.unknown0:X}")
+    if header.subfileSize <= DATA_OFFSET:
+        problems.add(path.name, f"subfile size 0x{header.subfileSize:X} is too small")
+        return None
+    expected = (
+        parser.FileHeader.size + header.subfileCount * header.subfileSize + FOOTER_SIZE
+    )
+    size = stream.seek(0, os.SEEK_END)
+    if size < expected:
+        problems.add(path.name, f"file is 0x{size:X} bytes, should be 0x{expected:X}")
+    return header
+
+
+def _check_chunk(
+    raw: bytes, position: tuple[int, int, int], subfile_size: int
+) -> list[str]:
+    "checks one CDB subfile, raw includes the subfile magic"
+    if parser.SubfileHeader(raw).magic == 0:
+        return ["index points to an empty subfile"]
+    result = []
+    header = parser.ChunkHeader(raw[len(parser.SubfileHeader) : DATA_OFFSET])
+    try:
+        chunk_position = parse_position(header.position)
+    except AssertionError as error:
+        result.append(f"chunk has an invalid position: {error}")
+    else:
+        if chunk_position != position:
+            result.append(f"chunk is at {chunk_position}, not {position}")
+
+    start = DATA_OFFSET
+    found = set()
+    for n, section in enumerate(header.sections):
+        if section.index == -1:
+            if section.compressedSize or section.decompressedSize:
+                result.append(f"empty section {n:d} has a size")
+            continue
+        if section.index != n or not 0 <= section.index < SECTION_COUNT:
+            result.append(f"section {n:d} has index {section.index:d}")
+            continue
+        found.add(n)
+        if section.position != start:
+            result.append(
+                f"section {n:d} is at 0x{section.position:X}, should be 0x{start:X}"
+            )
+        end = section.position + section.compressedSize
+        start += section.compressedSize
+        if section.position < DATA_OFFSET or end > subfile_size:
+            result.append(f"section {n:d} goes past the end of the subfile")
+            continue
+
+        decompress_object = zlib.decompressobj()
+        try:
+            decompressed = decompress_object.decompress(raw[section.position : end])
+        except zlib.error as error:
+            result.append(f"section {n:d} can't be inflated: {error}")
+            continue
+        if not decompress_object.eof:
+            result.append(f"section {n:d} is truncated")
+        elif decompress_object.unused_data:
+            compressed_size = section.compressedSize - len(
+                decompress_object.unused_data
+            )
+            result.append(
+                f"section {n:d} is 0x{compressed_size:X} bytes compressed, "
+                f"should be 0x{section.compressedSize:X}"
+            )
+        if len(decompressed) != section.decompressedSize:
+            result.append(
+                f"section {n:d} is 0x{len(decompressed):X} bytes decompressed, "
+                f"should be 0x{section.decompressedSize:X}"
+            )
+        if n == 0:
+            result.extend(check_block_data(decompressed))
+    if 0 not in found:
+        result.append("chunk has no block data")
+    return result
+
+
+def verify_cdb_slot(
+    path: Path, chunks: list[tuple[tuple[int, int, int], int]]
+) -> Problems:
+    "checks the chunks of one slot file, chunks are (position, subfile), this runs in a worker process"
+    problems = Problems()
+    with path.open("rb") as stream:
+        header = _check_file_header(path, stream, CDB_UNKNOWN, problems)
+        if header is None:
+            return problems
+        for position, subfile in sorted(chunks, key=lambda chunk: chunk[1]):
+            if subfile >= header.subfileCount:
+                problems.add(
+                    path.name, "subfile is past the end of the file", subfile, position
+                )
+                continue
+            stream.seek(subfile_offset(subfile, header.subfileSize))
+            raw = stream.read(header.subfileSize)
+            if len(raw) != header.subfileSize:
+                problems.add(path.name, "subfile is truncated", subfile, position)
+                continue
+            for problem in _check_chunk(raw, position, header.subfileSize):
+                problems.add(path.name, problem, subfile, position)
+    return problems
+
+
+def verify_vdb_slot(path: Path) -> Problems:
+    "checks the header of every used subfile of a VDB slot file, this runs in a worker process"
+    problems = Problems()
+    with path.open("rb") as stream:
+        header = _check_file_header(path, stream, VDB_UNKNOWN, problems)
+        if header is None:
+            return problems
+        for subfile in range(header.subfileCount):
+            stream.seek(subfile_offset(subfile, header.subfileSize))
+            raw = stream.read(header.subfileSize)
+            if len(raw) < len(parser.SubfileHeader):
+                break
+            if parser.SubfileHeader(raw).magic == 0:
+                continue
+            try:
+                vdb_header = parser.VDBHeader(raw)
+            except (EOFError, ValueError):
+                problems.add(path.name, "header is truncated", subfile)
+                continue
+            if vdb_header.magic != parser.MAGIC_VDB:
+                problems.add(path.name, f"magic is 0x{vdb_header.magic:X}", subfile)
+    return problems
+
+
+def verify_index(cdb_path: Path, slots: tuple[int]) -> tuple[Problems, dict]:
+    "checks the index, returns the problems and the chunks of each slot as (position, subfile)"
+    problems = Problems()
+    chunks = {}
+    path = index_path(cdb_path)
+    try:
+        with path.open("rb") as index_file:
+            index = parser.Index(index_file)
+    except (OSError, EOFError) as error:
+        problems.add(path.name, f"can't read the index: {error}")
+        return problems, chunks
+    if index.constant0 != 0x2:
+        problems.add(path.name, f"index version is 0x{index.constant0:X}")
+
+    positions = {}
+    for entry in index.entries:
+        try:
+            position = parse_position(entry.position)
+        except AssertionError as error:
+            problems.add(path.name, f"invalid position: {error}", int(entry.subfile))
+            continue
+        subfile = int(entry.subfile)
+        for name, value, expected in (
+            ("constant0", entry.constant0, 0x20FF),
+            ("constant1", entry.constant1, 0xA),
+            ("constant2", entry.constant2, 0x8000),
+        ):
+            if value != expected:
+                problems.add(
+                    path.name,
+                    f"{name} is 0x{value:X}, should be 0x{expected:X}",
+                    subfile,
+                    position,
+                )
+        if position in positions:
+            problems.add(
+                path.name,
+                f"duplicate position, also in slot {positions[position]:d}",
+                subfile,
+                position,
+            )
+            continue
+        positions[position] = int(entry.slot)
+        # entries for slot files that don't exist are skipped, like World does
+        if entry.slot in slots:
+            chunks.setdefault(int(entry.slot), []).append((position, subfile))
+    return problems, chunks
+
+
+def verify_world(
+    path: Path, workers: int | None = None, world_id: str | None = None
+) -> Problems:
+    "checks every part of a save that can be checked, the slot files are checked at the same time"
+    path = world_root(path, world_id)
+    cdb = CDBDirectory(path / "db" / "cdb")
+    vdb = VDBDirectory(path / "db" / "vdb")
+    problems, chunks = verify_index(cdb.path, cdb.keys())
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(verify_cdb_slot, cdb.get_file(slot), slot_chunks): (
+                cdb.get_file(slot)
+            )
+            for slot, slot_chunks in sorted(chunks.items())
+        }
+        for slot in sorted(vdb.keys()):
+            futures[executor.submit(verify_vdb_slot, vdb.get_file(slot))] = (
+                vdb.get_file(slot)
+            )
+        for future, slot_path in futures.items():
+            try:
+                problems.extend(future.result())
+            except Exception as error:
+                problems.add(slot_path.name, f"can't be checked: {error}")
+    for problem in problems:
+        logger.error(f"{problem['file']}: {problem['problem']}")
+    return problems
@@ -0,0 +1,608 @@
+"batched, journaled rewriting of chunks inside CDB slot files, and writing new chunks with a new index"
+
+import os
+from pathlib import Path
+from collections import defaultdict
+import struct
+import zlib
+import logging
+
+import numpy as np
+
+from .parser import parser
+from .classes import index_path, parse_position, SUBCHUNK_SIZE, MAX_SUBCHUNKS
+
+logger = logging.getLogger(__name__)
+
+SECTION_COUNT = 6
+# the section table starts after the subfile magic and the start of the chunk header
+SECTION_TABLE_OFFSET = len(parser.SubfileHeader) + 0x4 + 0x2 + 0x6
+DATA_OFFSET = len(parser.SubfileHeader) + parser.ChunkHeader.size
+
+JOURNAL_MAGIC = b"MC3DSJNL"
+JOURNAL_VERSION = 1
+JOURNAL_SUFFIX = ".journal"
+_journal_header = struct.Struct("<8sII")
+_journal_record = struct.Struct("<QI")
+_journal_footer = struct.Struct("<I")
+
+FOOTER_SIZE = 0x14
+CDB_FILE_TYPE = 0x4
+INDEX_VERSION = 0x2
+INDEX_CONSTANT = 0x80
+ENTRY_CONSTANTS = (0x20FF, 0xA, 0x8000)
+DEFAULT_PARAMETERS = (1, 0)
+WRITE_BUFFER_SIZE = 1 << 20
+_file_header = struct.Struct("<HHIIII")
+_chunk_header = struct.Struct("<IIbbHHH")
+_chunk_section = struct.Struct("<iiii")
+_index_header = struct.Struct("<IIIIII")
+_index_entry = struct.Struct("<IHHHHbbH")
+assert _file_header.size == parser.FileHeader.size
+assert _chunk_header.size == DATA_OFFSET - SECTION_COUNT * _chunk_section.size
+assert _index_entry.size == len(parser.CDBEntry)
+
+
+class JournalError(Exception):
+    pass
+
+
+def subfile_offset(subfile: int, subfile_size: int) -> int:
+    return parser.FileHeader.size + subfile * subfile_size
+
+
+def pack_position(position: tuple[int, int, int]) -> int:
+    "the opposite of classes.parse_position"
+    x, z, dimension = position
+    assert 0 <= dimension <= 2, f"invalid dimension {dimension:d}"
+    return (x % (1 << 13)) | ((z % (1 << 13)) << 14) | (dimension << 28)
+
+
+def encode_block_data(
+    ids: np.ndarray,
+    data: np.ndarray,
+    biomes: np.ndarray,
+    unknown0: np.ndarray | None = None,
+) -> bytes:
+    """
+    the opposite of classes.BlockArrays, ids and data are indexed [subchunk][x][z][y]
+    and biomes [z][x], the all-air subchunks at the top are left out
+    """
+    assert ids.shape == data.shape and ids.shape[1:] == (16, 16, 16)
+    assert len(ids) <= MAX_SUBCHUNKS
+    not_air = (ids != 0) | (data != 0)
+    filled = np.flatnonzero(not_air.reshape(len(ids), 4096).any(axis=1))
+    count = int(filled[-1]) + 1 if len(filled) else 0
+    subchunks = np.zeros((count, SUBCHUNK_SIZE), np.uint8)
+    subchunks[:, 1:4097] = ids[:count].reshape(count, 4096)
+    # two blocks in every byte, the low nibble comes first
+    flat = data[:count].reshape(count, 4096).astype(np.uint8)
+    subchunks[:, 4097:6145] = (flat[:, 0::2] & 0xF) | (flat[:, 1::2] << 4)
+    if unknown0 is None:
+        unknown0 = np.zeros((16, 16), "<u2")
+    return b"".join(
+        (
+            bytes((count,)),
+            subchunks.tobytes(),
+            np.asarray(unknown0, "<u2").tobytes(),
+            np.asarray(biomes, np.uint8).tobytes(),
+        )
+    )
+
+
+def compress_block_data(
+    raw: bytes, compression_level: int = zlib.Z_DEFAULT_COMPRESSION
+) -> dict[int, tuple[bytes, int]]:
+    "the sections of a chunk with only block data, for CDBWriter.add_compressed"
+    return {0: (zlib.compress(raw, compression_level), len(raw))}
+
+
+def check_subfile_size(
+    position: tuple[int, int, int],
+    sections: dict[int, tuple[bytes, int]],
+    subfile_size: int,
+) -> None:
+    "raises ValueError if the compressed sections of a chunk don't fit in a subfile"
+    end = DATA_OFFSET + sum(len(compressed) for compressed, size in sections.values())
+    if end > subfile_size:
+        raise ValueError(
+            f"chunk {position} is 0x{end:X} bytes, too big for a subfile of 0x{subfile_size:X}"
+        )
+
+
+def build_subfile(
+    position: tuple[int, int, int],
+    sections: dict[int, tuple[bytes, int]],
+    subfile_size: int,
+    parameters: tuple[int, int] = DEFAULT_PARAMETERS,
+) -> bytes:
+    "a whole subfile for a chunk, sections maps a section index to (compressed data, decompressed size)"
+    table = b""
+    body = b""
+    position_in_subfile = DATA_OFFSET
+    for index in range(SECTION_COUNT):
+        if index not in sections:
+            table += _chunk_section.pack(-1, -1, 0, 0)
+            continue
+        compressed, decompressed_size = sections[index]
+        table += _chunk_section.pack(
+            index, position_in_subfile, len(compressed), decompressed_size
+        )
+        body += compressed
+        position_in_subfile += len(compressed)
+    check_subfile_size(position, sections, subfile_size)
+    header = _chunk_header.pack(
+        parser.MAGIC_CDB, pack_position(position), *parameters, 0, 0, 0
+    )
+    return header + table + body + bytes(subfile_size - position_in_subfile)
+
+
+def rebuild_subfile(old: bytes, new_data: dict, subfile_size: int) -> bytes:
+    """
+    returns a copy of the subfile with the sections in new_data replaced,
+    new_data maps a section index to its decompressed data, or None to remove it
+    """
+    assert len(old) == subfile_size
+    header = parser.ChunkHeader(old[len(parser.SubfileHeader) :])
+    table = b""
+    body = b""
+    position = DATA_OFFSET
+    for index in range(SECTION_COUNT):
+        if index in new_data:
+            new = new_data[index]
+            if new is None:
+                compressed = None
+            else:
+                compressed = zlib.compress(new)
+                decompressed_size = len(new)
+        else:
+            for section in header.sections:
+                if section.index == index:
+                    start = section.position
+                    compressed = old[start : start + section.compressedSize]
+                    decompressed_size = section.decompressedSize
+                    break
+            else:
+                compressed = None
+        if compressed is None:
+            section = parser.ChunkSection(
+                index=-1, position=-1, compressedSize=0, decompressedSize=0
+            )
+        else:
+            section = parser.ChunkSection(
+                index=index,
+                position=position,
+                compressedSize=len(compressed),
+                decompressedSize=decompressed_size,
+            )
+            body += compressed
+            position += len(compressed)
+            if position > subfile_size:
+                raise ValueError("out of space")
+        table += section.dumps()
+    # anything after the new data is left as it was, like the 3DS does
+    return old[:SECTION_TABLE_OFFSET] + table + body + old[position:]
+
+
+def _coalesce(changes: dict[int, bytes]) -> list[tuple[int, bytes]]:
+    "merges writes to adjacent offsets so each run is written at once"
+    runs = []
+    for offset in sorted(changes):
+        data = changes[offset]
+        if runs and runs[-1][0] + len(runs[-1][1]) == offset:
+            runs[-1] = (runs[-1][0], runs[-1][1] + data)
+        else:
+            runs.append((offset, data))
+    return runs
+
+
+def _fsync_directory(path: Path) -> None:
+    # not possible on Windows, the rename/unlink is still atomic there
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def journal_path(slot_path: str | os.PathLike) -> Path:
+    slot_path = Path(slot_path)
+    return slot_path.with_name(slot_path.name + JOURNAL_SUFFIX)
+
+
+def write_journal(path: Path, records: list[tuple[int, bytes, bytes]]) -> None:
+    "records are (offset, old data, new data)"
+    buffer = bytearray(
+        _journal_header.pack(JOURNAL_MAGIC, JOURNAL_VERSION, len(records))
+    )
+    for offset, old, new in records:
+        assert len(old) == len(new)
+        buffer += _journal_record.pack(offset, len(old))
+        buffer += old
+        buffer += new
+    buffer += _journal_footer.pack(zlib.crc32(buffer))
+    temporary = path.with_name(path.name + ".tmp")
+    with open(temporary, "wb") as journal:
+        journal.write(buffer)
+        journal.flush()
+        os.fsync(journal.fileno())
+    # the journal only exists once it is complete
+    os.replace(temporary, path)
+    _fsync_directory(path.parent)
+
+
+def read_journal(path: Path) -> list[tuple[int, bytes, bytes]]:
+    with open(path, "rb") as journal:
+        buffer = journal.read()
+    if len(buffer) < _journal_header.size + _journal_footer.size:
+        raise JournalError(f"journal {path} is truncated")
+    (checksum,) = _journal_footer.unpack_from(
+        buffer, len(buffer) - _journal_footer.size
+    )
+    body = memoryview(buffer)[: -_journal_footer.size]
+    if zlib.crc32(body) != checksum:
+        raise JournalError(f"journal {path} is corrupt")
+    magic, version, count = _journal_header.unpack_from(body)
+    if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION:
+        raise JournalError(f"{path} is not a journal")
+    records = []
+    position = _journal_header.size
+    for _ in range(count):
+        offset, size = _journal_record.unpack_from(body, position)
+        position += _journal_record.size
+        old = bytes(body[position : position + size])
+        position += size
+        new = bytes(body[position : position + size])
+        position += size
+        records.append((offset, old, new))
+    return records
+
+
+def _apply(slot_path: Path, runs: list[tuple[int, bytes]]) -> None:
+    with open(slot_path, "r+b") as slot:
+        for offset, data in runs:
+            slot.seek(offset)
+            slot.write(data)
+        slot.flush()
+        os.fsync(slot.fileno())
+
+
+def recover(slot_path: str | os.PathLike, finish: bool = False) -> bool:
+    """
+    undoes (or with finish, completes) an interrupted write to a slot file,
+    returns False if there was nothing to recover
+    """
+    slot_path = Path(slot_path)
+    path = journal_path(slot_path)
+    temporary = path.with_name(path.name + ".tmp")
+    if temporary.exists():
+        # the crash happened before the slot was touched
+        temporary.unlink()
+    if not path.exists():
+        return False
+    records = read_journal(path)
+    if finish:
+        _apply(slot_path, [(offset, new) for offset, old, new in records])
+    else:
+        _apply(slot_path, [(offset, old) for offset, old, new in records])
+    path.unlink()
+    _fsync_directory(path.parent)
+    logger.info(f"{'finished' if finish else 'rolled back'} write to {slot_path}")
+    return True
+
+
+def pending_journals(cdb_path: str | os.PathLike) -> list[Path]:
+    return sorted(Path(cdb_path).glob(f"slt*.cdb{JOURNAL_SUFFIX}"))
+
+
+def recover_all(cdb_path: str | os.PathLike, finish: bool = False) -> list[Path]:
+    """
+    undoes (or with finish, completes) every interrupted write in a cdb folder, so a
+    ChunkWriteBatch or CDBWriter can be opened, returns the slot files that were recovered
+    """
+    cdb_path = Path(cdb_path)
+    # a journal that was never finished is only a temporary file
+    slot_names = {
+        path.name.split(JOURNAL_SUFFIX)[0]
+        for path in cdb_path.glob(f"slt*.cdb{JOURNAL_SUFFIX}*")
+    }
+    recovered = []
+    for name in sorted(slot_names):
+        if recover(cdb_path / name, finish):
+            recovered.append(cdb_path / name)
+    return recovered
+
+
+class ChunkWriteBatch:
+    """
+    collects chunk rewrites and applies them one slot at a time, every slot is
+    journaled first so an interrupted write can be rolled back or finished with recover()
+    """
+
+    def __init__(self, cdb_path: str | os.PathLike) -> None:
+        self._path = Path(cdb_path)
+        self._pending = defaultdict(dict)
+        journals = pending_journals(self._path)
+        if journals:
+            raise JournalError(
+                f"interrupted write found ({journals[0].name}), recover it first"
+            )
+
+    def slot_path(self, slot: int) -> Path:
+        return self._path / f"slt{slot:d}.cdb"
+
+    def add(self, slot: int, subfile: int, new_data: dict) -> None:
+        "new_data maps a section index to its decompressed data, or None to remove it"
+        self._pending[slot].setdefault(subfile, {}).update(new_data)
+
+    def __len__(self) -> int:
+        return sum(len(subfiles) for subfiles in self._pending.values())
+
+    def commit(self) -> None:
+        for slot in sorted(self._pending):
+            self._commit_slot(slot, self._pending[slot])
+        self._pending.clear()
+
+    def _commit_slot(self, slot: int, subfiles: dict[int, dict]) -> None:
+        path = self.slot_path(slot)
+        with open(path, "rb") as slot_file:
+            header = parser.FileHeader(slot_file)
+            subfile_size = header.subfileSize
+            old = {}
+            # read every affected subfile, a contiguous run with one read
+            runs = []
+            for subfile in sorted(subfiles):
+                if subfile >= header.subfileCount:
+                    raise ValueError("index goes past the bounds of the database")
+                if runs and runs[-1][-1] == subfile - 1:
+                    runs[-1].append(subfile)
+                else:
+                    runs.append([subfile])
+            for run in runs:
+                slot_file.seek(subfile_offset(run[0], subfile_size))
+                buffer = slot_file.read(subfile_size * len(run))
+                if len(buffer) != subfile_size * len(run):
+                    raise ValueError("slot file is truncated")
+                for n, subfile in enumerate(run):
+                    old[subfile] = buffer[n * subfile_size : (n + 1) * subfile_size]
+
+        changes = {}
+        records = []
+        for subfile, new_data in subfiles.items():
+            new = rebuild_subfile(old[subfile], new_data, subfile_size)
+            if new == old[subfile]:
+                continue
+            offset = subfile_offset(subfile, subfile_size)
+            changes[offset] = new
+            records.append((offset, old[subfile], new))
+        if not changes:
+            return
+
+        journal = journal_path(path)
+        write_journal(journal, records)
+        _apply(path, _coalesce(changes))
+        journal.unlink()
+        _fsync_directory(journal.parent)
+        logger.debug(f"rewrote {len(changes):d} subfiles in {path.name}")
+
+
+class CDBWriter:
+    """
+    writes new and changed chunks into free subfiles, adding slot files once the
+    others are full, and then writes the whole index at once, chunks are never
+    overwritten: their old subfiles are only cleared once the new index is in place,
+    so an interrupted write leaves the world as it was
+    """
+
+    def __init__(
+        self,
+        cdb_path: str | os.PathLike,
+        subfile_count: int | None = None,
+        subfile_size: int | None = None,
+        compression_level: int = zlib.Z_DEFAULT_COMPRESSION,
+    ) -> None:
+        self._path = Path(cdb_path)
+        self.compression_level = compression_level
+        journals = pending_journals(self._path)
+        if journals:
+            raise JournalError(
+                f"interrupted write found ({journals[0].name}), recover it first"
+            )
+        # the subfile count and size of every slot file
+        self._slots = {}
+        for path in self._path.glob("slt*.cdb"):
+            with open(path, "rb") as slot_file:
+                header = parser.FileHeader(slot_file)
+            self._slots[int(path.stem[3:])] = (header.subfileCount, header.subfileSize)
+        # new slot files are like the first one
+        if self._slots:
+            first_count, first_size = self._slots[min(self._slots)]
+            subfile_count = first_count if subfile_count is None else subfile_count
+            subfile_size = first_size if subfile_size is None else subfile_size
+        if subfile_count is None or subfile_size is None:
+            raise ValueError("there are no slot files to copy the subfile size from")
+        self.subfile_count = subfile_count
+        self.subfile_size = subfile_size
+
+        # (slot, subfile, parameters) by position, in the order of the index
+        self._entries = {}
+        # what these mean isn't known, so they're kept as they are, see _write_index
+        self._index_unknown = 0
+        self._pointers = [0]
+        path = index_path(self._path)
+        if path.exists():
+            with open(path, "rb") as index_file:
+                index = parser.Index(index_file)
+            self._index_unknown = index.unknown0
+            self._pointers = [pointer.unknown for pointer in index.pointers]
+            for entry in index.entries:
+                self._entries[parse_position(entry.position)] = (
+                    int(entry.slot),
+                    int(entry.subfile),
+                    (int(entry.parameters.unknown0), int(entry.parameters.unknown1)),
+                )
+        self._pending = {}
+
+    def slot_path(self, slot: int) -> Path:
+        return self._path / f"slt{slot:d}.cdb"
+
+    def add(
+        self,
+        position: tuple[int, int, int],
+        sections: dict[int, bytes],
+        parameters: tuple[int, int] = DEFAULT_PARAMETERS,
+    ) -> None:
+        "sections maps a section index to its decompressed data"
+        compressed = {
+            index: (zlib.compress(data, self.compression_level), len(data))
+            for index, data in sections.items()
+        }
+        self.add_compressed(position, compressed, parameters)
+
+    def add_compressed(
+        self,
+        position: tuple[int, int, int],
+        sections: dict[int, tuple[bytes, int]],
+        parameters: tuple[int, int] = DEFAULT_PARAMETERS,
+    ) -> None:
+        """
+        sections maps a section index to (compressed data, decompressed size), a chunk
+        that doesn't fit in a subfile raises ValueError here and isn't added
+        """
+        check_subfile_size(position, sections, self.subfile_size)
+        # the padded subfile is only built in commit(), so pending chunks stay small
+        self._pending[position] = (sections, parameters)
+
+    def remove(self, position: tuple[int, int, int]) -> None:
+        if position not in self._entries and position not in self._pending:
+            raise KeyError(position)
+        self._pending[position] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _free_subfiles(self):
+        "yields (slot, subfile) for every subfile the index doesn't use, then new slots"
+        used = {(slot, subfile) for slot, subfile, parameters in self._entries.values()}
+        for slot in sorted(self._slots):
+            subfile_count, subfile_size = self._slots[slot]
+            if subfile_size != self.subfile_size:
+                continue
+            for subfile in range(subfile_count):
+                if (slot, subfile) not in used:
+                    yield slot, subfile
+        slot = max(self._slots, default=-1) + 1
+        while True:
+            for subfile in range(self.subfile_count):
+                yield slot, subfile
+            slot += 1
+
+    def commit(self) -> None:
+        entries = dict(self._entries)
+        writes = defaultdict(dict)
+        freed = defaultdict(list)
+        free_subfiles = self._free_subfiles()
+        for position, pending in self._pending.items():
+            if position in self._entries:
+                slot, subfile, parameters = self._entries[position]
+                freed[slot].append(subfile)
+            if pending is None:
+                entries.pop(position, None)
+                continue
+            sections, parameters = pending
+            slot, subfile = next(free_subfiles)
+            writes[slot][subfile] = build_subfile(
+                position, sections, self.subfile_size, parameters
+            )
+            entries[position] = (slot, subfile, parameters)
+
+        for slot, subfiles in sorted(writes.items()):
+            if slot in self._slots:
+                self._write_subfiles(slot, subfiles)
+            else:
+                self._write_slot(slot, subfiles)
+        # the new chunks are only used once the new index replaces the old one
+        self._write_index(entries)
+        filler = bytes(self.subfile_size)
+        for slot, subfiles in sorted(freed.items()):
+            self._write_subfiles(slot, {subfile: filler for subfile in subfiles})
+
+        self._entries = entries
+        self._pending.clear()
+        logger.debug(
+            f"wrote {sum(len(subfiles) for subfiles in writes.values()):d} chunks "
+            f"and freed {sum(len(subfiles) for subfiles in freed.values()):d}"
+        )
+
+    def _write_subfiles(self, slot: int, subfiles: dict[int, bytes]) -> None:
+        subfile_count, subfile_size = self._slots[slot]
+        changes = {
+            subfile_offset(subfile, subfile_size): data
+            for subfile, data in subfiles.items()
+        }
+        with open(
+            self.slot_path(slot), "r+b", buffering=WRITE_BUFFER_SIZE
+        ) as slot_file:
+            for offset, data in _coalesce(changes):
+                slot_file.seek(offset)
+                slot_file.write(data)
+            slot_file.flush()
+            os.fsync(slot_file.fileno())
+
+    def _write_slot(self, slot: int, subfiles: dict[int, bytes]) -> None:
+        "creates a slot file, written at once"
+        buffer = bytearray(
+            _file_header.pack(
+                1, 1, self.subfile_count, FOOTER_SIZE, self.subfile_size, CDB_FILE_TYPE
+            )
+        )
+        buffer += bytes(self.subfile_count * self.subfile_size + FOOTER_SIZE)
+        for subfile, data in subfiles.items():
+            offset = subfile_offset(subfile, self.subfile_size)
+            buffer[offset : offset + self.subfile_size] = data
+        with open(self.slot_path(slot), "xb") as slot_file:
+            slot_file.write(buffer)
+            slot_file.flush()
+            os.fsync(slot_file.fileno())
+        _fsync_directory(self._path)
+        self._slots[slot] = (self.subfile_count, self.subfile_size)
+
+    def _write_index(self, entries: dict) -> None:
+        """
+        the pointers after the header are written back unchanged, even when slot files
+        were added: minecraft3ds.h only guesses they're related to the slot numbers, and
+        without saves made by the game with more slot files there's nothing to work out
+        new values from, so keeping the game's own values is the only safe choice
+        """
+        buffer = bytearray(
+            _index_header.pack(
+                INDEX_VERSION,
+                len(entries),
+                self._index_unknown,
+                _index_entry.size,
+                len(self._pointers),
+                INDEX_CONSTANT,
+            )
+        )
+        buffer += struct.pack(f"<{len(self._pointers):d}I", *self._pointers)
+        for position, (slot, subfile, parameters) in entries.items():
+            buffer += _index_entry.pack(
+                pack_position(position),
+                slot,
+                subfile,
+                ENTRY_CONSTANTS[0],
+                ENTRY_CONSTANTS[1],
+                *parameters,
+                ENTRY_CONSTANTS[2],
+            )
+        path = self._path / "newindex.cdb"
+        temporary = path.with_name(path.name + ".tmp")
+        with open(temporary, "wb") as index_file:
+            index_file.write(buffer)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(temporary, path)
+        _fsync_directory(self._path)
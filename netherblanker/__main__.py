@@ -6,6 +6,8 @@ import random
 import zlib
 from shutil import copytree, rmtree
 
+from mc3ds.writer import ChunkWriteBatch, recover_all
+
 INT8 = 0x1
 INT16 = 0x2
 INT32 = 0x4
@@ -251,16 +253,20 @@ def main() -> None:
                 if chunk_type == "nether":
                     nethers.append((region, chunk))
     # write it to the file!!
-    with open(world_path / "db" / "cdb" / "newindex.cdb", "rb") as new_index:
+    cdb_path = world_path / "db" / "cdb"
+    for slot_path in recover_all(cdb_path):
+        print(f"rolled back an interrupted write to {slot_path.name}")
+    with open(cdb_path / "newindex.cdb", "rb") as new_index:
         found = extract_used_chunks(new_index)
+    batch = ChunkWriteBatch(cdb_path)
     for entry in found:
         if entry in blanks:
             print("found blank")
         elif entry in nethers:
             print("found nether")
             region, chunk = entry
-            region_path = world_path / "db" / "cdb" / f"slt{region:d}.cdb"
-            with open(region_path, "rb+") as cdb:
+            region_path = cdb_path / f"slt{region:d}.cdb"
+            with open(region_path, "rb") as cdb:
                 subfile_count, subfile_size = read_header(cdb)
                 print(region, chunk)
                 raw_chunk = read_chunk(cdb, chunk, 0, subfile_count, subfile_size)
@@ -281,7 +287,9 @@ def main() -> None:
                 new_bytes += biomes
                 assert len(new_bytes) == len(raw_chunk)
                 new_data = {0: new_bytes}
-                write_chunk(cdb, chunk, new_data, subfile_count, subfile_size)
+                batch.add(region, chunk, new_data)
+    # every slot is rewritten in one pass, and can be recovered if it's interrupted
+    batch.commit()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+import struct
+from pathlib import Path
+
+import nbtlib
+import numpy as np
+import pytest
+
+from mc3ds import data
+from mc3ds.writer import CDBWriter, encode_block_data
+
+SUBFILE_COUNT = 16
+SUBFILE_SIZE = 0x5000
+# the version and length in front of the NBT of a 3DS level.dat
+LEVEL_VERSION = 5
+BLANK_WORLD = Path(data.__path__[0]) / "blankworld"
+
+
+def random_block_data(seed: int, subchunks: int = 3) -> bytes:
+    "block data with stone at the bottom, random blocks above it and one biome"
+    rng = np.random.default_rng(seed)
+    ids = np.zeros((subchunks, 16, 16, 16), np.uint8)
+    data = np.zeros_like(ids)
+    ids[0] = 1
+    ids[1:, :, :, :8] = rng.choice([0, 1, 2, 3, 17], (subchunks - 1, 16, 16, 8))
+    data[1:, :, :, :8] = rng.integers(0, 2, (subchunks - 1, 16, 16, 8))
+    return encode_block_data(ids, data, np.full((16, 16), seed % 40, np.uint8))
+
+
+def write_world(path: Path, chunks: dict[tuple, bytes], name: str = "Test") -> Path:
+    "a 3DS world with the block data of each chunk, written by CDBWriter"
+    cdb_path = path / "db" / "cdb"
+    cdb_path.mkdir(parents=True)
+    (path / "db" / "vdb").mkdir()
+    writer = CDBWriter(cdb_path, SUBFILE_COUNT, SUBFILE_SIZE)
+    for position, raw in chunks.items():
+        writer.add(position, {0: raw})
+    writer.commit()
+    level = nbtlib.File(
+        {
+            "LevelName": nbtlib.String(name),
+            "SpawnX": nbtlib.Int(0),
+            "SpawnZ": nbtlib.Int(0),
+        }
+    )
+    level.save(path / "level.dat", byteorder="little")
+    buffer = (path / "level.dat").read_bytes()
+    (path / "level.dat").write_bytes(
+        struct.pack("<II", LEVEL_VERSION, len(buffer)) + buffer
+    )
+    return path
+
+
+@pytest.fixture
+def chunks() -> dict[tuple, bytes]:
+    "the block data of a few chunks in two regions and two dimensions"
+    positions = [(x, z, 0) for x in range(-2, 2) for z in range(-1, 2)]
+    positions += [(0, 0, 1), (1, 0, 1)]
+    return {
+        position: random_block_data(seed) for seed, position in enumerate(positions)
+    }
+
+
+@pytest.fixture
+def world_path(tmp_path: Path, chunks: dict[tuple, bytes]) -> Path:
+    return write_world(tmp_path / "world", chunks)
@@ -0,0 +1,52 @@
+import zipfile
+from pathlib import Path
+
+from mc3ds.classes import World
+from mc3ds.convert import convert
+from mc3ds.ls3ds import get_world_names
+
+from conftest import BLANK_WORLD
+
+
+def backup(world_path: Path, zip_path: Path) -> Path:
+    "a zip of the world laid out like a Checkpoint backup"
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        for path in sorted(world_path.rglob("*")):
+            name = (
+                Path("minecraftWorlds") / world_path.name / path.relative_to(world_path)
+            )
+            zip_file.write(path, name.as_posix())
+    return zip_path
+
+
+def test_archive_lists_the_same_worlds(tmp_path, world_path):
+    zip_path = backup(world_path, tmp_path / "backup.zip")
+    assert get_world_names(zip_path) == get_world_names(world_path.parent)
+    assert get_world_names(zip_path) == {"world": "Test"}
+
+
+def test_archive_reads_the_same_chunks(tmp_path, world_path, chunks):
+    zip_path = backup(world_path, tmp_path / "backup.zip")
+    with World(zip_path, world_id="world") as archived, World(world_path) as world:
+        assert archived.name == world.name
+        assert archived.entries.keys() == world.entries.keys() == chunks.keys()
+        for position, raw in chunks.items():
+            assert archived.entries[position].data_chunk.raw_decompressed == raw
+
+
+def test_archive_converts_like_the_folder(tmp_path, world_path):
+    zip_path = backup(world_path, tmp_path / "backup.zip")
+    outputs = {}
+    for name, path in (("folder", world_path), ("archive", zip_path)):
+        outputs[name] = tmp_path / name
+        with World(path, world_id="world") as world:
+            convert(world, BLANK_WORLD, outputs[name], interactive=False, workers=1)
+    folder = {
+        path.relative_to(outputs["folder"]): path.read_bytes()
+        for path in outputs["folder"].rglob("*.mca")
+    }
+    archive = {
+        path.relative_to(outputs["archive"]): path.read_bytes()
+        for path in outputs["archive"].rglob("*.mca")
+    }
+    assert folder and folder == archive
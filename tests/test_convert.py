@@ -0,0 +1,141 @@
+import numpy as np
+
+from mc3ds.classes import BlockArrays
+from mc3ds.convert import ChunkConverter, load_mappings, OVERWORLD, NETHER
+from mc3ds.lighting import BlockProperties, block_light, sky_light, pack_light
+from mc3ds.writer import encode_block_data
+
+STONE = (1, 0)
+WATER = (8, 0)
+FOREST = 4
+SAVANNA = 35
+# every numeric biome ID of Java Edition 1.16.5
+JAVA_BIOMES = (
+    set(range(51))
+    | {127}
+    | set(range(129, 135))
+    | {140, 149, 151}
+    | set(range(155, 159))
+    | set(range(160, 174))
+)
+# the biomes of Bedrock Edition, which the 3DS uses the IDs of
+BEDROCK_BIOMES = (
+    set(range(50))
+    | set(range(129, 135))
+    | {140, 149, 151}
+    | set(range(155, 159))
+    | set(range(160, 168))
+    | set(range(178, 182))
+)
+
+blocks, biomes, items = load_mappings()
+
+
+def unpack_heightmap(longs: list[int]) -> np.ndarray:
+    "the opposite of lighting.pack_heightmap, indexed [x][z]"
+    values = []
+    for value in longs:
+        for n in range(7):
+            values.append((value >> (n * 9)) & 0x1FF)
+    return np.array(values[:256]).reshape(16, 16).T
+
+
+def known_chunk(dimension: int = OVERWORLD) -> ChunkConverter:
+    "stone up to y 9, a column of water up to y 14 at x 0 z 0, forest at x < 8"
+    ids = np.zeros((1, 16, 16, 16), np.uint8)
+    data = np.zeros_like(ids)
+    ids[0, :, :, :10] = STONE[0]
+    ids[0, 0, 0, 10:15] = WATER[0]
+    chunk_biomes = np.full((16, 16), SAVANNA, np.uint8)
+    chunk_biomes[:, :8] = FOREST
+    raw = encode_block_data(ids, data, chunk_biomes)
+    converter = ChunkConverter(
+        (0, 0, dimension), BlockArrays(raw), blocks, None, biomes
+    )
+    converter.place_blocks()
+    converter.convert_biomes()
+    converter.compute_lighting()
+    return converter
+
+
+def test_every_3ds_biome_has_a_java_biome():
+    lookup, defaults = biomes
+    for dimension, default in defaults.items():
+        java = np.where(lookup < 0, default, lookup)
+        assert set(java.tolist()) <= JAVA_BIOMES
+    for biome in BEDROCK_BIOMES:
+        assert lookup[biome] in JAVA_BIOMES, f"3DS biome {biome:d} isn't mapped"
+
+
+def test_known_chunk_biomes():
+    chunk = known_chunk().chunk
+    cells = np.array(chunk.biomes).reshape(64, 4, 4)
+    # [y][z][x], one cell for every 4 blocks
+    assert (cells[:, :, :2] == FOREST).all()
+    assert (cells[:, :, 2:] == SAVANNA).all()
+
+
+def test_unknown_biomes_use_the_dimension_default():
+    lookup, defaults = biomes
+    ids = np.zeros((0, 16, 16, 16), np.uint8)
+    raw = encode_block_data(ids, ids, np.full((16, 16), 255, np.uint8))
+    converter = ChunkConverter((0, 0, NETHER), BlockArrays(raw), blocks, None, biomes)
+    converter.place_blocks()
+    converter.convert_biomes()
+    assert set(converter.chunk.biomes) == {defaults[NETHER]}
+
+
+def test_known_chunk_heightmaps():
+    heightmaps = known_chunk().chunk.heightmaps
+    motion_blocking = unpack_heightmap(heightmaps["MOTION_BLOCKING"])
+    ocean_floor = unpack_heightmap(heightmaps["OCEAN_FLOOR"])
+    world_surface = unpack_heightmap(heightmaps["WORLD_SURFACE"])
+    assert motion_blocking[0, 0] == 15
+    assert ocean_floor[0, 0] == 10
+    assert world_surface[0, 0] == 15
+    for heights in (motion_blocking, ocean_floor, world_surface):
+        assert (heights[1:] == 10).all() and (heights[:, 1:] == 10).all()
+
+
+def test_light_matches_lighting_the_whole_area():
+    "each chunk lit with its neighbours has the same light as the area lit at once"
+    properties = BlockProperties(blocks)
+    glowstone = next(
+        (block_id << 4) | data
+        for (block_id, data), block in blocks.items()
+        if block.id == "glowstone"
+    )
+    rng = np.random.default_rng(0)
+    chunks = {}
+    area = np.zeros((5 * 16, 5 * 16, 64), np.uint16)
+    for chunk_x in range(-2, 3):
+        for chunk_z in range(-2, 3):
+            keys = np.zeros((16, 16, 48), np.uint16)
+            keys[:, :, :32] = 1 << 4
+            keys[:, :, 32:40] = np.where(rng.random((16, 16, 8)) < 0.5, 1 << 4, 0)
+            keys[rng.random(keys.shape) < 0.01] = glowstone
+            chunks[(chunk_x, chunk_z)] = keys
+            x, z = (chunk_x + 2) * 16, (chunk_z + 2) * 16
+            area[x : x + 16, z : z + 16, :48] = keys
+    opacity = properties.opacity[area]
+    whole_block = block_light(opacity, properties.emission[area])
+    whole_sky = sky_light(opacity)
+    for chunk_x, chunk_z in ((0, 0), (1, 0), (-1, 1)):
+        converter = known_chunk()
+        converter.keys = chunks[(chunk_x, chunk_z)]
+        converter.compute_lighting(
+            {
+                (offset_x, offset_z): chunks[(chunk_x + offset_x, chunk_z + offset_z)]
+                for offset_x in (-1, 0, 1)
+                for offset_z in (-1, 0, 1)
+                if offset_x or offset_z
+            }
+        )
+        x, z = (chunk_x + 2) * 16, (chunk_z + 2) * 16
+        for section_y in range(64 // 16):
+            assert converter.chunk.block_light[section_y] == pack_light(
+                whole_block[x : x + 16, z : z + 16], section_y
+            )
+            assert converter.chunk.sky_light[section_y] == pack_light(
+                whole_sky[x : x + 16, z : z + 16], section_y
+            )
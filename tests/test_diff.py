@@ -0,0 +1,52 @@
+import shutil
+from pathlib import Path
+
+from mc3ds.classes import World
+from mc3ds.diff import diff_worlds
+from mc3ds.writer import ChunkWriteBatch
+
+from conftest import random_block_data
+
+
+def corrupt(world_path: Path, position: tuple) -> None:
+    "overwrites the middle of the compressed block data of a chunk"
+    with World(world_path) as world:
+        entry = world.entries[position]
+        [section_position] = [
+            section_position
+            for index, section_position, *sizes in entry.sections
+            if index == 0
+        ]
+        offset = world.cdb[entry.slot].subfile_offset(entry.subfile) + section_position
+        slot_path = world.cdb.get_file(entry.slot)
+    with open(slot_path, "r+b") as slot_file:
+        slot_file.seek(offset + 8)
+        slot_file.write(b"\xff" * 64)
+
+
+def test_diff_reports_modified_chunks(tmp_path, world_path):
+    new_path = shutil.copytree(world_path, tmp_path / "new")
+    with World(new_path) as world:
+        entry = world.entries[(1, 1, 0)]
+        slot, subfile = entry.slot, entry.subfile
+    batch = ChunkWriteBatch(new_path / "db" / "cdb")
+    batch.add(slot, subfile, {0: random_block_data(99)})
+    batch.commit()
+    with World(world_path) as old, World(new_path) as new:
+        report = diff_worlds(old, new)
+    assert not report["added"] and not report["removed"] and not report["unreadable"]
+    [chunk] = report["modified"]
+    assert chunk["position"] == (1, 1, 0)
+    assert chunk["sections"] == [0]
+    assert chunk["changed_voxels"] > 0
+
+
+def test_diff_reports_unreadable_chunks(tmp_path, world_path):
+    new_path = shutil.copytree(world_path, tmp_path / "new")
+    corrupt(new_path, (0, 0, 0))
+    with World(world_path) as old, World(new_path) as new:
+        report = diff_worlds(old, new)
+    assert not report["modified"]
+    [chunk] = report["unreadable"]
+    assert chunk["position"] == (0, 0, 0)
+    assert chunk["error"]
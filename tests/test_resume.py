@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import nbtlib
+import pytest
+
+from mc3ds import convert as convert_module
+from mc3ds.classes import World
+from mc3ds.convert import convert, index_hash
+from mc3ds.output import JOURNAL_NAME
+
+from conftest import BLANK_WORLD
+
+
+def convert_world(world_path: Path, world_out: Path, resume: bool = False) -> None:
+    with World(world_path) as world:
+        convert(
+            world, BLANK_WORLD, world_out, interactive=False, workers=1, resume=resume
+        )
+
+
+def regions(world_out: Path) -> dict[str, bytes]:
+    return {
+        path.relative_to(world_out).as_posix(): path.read_bytes()
+        for path in world_out.rglob("*.mca")
+    }
+
+
+def test_resume_only_converts_the_regions_left(tmp_path, world_path):
+    finished = tmp_path / "finished"
+    convert_world(world_path, finished)
+    expected = regions(finished)
+    world_out = tmp_path / "out"
+    convert_world(world_path, world_out)
+    # as if it stopped after the first region was saved
+    done, *left = sorted(expected)
+    for name in left:
+        (world_out / name).unlink()
+    (world_out / done).write_bytes(b"kept")
+    with World(world_path) as world:
+        (world_out / JOURNAL_NAME).write_text(
+            f"index {index_hash(world)}\nfilter None\n{done}\nDIM-1/reg"
+        )
+    convert_world(world_path, world_out, resume=True)
+    assert regions(world_out) == {**expected, done: b"kept"}
+    assert not (world_out / JOURNAL_NAME).exists()
+
+
+def test_resume_after_crashing_before_level_dat(monkeypatch, tmp_path, world_path):
+    def crash(*args) -> None:
+        raise OSError("crashed")
+
+    world_out = tmp_path / "out"
+    with monkeypatch.context() as patch:
+        patch.setattr(convert_module, "write_blank_world", crash)
+        with pytest.raises(OSError):
+            convert_world(world_path, world_out)
+    assert not (world_out / "level.dat").exists()
+    convert_world(world_path, world_out, resume=True)
+    finished = tmp_path / "finished"
+    convert_world(world_path, finished)
+    # gzip adds the time, so the NBT is compared
+    assert nbtlib.load(world_out / "level.dat") == nbtlib.load(finished / "level.dat")
+    assert regions(world_out) == regions(finished)
+    assert not (world_out / JOURNAL_NAME).exists()
+
+
+def test_resume_a_finished_world_does_nothing(tmp_path, world_path):
+    world_out = tmp_path / "out"
+    convert_world(world_path, world_out)
+    converted = regions(world_out)
+    (world_out / sorted(converted)[0]).unlink()
+    convert_world(world_path, world_out, resume=True)
+    assert len(regions(world_out)) == len(converted) - 1
@@ -0,0 +1,78 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+from mc3ds.classes import World
+from mc3ds.convert import convert
+from mc3ds.shard import MANIFEST_NAME, merge_shards
+
+from conftest import BLANK_WORLD
+
+SHARDS = 3
+
+
+def regions(world_out: Path) -> dict[str, bytes]:
+    return {
+        path.relative_to(world_out).as_posix(): path.read_bytes()
+        for path in world_out.rglob("*.mca")
+    }
+
+
+@pytest.fixture
+def shard_paths(tmp_path: Path, world_path: Path) -> list[Path]:
+    paths = []
+    with World(world_path) as world:
+        for index in range(SHARDS):
+            paths.append(tmp_path / f"shard{index:d}")
+            convert(
+                world,
+                BLANK_WORLD,
+                paths[-1],
+                interactive=False,
+                workers=1,
+                shard=(index, SHARDS),
+            )
+    return paths
+
+
+def test_shards_cover_every_region_once(tmp_path, world_path, shard_paths):
+    whole = tmp_path / "whole"
+    with World(world_path) as world:
+        convert(world, BLANK_WORLD, whole, interactive=False, workers=1)
+    expected = regions(whole)
+    seen = {}
+    for shard_path in shard_paths:
+        manifest = json.loads((shard_path / MANIFEST_NAME).read_text())
+        assert manifest["world_regions"] == len(expected)
+        assert set(manifest["regions"]) == regions(shard_path).keys()
+        for name in manifest["regions"]:
+            assert name not in seen
+            seen[name] = shard_path
+    assert seen.keys() == expected.keys()
+    merged = tmp_path / "merged"
+    assert merge_shards(shard_paths, merged) == len(expected)
+    assert regions(merged) == expected
+    assert (merged / "level.dat").is_file()
+    assert not (merged / MANIFEST_NAME).exists()
+
+
+def test_merge_needs_every_shard(tmp_path, shard_paths):
+    with pytest.raises(ValueError, match="missing"):
+        merge_shards(shard_paths[1:], tmp_path / "merged")
+
+
+def test_merge_refuses_different_chunk_options(tmp_path, shard_paths):
+    manifest_path = shard_paths[0] / MANIFEST_NAME
+    manifest = json.loads(manifest_path.read_text())
+    manifest["filter"] = "ChunkFilter(dimensions={0})"
+    manifest_path.write_text(json.dumps(manifest))
+    with pytest.raises(ValueError, match="chunk options"):
+        merge_shards(shard_paths, tmp_path / "merged")
+
+
+def test_merge_refuses_archives(tmp_path, shard_paths):
+    archive = Path(shutil.make_archive(tmp_path / "shard0", "zip", shard_paths[0]))
+    with pytest.raises(ValueError, match="isn't a folder"):
+        merge_shards([archive, *shard_paths[1:]], tmp_path / "merged")
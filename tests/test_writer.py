@@ -0,0 +1,126 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from mc3ds import writer
+from mc3ds.classes import World, index_path, parse_block_data, MAX_SUBCHUNKS
+from mc3ds.parser import parser
+from mc3ds.writer import (
+    CDBWriter,
+    ChunkWriteBatch,
+    JournalError,
+    recover_all,
+    encode_block_data,
+)
+
+from conftest import SUBFILE_COUNT, random_block_data
+
+
+def interrupt(monkeypatch: pytest.MonkeyPatch, batch: ChunkWriteBatch) -> None:
+    "commits the batch, but stops halfway through the first write to a slot file"
+
+    def partial_apply(slot_path: Path, runs: list[tuple[int, bytes]]) -> None:
+        offset, data = runs[0]
+        with open(slot_path, "r+b") as slot_file:
+            slot_file.seek(offset)
+            slot_file.write(data[: len(data) // 2])
+        raise OSError("interrupted")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(writer, "_apply", partial_apply)
+        with pytest.raises(OSError):
+            batch.commit()
+
+
+def rewrite_batch(world_path: Path, position: tuple, raw: bytes) -> ChunkWriteBatch:
+    with World(world_path) as world:
+        entry = world.entries[position]
+        slot, subfile = entry.slot, entry.subfile
+    batch = ChunkWriteBatch(world_path / "db" / "cdb")
+    batch.add(slot, subfile, {0: raw})
+    return batch
+
+
+def test_interrupted_write_is_rolled_back(monkeypatch, world_path):
+    cdb_path = world_path / "db" / "cdb"
+    before = {path.name: path.read_bytes() for path in cdb_path.glob("slt*.cdb")}
+    interrupt(monkeypatch, rewrite_batch(world_path, (0, 0, 0), random_block_data(99)))
+    with pytest.raises(JournalError):
+        ChunkWriteBatch(cdb_path)
+    assert recover_all(cdb_path)
+    after = {path.name: path.read_bytes() for path in cdb_path.glob("slt*.cdb")}
+    assert after == before
+    assert not recover_all(cdb_path)
+    ChunkWriteBatch(cdb_path)
+
+
+def test_interrupted_write_can_be_finished(monkeypatch, tmp_path, world_path, chunks):
+    new = random_block_data(99)
+    finished = shutil.copytree(world_path, tmp_path / "finished")
+    rewrite_batch(finished, (0, 0, 0), new).commit()
+    interrupt(monkeypatch, rewrite_batch(world_path, (0, 0, 0), new))
+    cdb_path = world_path / "db" / "cdb"
+    assert recover_all(cdb_path, finish=True)
+    for path in cdb_path.glob("slt*.cdb"):
+        assert path.read_bytes() == (finished / "db" / "cdb" / path.name).read_bytes()
+    with World(world_path) as world:
+        assert world.entries[(0, 0, 0)].data_chunk.raw_decompressed == new
+        assert world.entries[(1, 0, 0)].data_chunk.raw_decompressed == chunks[(1, 0, 0)]
+
+
+def test_written_world_reads_back(world_path, chunks):
+    with World(world_path) as world:
+        assert world.entries.keys() == chunks.keys()
+        for position, raw in chunks.items():
+            entry = world.entries[position]
+            assert entry.position == position
+            assert entry.data_chunk.raw_decompressed == raw
+
+
+def test_commit_adds_replaces_and_removes_chunks(world_path, chunks):
+    cdb_path = world_path / "db" / "cdb"
+    with open(index_path(cdb_path), "rb") as index_file:
+        pointers = [pointer.unknown for pointer in parser.Index(index_file).pointers]
+    slot_count = len(list(cdb_path.glob("slt*.cdb")))
+    new_chunks = dict(chunks)
+    cdb_writer = CDBWriter(cdb_path)
+    # enough new chunks that another slot file is needed
+    for x in range(SUBFILE_COUNT):
+        new_chunks[(x, 5, 0)] = random_block_data(100 + x)
+        cdb_writer.add((x, 5, 0), {0: new_chunks[(x, 5, 0)]})
+    new_chunks[(0, 0, 0)] = random_block_data(99)
+    cdb_writer.add((0, 0, 0), {0: new_chunks[(0, 0, 0)]})
+    cdb_writer.remove((1, 1, 0))
+    del new_chunks[(1, 1, 0)]
+    cdb_writer.commit()
+    assert len(list(cdb_path.glob("slt*.cdb"))) > slot_count
+    with open(index_path(cdb_path), "rb") as index_file:
+        assert [pointer.unknown for pointer in parser.Index(index_file).pointers] == (
+            pointers
+        )
+    with World(world_path) as world:
+        assert world.entries.keys() == new_chunks.keys()
+        for position, raw in new_chunks.items():
+            assert world.entries[position].data_chunk.raw_decompressed == raw
+
+
+def test_encoded_block_data_parses():
+    rng = np.random.default_rng(0)
+    ids = rng.integers(0, 256, (MAX_SUBCHUNKS, 16, 16, 16), np.uint8)
+    data = rng.integers(0, 16, ids.shape, np.uint8)
+    # all air, so it's left out
+    ids[-2:] = data[-2:] = 0
+    biomes = rng.integers(0, 256, (16, 16), np.uint8)
+    unknown0 = rng.integers(0, 1 << 16, (16, 16), np.uint16)
+    parsed = parse_block_data(encode_block_data(ids, data, biomes, unknown0))
+    assert parsed.subchunkCount == MAX_SUBCHUNKS - 2
+    for subchunk, subchunk_ids, subchunk_data in zip(parsed.subchunks, ids, data):
+        assert (np.array(subchunk.blocks, np.uint8) == subchunk_ids).all()
+        nibbles = np.array(subchunk.blockData, np.uint8)
+        assert (nibbles & 0xF == subchunk_data.reshape(-1)[0::2]).all()
+        assert (nibbles >> 4 == subchunk_data.reshape(-1)[1::2]).all()
+        assert not np.array(subchunk.unknownBlockData).any()
+    assert (np.array(parsed.unknown0) == unknown0).all()
+    assert (np.array(parsed.biomes) == biomes).all()